@@ -0,0 +1,479 @@
+#-----------------------------------------------------------------------------
+# AsyncNIH_NCBI.py:
+# asyncio variant of the NIH_NCBI API. It provides the same public methods as
+# coroutines, so that many requests can be in flight at once, e.g.
+#
+#   async with AsyncNIH_NCBI() as NN:
+#       records = await asyncio.gather(*[NN.getCitedBy('pm_id', id) for id in ids])
+#
+# Requests share the rate limiter and the response cache with NIH_NCBI, and
+# the number of requests in flight is limited per host.
+#-----------------------------------------------------------------------------
+
+import json
+import asyncio
+import aiohttp
+import urllib.parse as urlparser
+
+from ExternalAPIs.NIH_NCBI import NIH_NCBI
+from ExternalAPIs.http_cache import getSharedHTTPCache, buildResponse
+from ExternalAPIs.http_client import HTTP_STATS, RETRY_STATUS_CODES, parseRetryAfter
+from ExternalAPIs.rate_limiter import getSharedRateLimiter
+
+class AsyncNIH_NCBI(NIH_NCBI):
+
+    #----------------------------------------------------
+    # __init__:
+    # 'api_key', 'rate_limiter', 'cache' and 'crosswalk' are the same as for NIH_NCBI.
+    # 'host_concurrency' maps a host to the maximum number of requests in flight to
+    # that host. By default, a host with a rate limit gets as many requests in
+    # flight as it allows per second, and other hosts get 'default_concurrency'.
+    # 'max_retries', 'backoff' and 'connection_retries' are the same as for
+    # HTTPClient. Every public method of NIH_NCBI that sends requests is overridden
+    # by a coroutine; only the parsing helpers are inherited.
+    #----------------------------------------------------
+    def __init__(self, api_key=None, rate_limiter=None, cache=None, crosswalk=None, host_concurrency=None,
+                 default_concurrency=10, max_retries=5, backoff=1.0, connection_retries=2):
+        self._rate_limiter = rate_limiter or getSharedRateLimiter()
+
+        if cache is None:
+            cache = getSharedHTTPCache()
+        self._cache = cache or None
+
+        super().__init__(api_key, self._rate_limiter, self._cache or False, crosswalk)
+        self._http = None # every request goes through the aiohttp session
+
+        self._host_concurrency    = dict(host_concurrency or {})
+        self._default_concurrency = default_concurrency
+        self._max_retries         = max_retries
+        self._backoff             = backoff
+        self._connection_retries  = connection_retries
+
+        self._session    = None
+        self._semaphores = {}
+        self._tasks      = set() # background revalidations
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    #----------------------------------------------------
+    # close:
+    # Close the pooled connections. Must be called (or the client used as an async
+    # context manager) once the client is no longer needed.
+    #----------------------------------------------------
+    async def close(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    #----------------------------------------------------
+    # _getSession:
+    # aiohttp session with a pooled connector, created on first use so that it
+    # belongs to the running event loop.
+    #----------------------------------------------------
+    def _getSession(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._default_concurrency * 4)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    #----------------------------------------------------
+    # _getSemaphore:
+    # Semaphore limiting the number of requests in flight to 'host'.
+    #----------------------------------------------------
+    def _getSemaphore(self, host):
+        if host not in self._semaphores:
+            limit = self._host_concurrency.get(host)
+            if limit is None:
+                rate  = self._rate_limiter.getRate(host)
+                limit = max(1, int(rate)) if rate is not None else self._default_concurrency
+            self._semaphores[host] = asyncio.Semaphore(limit)
+        return self._semaphores[host]
+
+    #----------------------------------------------------
+    # _request:
+    # Send an HTTP request and return it as a requests.Response, so that the parsing
+    # code of NIH_NCBI can be reused. Cached responses are returned without
+    # sending the request. Requests rejected with HTTP 429 (or a temporary 5xx
+    # error), or whose connection fails or times out, are retried with backoff,
+    # as in HTTPClient. 'use_cache=False' bypasses the cache. The SQLite cache and
+    # the rate limiter (which may lock a shared state file) are used from a worker
+    # thread, so that they do not block the event loop.
+    #----------------------------------------------------
+    async def _request(self, method, url, params=None, data=None, headers=None, use_cache=True):
+        key = None
+        if (self._cache is not None and use_cache):
+            key = self._cache.requestKey(method, url, params=params, data=data)
+            resp, is_fresh = await asyncio.to_thread(self._cache.get, key)
+            if resp is not None:
+                host = urlparser.urlsplit(url).hostname
+                HTTP_STATS.record(host, 'cache_hits')
+                if not is_fresh:
+                    HTTP_STATS.record(host, 'stale_hits')
+                    self._revalidate(key, method, url, params, data, headers)
+                return resp
+
+        return await self._send(key, method, url, params, data, headers)
+
+    #----------------------------------------------------
+    # _revalidate:
+    # Refresh an expired cache entry in a background task. The task is kept until
+    # it is done, and cancelled by close().
+    #----------------------------------------------------
+    def _revalidate(self, key, method, url, params, data, headers):
+        async def revalidate():
+            try:
+                await self._send(key, method, url, params, data, headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass # keep serving the stale response
+
+        task = asyncio.get_running_loop().create_task(revalidate())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key, method, url, params, data, headers):
+        host = urlparser.urlsplit(url).hostname
+
+        async with self._getSemaphore(host):
+            attempt = 0
+            while True:
+                wait = await asyncio.to_thread(self._rate_limiter.reserve, host)
+                if (wait > 0):
+                    await asyncio.sleep(wait)
+
+                try:
+                    async with self._getSession().request(method, url, params=self._queryItems(params), data=data, headers=headers) as aresp:
+                        content = await aresp.read()
+                        resp    = buildResponse(str(aresp.url), aresp.status, dict(aresp.headers), content)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    HTTP_STATS.record(host, 'requests')
+                    if (attempt >= min(self._max_retries, self._connection_retries)):
+                        raise
+
+                    # Only this request waits, as the other ones may get through
+                    await asyncio.sleep(self._backoff * (2 ** attempt))
+                    HTTP_STATS.record(host, 'retries')
+                    attempt += 1
+                    continue
+                HTTP_STATS.record(host, 'requests')
+
+                if (resp.status_code not in RETRY_STATUS_CODES or attempt >= self._max_retries):
+                    break
+
+                delay = parseRetryAfter(resp.headers.get('Retry-After'))
+                if delay is None:
+                    delay = self._backoff * (2 ** attempt)
+
+                # Pause every request to this host, not only this one
+                await asyncio.to_thread(self._rate_limiter.block, host, delay)
+                HTTP_STATS.record(host, 'retries')
+                attempt += 1
+
+        if (key is not None and resp.status_code == 200):
+            await asyncio.to_thread(self._cache.set, key, resp)
+        return resp
+
+    #----------------------------------------------------
+    # _queryItems:
+    # Query parameters as a list of (name, value), repeating the parameters whose
+    # value is a list (as requests does).
+    #----------------------------------------------------
+    def _queryItems(self, params):
+        if params is None:
+            return None
+
+        items = []
+        for name, value in params.items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            items.extend((name, str(v)) for v in values)
+        return items
+
+    #----------------------------------------------------
+    # _getEutils:
+    # Send a GET request to the NCBI eutils 'tool' with the given query parameters.
+    # Requests using the history server are not cached.
+    #----------------------------------------------------
+    async def _getEutils(self, tool, params):
+        params = dict(params)
+        if self._api_key:
+            params['api_key'] = self._api_key
+
+        use_cache = (params.get('usehistory') != 'y' and 'WebEnv' not in params)
+        return await self._request('GET', f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/{tool}.fcgi', params=params, use_cache=use_cache)
+
+    #----------------------------------------------------
+    # getPublicationsBatch:
+    # See NIH_NCBI.getPublicationsBatch. The esummary requests of the batches are
+    # sent concurrently.
+    #----------------------------------------------------
+    async def getPublicationsBatch(self, db, ids):
+        ids     = list(dict.fromkeys(str(id) for id in ids))
+        batches = [ids[start:start + self._ESUMMARY_BATCH_SIZE] for start in range(0, len(ids), self._ESUMMARY_BATCH_SIZE)]
+
+        responses = await asyncio.gather(*[
+            self._getEutils('esummary', {'db': db, 'retmode': 'json', 'id': ','.join(batch)})
+            for batch in batches
+        ])
+
+        records = {}
+        for resp in responses:
+            if (resp.status_code == 200):
+                records.update(self._parseESummaryResult(json.loads(resp.content)))
+
+        await asyncio.to_thread(self._addToCrosswalk, db, records)
+        return records
+
+    #----------------------------------------------------
+    # convertIds:
+    # See NIH_NCBI.convertIds.
+    #----------------------------------------------------
+    async def convertIds(self, id_type, ids):
+        ids = list(dict.fromkeys(str(id) for id in ids))
+
+        converted = await asyncio.to_thread(self._lookupCrosswalk, id_type, ids)
+        converted.update(await self._requestIDConv(id_type, [id for id in ids if id not in converted]))
+        return converted
+
+    #----------------------------------------------------
+    # getDOIs:
+    # See NIH_NCBI.getDOIs.
+    #----------------------------------------------------
+    async def getDOIs(self, id_type, ids):
+        dois, missing = await asyncio.to_thread(self._knownDOIs, id_type, ids)
+
+        if missing:
+            for id, entry in (await self._requestIDConv(id_type, missing)).items():
+                if entry['doi']:
+                    dois[id] = entry['doi']
+            missing = [id for id in missing if id not in dois]
+
+        if missing:
+            records = await self.getPublicationsBatch(self._ID_TYPE_DB[id_type], missing)
+            for id in missing:
+                dois[id] = records.get(id, {}).get('doi')
+
+        return dois
+
+    async def _requestIDConv(self, id_type, ids):
+        batches   = [ids[start:start + self._IDCONV_BATCH_SIZE] for start in range(0, len(ids), self._IDCONV_BATCH_SIZE)]
+        responses = await asyncio.gather(*[
+            self._request('GET', 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/', params=self._generateIDConvParams(id_type, batch))
+            for batch in batches
+        ])
+
+        converted = {}
+        for batch, resp in zip(batches, responses):
+            if (resp.status_code == 200):
+                converted.update(self._parseIDConvResult(id_type, batch, json.loads(resp.content)))
+
+        if self._crosswalk is not None:
+            await asyncio.to_thread(self._crosswalk.addMany, list(converted.values()))
+        return converted
+
+    async def _getPublicationFromPubmed(self, pm_id):
+        return (await self.getPublicationsBatch('pubmed', [pm_id])).get(str(pm_id), {})
+
+    async def _getPublicationFromPMC(self, pmc_id):
+        return (await self.getPublicationsBatch('pmc', [pmc_id])).get(str(pmc_id), {})
+
+    #----------------------------------------------------
+    # getCitedBy:
+    # See NIH_NCBI.getCitedBy.
+    #----------------------------------------------------
+    async def getCitedBy(self, id_type, id):
+        return (await self.getCitedByMany(id_type, [id])).get(str(id), {})
+
+    #----------------------------------------------------
+    # getCitedByMany:
+    # See NIH_NCBI.getCitedByMany.
+    #----------------------------------------------------
+    async def getCitedByMany(self, id_type, ids):
+        return await self._getCitedByMany(id_type, ids)
+
+    async def _getCitedByMany(self, id_type, ids):
+        citing_ids = await self.getCitingIdsMany(id_type, ids)
+
+        to_fetch = {}
+        for links in citing_ids.values():
+            for dbto, cited_id in links:
+                to_fetch.setdefault(dbto, []).append(cited_id)
+
+        dbs     = list(to_fetch)
+        fetched = await asyncio.gather(*[self.getPublicationsBatch(dbto, to_fetch[dbto]) for dbto in dbs])
+
+        return self._assembleCitedBy(citing_ids, dict(zip(dbs, fetched)))
+
+    #----------------------------------------------------
+    # getNewCitedByMany:
+    # See NIH_NCBI.getNewCitedByMany.
+    #----------------------------------------------------
+    async def getNewCitedByMany(self, id_type, ids, isKnown):
+        citing_ids      = await self.getCitingIdsMany(id_type, ids)
+        known, to_fetch = await asyncio.to_thread(self._splitKnownCiters, citing_ids, isKnown)
+
+        dbs     = list(to_fetch)
+        fetched = await asyncio.gather(*[self.getPublicationsBatch(dbto, to_fetch[dbto]) for dbto in dbs])
+
+        return self._assembleNewCitedBy(citing_ids, dict(zip(dbs, fetched)), known)
+
+    #----------------------------------------------------
+    # getCitingIdsMany:
+    # See NIH_NCBI.getCitingIdsMany. The elink requests are sent concurrently.
+    #----------------------------------------------------
+    async def getCitingIdsMany(self, id_type, ids):
+        ids     = list(dict.fromkeys(str(id) for id in ids))
+        batches = [ids[start:start + self._ELINK_BATCH_SIZE] for start in range(0, len(ids), self._ELINK_BATCH_SIZE)]
+
+        responses = await asyncio.gather(*[
+            self._getEutils('elink', {'dbfrom': 'pubmed', 'linkname': linkname, 'retmode': 'json', 'id': batch})
+            for linkname in self._citedByLinknames(id_type)
+            for batch in batches
+        ])
+
+        citing_ids = {id: [] for id in ids}
+        for resp in responses:
+            if (resp.status_code != 200):
+                continue
+
+            for source_id, links in self._parseELinkSets(json.loads(resp.content)).items():
+                if source_id in citing_ids:
+                    citing_ids[source_id].extend(links)
+
+        return citing_ids
+
+    #----------------------------------------------------
+    # getProjectFundingDetails:
+    # See NIH_NCBI.getProjectFundingDetails.
+    #----------------------------------------------------
+    async def getProjectFundingDetails(self, project_no):
+        return await self._getProjectFundingDetails(project_no)
+
+    async def _getProjectFundingDetails(self, project_no):
+        resp = await self._postFundingDetails(self._generateFundingDetailsPayload(project_no))
+
+        if (resp.status_code == 200):
+            return json.loads(resp.content)
+        return {}
+
+    #----------------------------------------------------
+    # getProjectFundingDetailsMany:
+    # See NIH_NCBI.getProjectFundingDetailsMany. The batches are retrieved
+    # concurrently, and the pages of each batch one after the other.
+    #----------------------------------------------------
+    async def getProjectFundingDetailsMany(self, project_nums):
+        return await self._getProjectFundingDetailsMany(project_nums)
+
+    async def _getProjectFundingDetailsMany(self, project_nums):
+        project_nums = list(dict.fromkeys(p for p in project_nums if p))
+        records      = {project_no: {} for project_no in project_nums}
+
+        async def retrieveBatch(batch):
+            offset = 0
+            while True:
+                resp = await self._postFundingDetails(self._generateFundingDetailsPayload(batch, offset, self._REPORTER_PAGE_SIZE))
+                if (resp.status_code != 200):
+                    return
+
+                jsonData = json.loads(resp.content)
+                self._assignSubProjects(records, batch, jsonData)
+
+                offset += len(jsonData['results'])
+                if (len(jsonData['results']) == 0 or offset >= jsonData['meta']['total']):
+                    return
+
+        await asyncio.gather(*[
+            retrieveBatch(project_nums[start:start + self._REPORTER_BATCH_SIZE])
+            for start in range(0, len(project_nums), self._REPORTER_BATCH_SIZE)
+        ])
+        return records
+
+    async def _postFundingDetails(self, payload):
+        return await self._request(
+            'POST', 'https://api.reporter.nih.gov/v1/projects/Search/',
+            data=payload, headers={'Content-Type': 'application/json'},
+        )
+
+    #----------------------------------------------------
+    # getPublications:
+    # See NIH_NCBI.getPublications.
+    #----------------------------------------------------
+    async def getPublications(self, appl_id):
+        return await self._getPublications(appl_id)
+
+    async def _getPublications(self, appl_id):
+        resp = await self._request('GET', f'https://reporter.nih.gov/services/Projects/Publications?projectId={str(appl_id)}')
+
+        if (resp.status_code != 200):
+            return {}
+
+        jsonPub = json.loads(resp.content)
+        dois    = await self.getDOIs('pm_id', [pub['pm_id'] for pub in jsonPub['results']])
+        return self._generatePublicationRecords(jsonPub, dois)
+
+    #----------------------------------------------------
+    # getPublicationWithSearchTerm:
+    # See NIH_NCBI.getPublicationWithSearchTerm.
+    #----------------------------------------------------
+    async def getPublicationWithSearchTerm(self, search_term):
+        return {doi: pub async for doi, pub in self.iterPublicationsWithSearchTerm(search_term)}
+
+    #----------------------------------------------------
+    # iterPublicationsWithSearchTerm:
+    # See NIH_NCBI.iterPublicationsWithSearchTerm. The esummary requests are sent
+    # concurrently, and their records are yielded in the order they arrive.
+    #----------------------------------------------------
+    async def iterPublicationsWithSearchTerm(self, search_term, page_size=None):
+        resp = await self._getEutils('esearch', {'db': 'pmc', 'retmode': 'json', 'term': str(search_term), 'retmax': self._ESEARCH_MAX_IDS})
+        resp.raise_for_status()
+
+        count, ids = self._parseESearchIds(json.loads(resp.content))
+        if (count > len(ids)):
+            async for doi, pub in self._iterHistorySearch(search_term, page_size):
+                yield doi, pub
+            return
+
+        pages = [
+            self._getEutils('esummary', {'db': 'pmc', 'retmode': 'json', 'id': ','.join(ids[start:start + self._ESUMMARY_BATCH_SIZE])})
+            for start in range(0, len(ids), self._ESUMMARY_BATCH_SIZE)
+        ]
+        for page in asyncio.as_completed(pages):
+            resp = await page
+            resp.raise_for_status()
+
+            records = self._parseESummaryResult(json.loads(resp.content))
+            await asyncio.to_thread(self._addToCrosswalk, 'pmc', records)
+            for doi, pub in self._recordsWithDOI(records).items():
+                yield doi, pub
+
+    #----------------------------------------------------
+    # _iterHistorySearch:
+    # See NIH_NCBI._iterHistorySearch. All the pages are requested concurrently.
+    #----------------------------------------------------
+    async def _iterHistorySearch(self, search_term, page_size=None):
+        page_size = page_size or self._HISTORY_PAGE_SIZE
+
+        resp = await self._getEutils('esearch', {'db': 'pmc', 'retmode': 'json', 'term': str(search_term), 'usehistory': 'y', 'retmax': 0})
+        resp.raise_for_status()
+
+        count, history = self._parseESearchHistory(json.loads(resp.content))
+
+        pages = [
+            self._getEutils('esummary', {'db': 'pmc', 'retmode': 'json', 'retstart': retstart, 'retmax': page_size, **history})
+            for retstart in range(0, count, page_size)
+        ]
+        for page in asyncio.as_completed(pages):
+            resp = await page
+            resp.raise_for_status()
+
+            records = self._parseESummaryResult(json.loads(resp.content))
+            await asyncio.to_thread(self._addToCrosswalk, 'pmc', records)
+            for doi, pub in self._recordsWithDOI(records).items():
+                yield doi, pub
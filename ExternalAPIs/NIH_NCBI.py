@@ -6,37 +6,101 @@
 # Date  : 16/07/2021
 #-----------------------------------------------------------------------------
 
-import time
 import json
-import requests
-import urllib.parse as urlparser
 from requests.structures import CaseInsensitiveDict
 
+from ExternalAPIs.http_cache import getSharedHTTPCache
+from ExternalAPIs.http_client import HTTPClient
+from ExternalAPIs.id_crosswalk import getSharedIDCrosswalk, normalizeId
+from ExternalAPIs.rate_limiter import applyNCBIRates, getSharedRateLimiter
+from ExternalAPIs.single_flight import SingleFlight
+
 class NIH_NCBI:
 
-    __NIH_timestamp = None  # can post only 1 request per second
-    __NCBI_timestamp = None # can post only 3 requests per second
+    _ESUMMARY_BATCH_SIZE = 200 # maximum number of ids sent in one esummary request
+    _HISTORY_PAGE_SIZE   = 500 # number of summaries fetched at once from the history server
+    _ESEARCH_MAX_IDS     = 10000 # maximum number of ids returned by a plain esearch
+    _ELINK_BATCH_SIZE    = 200 # maximum number of ids sent in one elink request
+    _REPORTER_BATCH_SIZE = 50  # number of award numbers sent in one NIH reporter search
+    _REPORTER_PAGE_SIZE  = 500 # maximum number of results in one NIH reporter page
+    _IDCONV_BATCH_SIZE   = 200 # maximum number of ids sent in one NCBI ID converter request
+
+    _ID_TYPE_DB     = {'pm_id': 'pubmed', 'pmc_id': 'pmc'}
+    _DB_ID_TYPE     = {'pubmed': 'pm_id', 'pmc': 'pmc_id'}
+    _ID_TYPE_IDCONV = {'pm_id': 'pmid', 'pmc_id': 'pmcid', 'doi': 'doi'}
+
+    #----------------------------------------------------
+    # __init__:
+    # 'api_key' is an optional NCBI API key, which raises the NCBI rate limit from
+    # 3 to 10 requests per second. By default all the instances share the rate
+    # limiter of the process (see rate_limiter.py), so they can be used from
+    # several threads without exceeding the limits of the API providers.
+    # Responses are kept in the on-disk cache of the process (see http_cache.py)
+    # unless another HTTPCache is given, or 'cache' is False. Likewise, the
+    # identifiers of the publications are kept in the crosswalk of the process
+    # (see id_crosswalk.py) unless another IDCrosswalk is given, or 'crosswalk' is False.
+    # Identical calls made through the same instance share one result (see
+    # getDedupStats), so an instance should last for one run.
+    #----------------------------------------------------
+    def __init__(self, api_key=None, rate_limiter=None, cache=None, crosswalk=None):
+        self._api_key = api_key
+        self._single_flight = SingleFlight()
+
+        if crosswalk is None:
+            crosswalk = getSharedIDCrosswalk()
+        self._crosswalk = crosswalk or None
 
+        rate_limiter = rate_limiter or getSharedRateLimiter()
+        applyNCBIRates(rate_limiter, api_key)
+
+        if cache is None:
+            cache = getSharedHTTPCache()
+        self._http = HTTPClient(rate_limiter, cache=cache or None)
+
+    #----------------------------------------------------
+    # getDedupStats:
+    # Number of calls to each coalesced method ('getCitedBy', 'getProjectFundingDetails',
+    # 'getProjectFundingDetailsMany', 'getPublications', 'getPublicationWithSearchTerm'),
+    # counted per id for the bulk methods, since the instance was created
+    # or resetDedup was called: 'calls' made, calls 'executed', and calls answered by
+    # an identical completed call ('hits') or call in flight ('waits').
     #----------------------------------------------------
-    # __maintainRequestFrequency:
-    # This function maintains the request frequency specified by the API providers by
-    # pausing the execution.
+    def getDedupStats(self):
+        return self._single_flight.getStats()
+
+    #----------------------------------------------------
+    # resetDedup:
+    # Forget the results of the completed calls and reset the counters, e.g. at the
+    # start of a new run.
     #----------------------------------------------------
-    def __maintainRequestFrequency (self, timestamp, request_per_second):
-        seconds_per_request = 1 / request_per_second
-        if (timestamp != None):
-            dt = time.time() - timestamp
-            if (dt < seconds_per_request):
-                time.sleep(seconds_per_request - dt)
-        return time.time()
+    def resetDedup(self):
+        self._single_flight.reset()
+
+    #----------------------------------------------------
+    # _getEutils:
+    # Send a GET request to the NCBI eutils 'tool' (e.g. 'esummary') with the given
+    # query parameters, adding the API key if there is one. Requests using the
+    # history server are not cached, as their WebEnv expires after a few hours.
+    #----------------------------------------------------
+    def _getEutils(self, tool, params):
+        params = dict(params)
+        if self._api_key:
+            params['api_key'] = self._api_key
+
+        use_cache = (params.get('usehistory') != 'y' and 'WebEnv' not in params)
+        return self._http.get(f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/{tool}.fcgi', params=params, use_cache=use_cache)
 
     #----------------------------------------------------
     # _generateFundingDetailsPayload:
     # Given a project number, this private function generates a POST payload to be 
-    # sent to the NIH reporter.
+    # sent to the NIH reporter. 'offset' and 'limit' select a page of the results.
     #----------------------------------------------------
-    def _generateFundingDetailsPayload(self, project_no):
+    def _generateFundingDetailsPayload(self, project_no, offset=None, limit=None):
         data = {'criteria': {'project_nums': project_no}}
+        if offset is not None:
+            data['offset'] = offset
+        if limit is not None:
+            data['limit'] = limit
         return json.dumps(data)
     
     #----------------------------------------------------
@@ -62,44 +126,197 @@ class NIH_NCBI:
         return data
 
     #----------------------------------------------------
-    # _getPublicationFromPubmed:
-    # Retrieve information about a publication using pm_id from NCBI eutils
+    # getPublicationsBatch:
+    # Retrieve information about many publications from NCBI eutils with as few
+    # requests as possible. 'db' is 'pubmed' or 'pmc', and 'ids' is a list of
+    # pm_ids or pmc_ids respectively. Up to _ESUMMARY_BATCH_SIZE ids are sent in a
+    # single esummary call. Returns a dict of the records keyed by the id (as a string).
+    # Ids without a summary are left out of the result.
     #----------------------------------------------------
-    def _getPublicationFromPubmed(self, pm_id):
-        self.__NCBI_timestamp = self.__maintainRequestFrequency(self.__NCBI_timestamp, 1)
-        resp = requests.get(
-            f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=pubmed&retmode=json&id={str(pm_id)}'
-        )
+    def getPublicationsBatch(self, db, ids):
+        ids = list(dict.fromkeys(str(id) for id in ids)) # remove duplicates, keep order
 
+        records = {}
+        for start in range(0, len(ids), self._ESUMMARY_BATCH_SIZE):
+            batch = ids[start:start + self._ESUMMARY_BATCH_SIZE]
 
-        record = {}
-        if (resp.status_code == 200):
-            jsonData = json.loads(resp.content)
+            resp = self._getEutils('esummary', {'db': db, 'retmode': 'json', 'id': ','.join(batch)})
 
-            if (len(jsonData['result']['uids']) > 0):
-                record = self._generateNCBIpublicationRecord(jsonData['result'][str(pm_id)])
+            if (resp.status_code != 200):
+                continue
 
-        return record
+            records.update(self._parseESummaryResult(json.loads(resp.content)))
+
+        self._addToCrosswalk(db, records)
+        return records
 
     #----------------------------------------------------
-    # _getPublicationFromPMC:
-    # Retrieve information about a publication from PMC using the pmc_id from NCBI eutils
+    # _addToCrosswalk:
+    # Record the identifiers of esummary records ('db' is 'pubmed' or 'pmc', and the
+    # records are keyed by their id in 'db') in the crosswalk.
     #----------------------------------------------------
-    def _getPublicationFromPMC(self, pmc_id):
-        self.__NCBI_timestamp = self.__maintainRequestFrequency(self.__NCBI_timestamp, 1)
-        resp = requests.get(
-            f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=pmc&retmode=json&id={str(pmc_id)}'
-        )
+    def _addToCrosswalk(self, db, records):
+        if self._crosswalk is None:
+            return
+
+        entries = []
+        for uid, record in records.items():
+            if (db == 'pubmed'):
+                entries.append({'pm_id': uid, 'pmc_id': record.get('pmc'), 'doi': record.get('doi'), 'complete': True})
+            elif (db == 'pmc'):
+                entries.append({'pm_id': record.get('pmid'), 'pmc_id': uid, 'doi': record.get('doi'), 'complete': True})
+        self._crosswalk.addMany(entries)
 
+    #----------------------------------------------------
+    # convertIds:
+    # Convert ids of type 'id_type' ('pm_id', 'pmc_id' or 'doi') to the other
+    # identifiers of the publications. The crosswalk is consulted first, and the
+    # remaining ids are sent to the NCBI ID converter, _IDCONV_BATCH_SIZE at a time.
+    # Returns a dict keyed by the given ids, where each value is a dict with 'pm_id',
+    # 'pmc_id' and 'doi' (None when unknown). Ids NCBI doesn't know are left out.
+    #----------------------------------------------------
+    def convertIds(self, id_type, ids):
+        ids = list(dict.fromkeys(str(id) for id in ids))
 
-        record = {}
-        if (resp.status_code == 200):
-            jsonData = json.loads(resp.content)
+        converted = self._lookupCrosswalk(id_type, ids)
+        converted.update(self._requestIDConv(id_type, [id for id in ids if id not in converted]))
+        return converted
+
+    #----------------------------------------------------
+    # getDOIs:
+    # Return the doi (or None if there is none) of each of the given ids of type
+    # 'id_type' ('pm_id' or 'pmc_id'), as a dict keyed by the given ids. The crosswalk
+    # is consulted first, then the NCBI ID converter, and the remaining ids are
+    # looked up with batched esummary requests.
+    #----------------------------------------------------
+    def getDOIs(self, id_type, ids):
+        dois, missing = self._knownDOIs(id_type, ids)
 
-            if (len(jsonData['result']['uids']) > 0):
-                record = self._generateNCBIpublicationRecord(jsonData['result'][str(pmc_id)])
+        if missing:
+            for id, entry in self._requestIDConv(id_type, missing).items():
+                if entry['doi']:
+                    dois[id] = entry['doi']
+            missing = [id for id in missing if id not in dois]
 
-        return record
+        if missing:
+            records = self.getPublicationsBatch(self._ID_TYPE_DB[id_type], missing)
+            for id in missing:
+                dois[id] = records.get(id, {}).get('doi')
+
+        return dois
+
+    #----------------------------------------------------
+    # _knownDOIs:
+    # Split the given ids into a dict of the dois known from the crosswalk, and a
+    # list of the ids that have to be looked up.
+    #----------------------------------------------------
+    def _knownDOIs(self, id_type, ids):
+        ids   = list(dict.fromkeys(str(id) for id in ids))
+        known = self._crosswalk.lookupMany(id_type, ids) if self._crosswalk is not None else {}
+
+        dois = {}
+        for id, entry in known.items():
+            # A complete entry without a doi means the publication has no doi
+            if (entry['doi'] or entry['complete']):
+                dois[id] = entry['doi']
+
+        return dois, [id for id in ids if id not in dois]
+
+    #----------------------------------------------------
+    # _lookupCrosswalk:
+    # The pm_id, pmc_id and doi of the given ids found in the crosswalk, keyed by id.
+    # The ids missing from the crosswalk are left out.
+    #----------------------------------------------------
+    def _lookupCrosswalk(self, id_type, ids):
+        if self._crosswalk is None:
+            return {}
+        return {
+            id: {k: entry[k] for k in ('pm_id', 'pmc_id', 'doi')}
+            for id, entry in self._crosswalk.lookupMany(id_type, ids).items()
+        }
+
+    #----------------------------------------------------
+    # _requestIDConv:
+    # Send the ids to the NCBI ID converter, and record the answers in the crosswalk.
+    #----------------------------------------------------
+    def _requestIDConv(self, id_type, ids):
+        converted = {}
+        for start in range(0, len(ids), self._IDCONV_BATCH_SIZE):
+            batch = ids[start:start + self._IDCONV_BATCH_SIZE]
+
+            resp = self._http.get(
+                'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/',
+                params=self._generateIDConvParams(id_type, batch),
+            )
+            if (resp.status_code != 200):
+                continue
+
+            converted.update(self._parseIDConvResult(id_type, batch, json.loads(resp.content)))
+
+        if self._crosswalk is not None:
+            self._crosswalk.addMany(converted.values())
+        return converted
+
+    def _generateIDConvParams(self, id_type, ids):
+        if (id_type == 'pmc_id'):
+            ids = ['PMC' + normalizeId('pmc_id', id) for id in ids]
+        return {'ids': ','.join(ids), 'idtype': self._ID_TYPE_IDCONV[id_type], 'format': 'json'}
+
+    #----------------------------------------------------
+    # _parseIDConvResult:
+    # Map each of the given ids to its identifiers in an NCBI ID converter response.
+    # Ids the converter doesn't know (status 'error') are left out.
+    #----------------------------------------------------
+    def _parseIDConvResult(self, id_type, ids, jsonData):
+        by_id = {normalizeId(id_type, id): id for id in ids}
+
+        converted = {}
+        for conv in jsonData.get('records', []):
+            if (conv.get('status') == 'error'):
+                continue
+
+            entry = {
+                'pm_id': normalizeId('pm_id', conv.get('pmid')),
+                'pmc_id': normalizeId('pmc_id', conv.get('pmcid')),
+                'doi': conv.get('doi'),
+            }
+            requested = by_id.get(normalizeId(id_type, entry[id_type]))
+            if requested is not None:
+                converted[requested] = entry
+
+        return converted
+
+    #----------------------------------------------------
+    # _parseESummaryResult:
+    # Generate publication records for every uid in the 'result' block of an
+    # esummary response. Uids that NCBI could not summarise are skipped.
+    #----------------------------------------------------
+    def _parseESummaryResult(self, jsonData):
+        records = {}
+        if ('result' not in jsonData):
+            return records
+
+        for uid in jsonData['result'].get('uids', []):
+            jsonPub = jsonData['result'].get(uid)
+            if (jsonPub is None or 'error' in jsonPub):
+                continue
+            records[str(uid)] = self._generateNCBIpublicationRecord(jsonPub)
+
+        return records
+
+    #----------------------------------------------------
+    # _getPublicationFromPubmed:
+    # Retrieve information about a publication using pm_id from NCBI eutils
+    #----------------------------------------------------
+    def _getPublicationFromPubmed(self, pm_id):
+        return self.getPublicationsBatch('pubmed', [pm_id]).get(str(pm_id), {})
+
+    #----------------------------------------------------
+    # _getPublicationFromPMC:
+    # Retrieve information about a publication from PMC using the pmc_id from NCBI eutils
+    #----------------------------------------------------
+    def _getPublicationFromPMC(self, pmc_id):
+        return self.getPublicationsBatch('pmc', [pmc_id]).get(str(pmc_id), {})
     
     #----------------------------------------------------
     # getCitedBy:
@@ -108,50 +325,173 @@ class NIH_NCBI:
     # id.
     #----------------------------------------------------
     def getCitedBy(self, id_type, id):
-        urls = []
-        if id_type == 'pm_id':
-            urls.extend(
-                (
-                    f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi?dbfrom=pubmed&linkname=pubmed_pubmed_citedin&retmode=json&id={str(id)}',
-                    f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi?dbfrom=pubmed&linkname=pubmed_pmc_refs&retmode=json&id={str(id)}',
-                )
-            )
+        return self.getCitedByMany(id_type, [id]).get(str(id), {})
 
-        elif id_type == 'pmc_id':
-            urls.append(
-                f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi?dbfrom=pubmed&linkname=pmc_pmc_citedby&retmode=json&id={str(id)}'
-            )
+    #----------------------------------------------------
+    # getCitedByMany:
+    # Get the articles that cite each of the given publications. 'id_type' is
+    # 'pm_id' or 'pmc_id', and 'ids' is a list of the respective ids. The ids are
+    # sent to elink in groups of _ELINK_BATCH_SIZE, the citing ids of all the
+    # publications are deduplicated, and only then are their summaries fetched in
+    # batches. Returns a dict keyed by the given ids (as strings), where each value
+    # is a dict of the citing articles with doi as the key. Ids already looked up by
+    # this instance are not sent again.
+    #----------------------------------------------------
+    def getCitedByMany(self, id_type, ids):
+        results = self._single_flight.doMany(
+            'getCitedBy', [(id_type, str(id)) for id in ids],
+            lambda keys: {(id_type, id): cited_by for id, cited_by in self._getCitedByMany(id_type, [id for _, id in keys]).items()}
+        )
+        return {id: cited_by for (_, id), cited_by in results.items()}
 
+    def _getCitedByMany(self, id_type, ids):
+        citing_ids = self.getCitingIdsMany(id_type, ids)
 
-        record = {}
+        # Fetch every citing article once, however many of the publications it cites
+        to_fetch = {}
+        for links in citing_ids.values():
+            for dbto, cited_id in links:
+                to_fetch.setdefault(dbto, []).append(cited_id)
 
-        for url in urls:
-            self.__NCBI_timestamp = self.__maintainRequestFrequency(self.__NCBI_timestamp, 1)
-            resp = requests.get(url)
+        pubs = {dbto: self.getPublicationsBatch(dbto, fetch_ids) for dbto, fetch_ids in to_fetch.items()}
 
-            if (resp.status_code != 200):
-                return {}
+        return self._assembleCitedBy(citing_ids, pubs)
+
+    #----------------------------------------------------
+    # getNewCitedByMany:
+    # Like getCitedByMany, but the summaries of the citing articles are only
+    # fetched for the articles that are new to the caller. The doi of each citing
+    # id is looked up in the crosswalk first, and 'isKnown(doi)' tells whether the
+    # caller already has that article. Returns a dict keyed by the given ids (as
+    # strings), where each value maps the doi of every citing article to its record,
+    # or to None for the known articles. Results are not shared between calls, as
+    # they depend on 'isKnown'.
+    #----------------------------------------------------
+    def getNewCitedByMany(self, id_type, ids, isKnown):
+        citing_ids      = self.getCitingIdsMany(id_type, ids)
+        known, to_fetch = self._splitKnownCiters(citing_ids, isKnown)
+
+        pubs = {dbto: self.getPublicationsBatch(dbto, fetch_ids) for dbto, fetch_ids in to_fetch.items()}
+        return self._assembleNewCitedBy(citing_ids, pubs, known)
+
+    #----------------------------------------------------
+    # _splitKnownCiters:
+    # Split the citing articles of 'citing_ids' (see getCitingIdsMany) into the
+    # articles the caller has ('isKnown' of their doi, from the crosswalk), as a dict
+    # keyed by db and then by id giving their doi, and the ids whose summaries have
+    # to be fetched, keyed by db. A complete crosswalk entry without a doi is in
+    # neither, as _recordsWithDOI would ignore the article anyway.
+    #----------------------------------------------------
+    def _splitKnownCiters(self, citing_ids, isKnown):
+        links_of = {}
+        for links in citing_ids.values():
+            for dbto, cited_id in links:
+                links_of.setdefault(dbto, []).append(cited_id)
+
+        known    = {}
+        to_fetch = {}
+        for dbto, cited_ids in links_of.items():
+            dois, missing = self._knownDOIs(self._DB_ID_TYPE[dbto], cited_ids)
+            known[dbto]   = {id: doi for id, doi in dois.items() if doi is not None and isKnown(doi)}
+
+            fetch_ids = missing + [id for id, doi in dois.items() if doi is not None and id not in known[dbto]]
+            if fetch_ids:
+                to_fetch[dbto] = fetch_ids
+
+        return known, to_fetch
+
+    #----------------------------------------------------
+    # _assembleNewCitedBy:
+    # Build the result of getNewCitedByMany from the fetched summaries ('pubs') and
+    # the dois of the 'known' articles (see _splitKnownCiters).
+    #----------------------------------------------------
+    def _assembleNewCitedBy(self, citing_ids, pubs, known):
+        record = self._assembleCitedBy(citing_ids, pubs)
+
+        for source_id, links in citing_ids.items():
+            for dbto, cited_id in links:
+                doi = known.get(dbto, {}).get(cited_id)
+                if doi is not None:
+                    record[source_id].setdefault(doi, None)
+
+        return record
+
+    #----------------------------------------------------
+    # getCitingIdsMany:
+    # Get the ids of the articles citing each of the given publications, without
+    # their summaries. Returns a dict keyed by the given ids (as strings), where each
+    # value is a list of (db, id) of the citing articles, 'db' being 'pubmed' or 'pmc'.
+    #----------------------------------------------------
+    def getCitingIdsMany(self, id_type, ids):
+        ids = list(dict.fromkeys(str(id) for id in ids))
+
+        citing_ids = {id: [] for id in ids}
+        for linkname in self._citedByLinknames(id_type):
+            for start in range(0, len(ids), self._ELINK_BATCH_SIZE):
+                batch = ids[start:start + self._ELINK_BATCH_SIZE]
+
+                # A separate 'id' parameter per id gives one linkset per id
+                resp = self._getEutils('elink', {'dbfrom': 'pubmed', 'linkname': linkname, 'retmode': 'json', 'id': batch})
+                if (resp.status_code != 200):
+                    continue
 
-            jsonData = json.loads(resp.content)
-            linksets = jsonData['linksets'][0]
+                for source_id, links in self._parseELinkSets(json.loads(resp.content)).items():
+                    if source_id in citing_ids:
+                        citing_ids[source_id].extend(links)
 
-            if ('linksetdbs' not in linksets):
+        return citing_ids
+
+    #----------------------------------------------------
+    # _citedByLinknames:
+    # elink link names that give the articles citing an article of the given 'id_type'.
+    #----------------------------------------------------
+    def _citedByLinknames(self, id_type):
+        if id_type == 'pm_id':
+            return ['pubmed_pubmed_citedin', 'pubmed_pmc_refs']
+        elif id_type == 'pmc_id':
+            return ['pmc_pmc_citedby']
+        return []
+
+    #----------------------------------------------------
+    # _parseELinkSets:
+    # Map each source id of an elink response to the list of (dbto, id) it links to.
+    #----------------------------------------------------
+    def _parseELinkSets(self, jsonData):
+        links = {}
+        for linkset in jsonData.get('linksets', []):
+            if not linkset.get('ids'):
                 continue
 
-            cited_by = linksets['linksetdbs'][0]
+            source_id = str(linkset['ids'][0])
+            links.setdefault(source_id, [])
+            for linksetdb in linkset.get('linksetdbs', []):
+                links[source_id].extend((linksetdb['dbto'], str(link)) for link in linksetdb['links'])
 
-            for cited_id in cited_by['links']:
-                pub = {}
-                if (cited_by['dbto'] == 'pubmed'):
-                    pub = self._getPublicationFromPubmed(cited_id)
-                elif (cited_by['dbto'] == 'pmc'):
-                    pub = self._getPublicationFromPMC(cited_id)
+        return links
 
-                # Ignore if the publication doesn't have a doi
-                if 'doi' in pub:
-                    record[pub['doi']] = pub
+    #----------------------------------------------------
+    # _assembleCitedBy:
+    # Build the result of getCitedByMany from the citing ids of each publication and
+    # the fetched summaries ('pubs', keyed by db and then by id).
+    #----------------------------------------------------
+    def _assembleCitedBy(self, citing_ids, pubs):
+        record = {}
+        for source_id, links in citing_ids.items():
+            citing_pubs = {}
+            for dbto, cited_id in links:
+                pub = pubs.get(dbto, {}).get(cited_id)
+                if pub is not None:
+                    citing_pubs[f'{dbto}:{cited_id}'] = pub
+            record[source_id] = self._recordsWithDOI(citing_pubs)
 
         return record
+
+    #----------------------------------------------------
+    # _recordsWithDOI:
+    # Key the given publication records by their doi. Publications without a doi are ignored.
+    #----------------------------------------------------
+    def _recordsWithDOI(self, pubs):
+        return {pub['doi']: pub for pub in pubs.values() if 'doi' in pub}
     
     #----------------------------------------------------
     # getProjectFundingDetails:
@@ -160,19 +500,83 @@ class NIH_NCBI:
     # project_no = [List of project numbers]
     #----------------------------------------------------
     def getProjectFundingDetails (self, project_no):
-        self.__NIH_timestamp = self.__maintainRequestFrequency(self.__NIH_timestamp, 1)
-        url = "https://api.reporter.nih.gov/v1/projects/Search/"
-        headers = CaseInsensitiveDict()
-        headers["Content-Type"] = "application/json"
+        return self._single_flight.do(
+            'getProjectFundingDetails', json.dumps(project_no, sort_keys=True),
+            lambda: self._getProjectFundingDetails(project_no)
+        )
 
+    def _getProjectFundingDetails(self, project_no):
         payload = self._generateFundingDetailsPayload(project_no)
-        resp = requests.post(url, headers=headers, data=payload)
+        resp = self._postFundingDetails(payload)
         
         if (resp.status_code == 200):
             return json.loads(resp.content)
         
         return {}
 
+    #----------------------------------------------------
+    # getProjectFundingDetailsMany:
+    # Retrieve the funding details of many awards from NIH reporter. The award
+    # numbers are deduplicated and sent _REPORTER_BATCH_SIZE at a time, and every
+    # page of the results is retrieved. Returns a dict with the award number as the
+    # key and the generateRecord of its sub-projects as the value. Awards without
+    # results map to an empty dict. Awards already retrieved by this instance are
+    # not sent again.
+    #----------------------------------------------------
+    def getProjectFundingDetailsMany(self, project_nums):
+        return self._single_flight.doMany(
+            'getProjectFundingDetailsMany', [p for p in project_nums if p], self._getProjectFundingDetailsMany
+        )
+
+    def _getProjectFundingDetailsMany(self, project_nums):
+        project_nums = list(dict.fromkeys(project_nums))
+
+        records = {project_no: {} for project_no in project_nums}
+        for start in range(0, len(project_nums), self._REPORTER_BATCH_SIZE):
+            batch = project_nums[start:start + self._REPORTER_BATCH_SIZE]
+
+            offset = 0
+            while True:
+                resp = self._postFundingDetails(self._generateFundingDetailsPayload(batch, offset, self._REPORTER_PAGE_SIZE))
+                if (resp.status_code != 200):
+                    break
+
+                jsonData = json.loads(resp.content)
+                self._assignSubProjects(records, batch, jsonData)
+
+                offset += len(jsonData['results'])
+                if (len(jsonData['results']) == 0 or offset >= jsonData['meta']['total']):
+                    break
+
+        return records
+
+    #----------------------------------------------------
+    # _postFundingDetails:
+    # Send a search payload to NIH reporter.
+    #----------------------------------------------------
+    def _postFundingDetails(self, payload):
+        url = "https://api.reporter.nih.gov/v1/projects/Search/"
+        headers = CaseInsensitiveDict()
+        headers["Content-Type"] = "application/json"
+        return self._http.post(url, headers=headers, data=payload)
+
+    #----------------------------------------------------
+    # _assignSubProjects:
+    # Add the sub-projects of a page of NIH reporter results to the records of the
+    # awards in 'project_nums' they belong to. A sub-project belongs to an award if
+    # the award is its core project number, or part of its project number.
+    #----------------------------------------------------
+    def _assignSubProjects(self, records, project_nums, jsonData):
+        for sub_project in jsonData['results']:
+            core_project_num = sub_project.get('core_project_num')
+            if core_project_num in project_nums:
+                owners = [core_project_num]
+            else:
+                owners = [project_no for project_no in project_nums if project_no in sub_project['project_num']]
+
+            for project_no in owners:
+                records[project_no].update(self.generateRecord({'results': [sub_project]}))
+
     #----------------------------------------------------
     # generateRecord:
     # Given the json object containing the data recevied from NIH reporter,
@@ -200,58 +604,124 @@ class NIH_NCBI:
     # Retrieve publications associated with a given grant application identified by the "appl_id"
     #----------------------------------------------------
     def getPublications(self, appl_id):
-        self.__NIH_timestamp = self.__maintainRequestFrequency(self.__NIH_timestamp, 1)
-        resp = requests.get(
+        return self._single_flight.do('getPublications', str(appl_id), lambda: self._getPublications(appl_id))
+
+    def _getPublications(self, appl_id):
+        resp = self._http.get(
             f'https://reporter.nih.gov/services/Projects/Publications?projectId={str(appl_id)}'
         )
 
+        if (resp.status_code != 200):
+            return {}
 
-        record = {}
-        if (resp.status_code == 200):
-            jsonPub = json.loads(resp.content)
+        jsonPub = json.loads(resp.content)
+        dois    = self.getDOIs('pm_id', [pub['pm_id'] for pub in jsonPub['results']])
+        return self._generatePublicationRecords(jsonPub, dois)
 
-            for pub in jsonPub['results']:
-                pubmed_data  = self._getPublicationFromPubmed(pub['pm_id'])
+    #----------------------------------------------------
+    # _generatePublicationRecords:
+    # Generate the records of the publications of a grant from the NIH reporter
+    # response 'jsonPub', taking the doi of each publication from 'dois' (keyed by pm_id).
+    #----------------------------------------------------
+    def _generatePublicationRecords(self, jsonPub, dois):
+        record = {}
+        for pub in jsonPub['results']:
+            doi = dois.get(str(pub['pm_id']))
 
-                data = {
-                    'title': pub['pub_title'],
-                    'journal': pub['journal_title'],
-                    'year': pub['pub_year'],
-                    'author_list': pub['author_list'],
-                    'url': pub['journal_title_link']['value'],
-                    'pm_id': pub['pm_id'],
-                }
+            data = {
+                'title': pub['pub_title'],
+                'journal': pub['journal_title'],
+                'year': pub['pub_year'],
+                'author_list': pub['author_list'],
+                'url': pub['journal_title_link']['value'],
+                'pm_id': pub['pm_id'],
+            }
 
-                # Ignore if the paper doesn't have a doi
-                if ('doi' in pubmed_data):
-                    data['doi']                = pubmed_data['doi']
-                    record[pubmed_data['doi']] = data
+            # Ignore if the paper doesn't have a doi
+            if doi:
+                data['doi'] = doi
+                record[doi] = data
 
         return record
 
     #----------------------------------------------------
     # getPublicationWithSearchTerm:
-    # Get all publications that mention the given search term.
+    # Get all publications that mention the given search term. A term already
+    # searched by this instance is not searched again.
     #----------------------------------------------------
     def getPublicationWithSearchTerm(self, search_term):
-        self.__NCBI_timestamp = self.__maintainRequestFrequency(self.__NCBI_timestamp, 1)
-        term = urlparser.quote(str(search_term), safe='')
-        resp = requests.get(
-            f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pmc&retmode=json&term={term}'
+        return self._single_flight.do(
+            'getPublicationWithSearchTerm', str(search_term),
+            lambda: dict(self.iterPublicationsWithSearchTerm(search_term))
         )
 
+    #----------------------------------------------------
+    # iterPublicationsWithSearchTerm:
+    # Generator over all the publications that mention the given search term, as
+    # (doi, record) pairs. A plain esearch returns the ids of up to _ESEARCH_MAX_IDS
+    # hits, and their summaries are fetched _ESUMMARY_BATCH_SIZE at a time; both are
+    # cached, and the records of a batch can be used before the next batch is
+    # fetched. Searches with more hits fall back to the Entrez history server
+    # (usehistory=y), 'page_size' summaries at a time, which is not cached.
+    # Publications without a doi are ignored. A failed request raises an
+    # HTTPError, so a partial result is never returned.
+    #----------------------------------------------------
+    def iterPublicationsWithSearchTerm(self, search_term, page_size=None):
+        resp = self._getEutils('esearch', {'db': 'pmc', 'retmode': 'json', 'term': str(search_term), 'retmax': self._ESEARCH_MAX_IDS})
+        resp.raise_for_status()
 
-        record = {}
-        if (resp.status_code == 200):
-            jsonData = json.loads(resp.content)
-            pmc_ids = jsonData['esearchresult']['idlist']
+        count, ids = self._parseESearchIds(json.loads(resp.content))
+        if (count > len(ids)):
+            yield from self._iterHistorySearch(search_term, page_size)
+            return
 
-            for pmc_id in pmc_ids:
-               pub = self._getPublicationFromPMC(pmc_id)
+        for start in range(0, len(ids), self._ESUMMARY_BATCH_SIZE):
+            batch = ids[start:start + self._ESUMMARY_BATCH_SIZE]
 
-               # Ignore if the publication doesn't have a doi
-               if 'doi' in pub:
-                   record[pub['doi']] = pub
+            resp = self._getEutils('esummary', {'db': 'pmc', 'retmode': 'json', 'id': ','.join(batch)})
+            resp.raise_for_status()
 
-        return record
-    
\ No newline at end of file
+            records = self._parseESummaryResult(json.loads(resp.content))
+            self._addToCrosswalk('pmc', records)
+            yield from self._recordsWithDOI(records).items()
+
+    #----------------------------------------------------
+    # _iterHistorySearch:
+    # Same as iterPublicationsWithSearchTerm, through the Entrez history server, for
+    # the searches with too many hits for a plain esearch.
+    #----------------------------------------------------
+    def _iterHistorySearch(self, search_term, page_size=None):
+        page_size = page_size or self._HISTORY_PAGE_SIZE
+
+        resp = self._getEutils('esearch', {'db': 'pmc', 'retmode': 'json', 'term': str(search_term), 'usehistory': 'y', 'retmax': 0})
+        resp.raise_for_status()
+
+        count, history = self._parseESearchHistory(json.loads(resp.content))
+
+        for retstart in range(0, count, page_size):
+            resp = self._getEutils('esummary', {'db': 'pmc', 'retmode': 'json', 'retstart': retstart, 'retmax': page_size, **history})
+            resp.raise_for_status()
+
+            records = self._parseESummaryResult(json.loads(resp.content))
+            self._addToCrosswalk('pmc', records)
+            yield from self._recordsWithDOI(records).items()
+
+    #----------------------------------------------------
+    # _parseESearchIds:
+    # Return the number of hits of an esearch response, and the ids it lists.
+    #----------------------------------------------------
+    def _parseESearchIds(self, jsonData):
+        result = jsonData.get('esearchresult', {})
+        return int(result.get('count', 0)), [str(id) for id in result.get('idlist', [])]
+
+    #----------------------------------------------------
+    # _parseESearchHistory:
+    # Return the number of hits of an esearch response made with usehistory=y, and the
+    # query parameters (WebEnv and query_key) to retrieve them from the history server.
+    #----------------------------------------------------
+    def _parseESearchHistory(self, jsonData):
+        result = jsonData.get('esearchresult', {})
+        if ('webenv' not in result):
+            return 0, {}
+
+        return int(result.get('count', 0)), {'WebEnv': result['webenv'], 'query_key': result['querykey']}
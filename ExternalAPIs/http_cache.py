@@ -0,0 +1,217 @@
+#-----------------------------------------------------------------------------
+# http_cache.py:
+# Persistent on-disk cache of HTTP responses, stored in SQLite. Responses are
+# keyed by method + URL + payload hash, expire after a per-endpoint TTL, and
+# the least recently used responses are evicted once the cache grows past its
+# size limit.
+#-----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DAY = 24 * 60 * 60
+
+#----------------------------------------------------
+# Time to live (in seconds) of the cached responses, keyed by URL prefix. The
+# longest matching prefix is used. Summaries of published papers and the files
+# of a dataset version rarely change, while search results grow over time.
+# Google Scholar searches are paid for, and kept for longer.
+#----------------------------------------------------
+DEFAULT_TTLS = {
+    'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi': 1 * DAY,
+    'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi': 7 * DAY,
+    'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi': 30 * DAY,
+    'https://api.reporter.nih.gov/': 7 * DAY,
+    'https://reporter.nih.gov/services/Projects/Publications': 7 * DAY,
+    'https://api.pennsieve.io/discover/search/records': 1 * DAY,
+    'https://api.pennsieve.io/discover/datasets/': 1 * DAY,
+    'https://api.pennsieve.io/zipit/discover': 30 * DAY,
+    'https://www.protocols.io/api/': 1 * DAY,
+    'https://serpapi.com/': 30 * DAY,
+}
+DEFAULT_TTL = 1 * DAY
+
+DEFAULT_CACHE_PATH = os.path.join('.cache', 'http_cache.sqlite')
+
+class HTTPCache:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'path'      : SQLite file holding the cache.
+    # 'ttls'      : Time to live of the responses, keyed by URL prefix (see DEFAULT_TTLS).
+    # 'max_bytes' : Size of the cached content after which the least recently used
+    #               responses are evicted.
+    # 'stale_while_revalidate': If True, an expired response is still returned, and
+    #               refreshed in the background by the HTTP client.
+    #----------------------------------------------------
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttls=None, default_ttl=DEFAULT_TTL,
+                 max_bytes=1024 * 1024 * 1024, stale_while_revalidate=False):
+        self.path        = path
+        self.ttls        = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.max_bytes   = max_bytes
+        self.stale_while_revalidate = stale_while_revalidate
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self.__connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                ' key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, content BLOB,'
+                ' size INTEGER, created_at REAL, accessed_at REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    #----------------------------------------------------
+    # key:
+    # Cache key of a request, made from the method, the full URL (including the query
+    # string) and a hash of the payload.
+    #----------------------------------------------------
+    @staticmethod
+    def key(method, url, body=None):
+        if isinstance(body, str):
+            body = body.encode()
+        payload_hash = hashlib.sha256(body or b'').hexdigest()
+        return hashlib.sha256(f'{method.upper()} {url} {payload_hash}'.encode()).hexdigest()
+
+    #----------------------------------------------------
+    # requestKey:
+    # Cache key of a request given with the arguments of requests.request. The
+    # request is prepared (not sent) to get the full URL and payload.
+    #----------------------------------------------------
+    @staticmethod
+    def requestKey(method, url, params=None, data=None, json=None):
+        prepared = requests.Request(method, url, params=params, data=data, json=json).prepare()
+        return HTTPCache.key(method, prepared.url, prepared.body)
+
+    #----------------------------------------------------
+    # ttl:
+    # Time to live of the responses of 'url'.
+    #----------------------------------------------------
+    def ttl(self, url):
+        prefixes = [p for p in self.ttls if url.startswith(p)]
+        if not prefixes:
+            return self.default_ttl
+        return self.ttls[max(prefixes, key=len)]
+
+    #----------------------------------------------------
+    # get:
+    # Return (response, is_fresh) for the given key, or (None, False) if the response
+    # is not in the cache. Expired responses are only returned when
+    # stale_while_revalidate is set; they are otherwise treated as missing.
+    #----------------------------------------------------
+    def get(self, key):
+        now = time.time()
+        with closing(self.__connect()) as conn, conn:
+            row = conn.execute(
+                'SELECT url, status, headers, content, created_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is None:
+                return None, False
+
+            url, status, headers, content, created_at = row
+            is_fresh = (now - created_at) < self.ttl(url)
+            if (not is_fresh and not self.stale_while_revalidate):
+                return None, False
+
+            conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+
+        return buildResponse(url, status, json.loads(headers), content, from_cache=True), is_fresh
+
+    #----------------------------------------------------
+    # set:
+    # Store a response in the cache, and evict the least recently used responses if
+    # the cache is too large.
+    #----------------------------------------------------
+    def set(self, key, resp):
+        now     = time.time()
+        content = resp.content or b''
+        headers = json.dumps(dict(resp.headers))
+
+        with closing(self.__connect()) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, resp.url, resp.status_code, headers, content, len(content), now, now)
+            )
+            self.__evict(conn)
+
+    #----------------------------------------------------
+    # __evict:
+    # Remove the least recently used responses until the cache fits in max_bytes.
+    #----------------------------------------------------
+    def __evict(self, conn):
+        if self.max_bytes is None:
+            return
+
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if (total <= self.max_bytes):
+            return
+
+        to_free = total - self.max_bytes
+        keys    = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+            keys.append((key,))
+            to_free -= size
+            if (to_free <= 0):
+                break
+        conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+
+    #----------------------------------------------------
+    # clear:
+    # Remove every response from the cache.
+    #----------------------------------------------------
+    def clear(self):
+        with closing(self.__connect()) as conn, conn:
+            conn.execute('DELETE FROM responses')
+
+#----------------------------------------------------
+# buildResponse:
+# Build a requests.Response from its parts (e.g. a cached row), so that callers can
+# use it exactly like a response received from the server.
+#----------------------------------------------------
+def buildResponse(url, status, headers, content, from_cache=False):
+    resp = requests.Response()
+    resp.url               = url
+    resp.status_code       = status
+    resp.headers           = CaseInsensitiveDict(headers)
+    resp.encoding          = requests.utils.get_encoding_from_headers(resp.headers)
+    resp._content          = content
+    resp._content_consumed = True
+    resp.from_cache        = from_cache
+    return resp
+
+_shared_cache      = None
+_shared_cache_lock = threading.Lock()
+
+#----------------------------------------------------
+# getSharedHTTPCache:
+# Return the cache shared by every client in this process. It is stored in
+# HTTP_CACHE_PATH (environment variable) or .cache/http_cache.sqlite. Setting
+# HTTP_CACHE_PATH to 'off' disables caching, in which case None is returned.
+#----------------------------------------------------
+def getSharedHTTPCache():
+    global _shared_cache
+
+    path = os.environ.get('HTTP_CACHE_PATH', DEFAULT_CACHE_PATH)
+    if (path.lower() == 'off'):
+        return None
+
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = HTTPCache(path)
+        return _shared_cache
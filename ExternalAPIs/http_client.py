@@ -0,0 +1,209 @@
+#-----------------------------------------------------------------------------
+# http_client.py:
+# Blocking HTTP client used to talk to the external APIs. Every request waits
+# for the per-host rate limiter, and requests that the server rejects with
+# HTTP 429 (or a temporary 5xx error) are retried with exponential backoff,
+# honouring the Retry-After header. If the client has an HTTPCache, successful
+# responses are stored and served from it.
+#-----------------------------------------------------------------------------
+
+import time
+import threading
+import email.utils
+import requests
+import urllib.parse as urlparser
+from requests.adapters import HTTPAdapter
+
+from ExternalAPIs.rate_limiter import getSharedRateLimiter
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class HTTPStats:
+
+    COUNTERS = ('requests', 'retries', 'cache_hits', 'stale_hits')
+
+    #----------------------------------------------------
+    # __init__:
+    # Counters of the HTTP requests of the process, per host: 'requests' sent
+    # (including retries), 'retries', and responses served from the cache
+    # ('cache_hits', of which 'stale_hits' were expired and refreshed in the background).
+    # The requests sent by each thread are counted too (see threadRequests).
+    #----------------------------------------------------
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self._hosts  = {}
+        self._thread = threading.local()
+
+    def record(self, host, counter, n=1):
+        with self._lock:
+            counters = self._hosts.setdefault(host, dict.fromkeys(self.COUNTERS, 0))
+            counters[counter] += n
+        if (counter == 'requests'):
+            self._thread.requests = self.threadRequests() + n
+
+    #----------------------------------------------------
+    # threadRequests:
+    # Number of requests sent by the calling thread, to any host. The background
+    # refreshes of cached responses run in threads of their own.
+    #----------------------------------------------------
+    def threadRequests(self):
+        return getattr(self._thread, 'requests', 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {host: dict(counters) for host, counters in self._hosts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._hosts = {}
+
+# Counters shared by every client of the process
+HTTP_STATS = HTTPStats()
+
+#----------------------------------------------------
+# parseRetryAfter:
+# Return the number of seconds requested by a Retry-After header, which is either
+# a number of seconds or an HTTP date. Returns None if the header is missing or invalid.
+#----------------------------------------------------
+def parseRetryAfter(value):
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+class HTTPClient:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'rate_limiter' defaults to the limiter shared by the whole process.
+    # 'max_retries' is the number of times a request rejected with one of the
+    # RETRY_STATUS_CODES is sent again, waiting 'backoff' * 2^attempt seconds
+    # (or the Retry-After time) in between. A request whose connection fails or
+    # times out is sent again up to 'connection_retries' times, with the same backoff.
+    # 'cache' is an optional HTTPCache.
+    #----------------------------------------------------
+    def __init__(self, rate_limiter=None, cache=None, max_retries=5, backoff=1.0, pool_size=10, connection_retries=2):
+        self.rate_limiter       = rate_limiter or getSharedRateLimiter()
+        self.cache              = cache
+        self.max_retries        = max_retries
+        self.backoff            = backoff
+        self.connection_retries = connection_retries
+
+        self._revalidating      = set() # cache keys being refreshed in the background
+        self._revalidating_lock = threading.Lock()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    #----------------------------------------------------
+    # request:
+    # Send an HTTP request, keeping within the rate limits of the host. Takes the
+    # same arguments as requests.request and returns the last response received.
+    # With a cache, a cached response is returned instead when there is one.
+    # 'use_cache=False' bypasses the cache, for requests whose responses are only
+    # valid for a short time.
+    #----------------------------------------------------
+    def request(self, method, url, use_cache=True, **kwargs):
+        if (self.cache is None or not use_cache):
+            return self._send(method, url, **kwargs)
+
+        key = self.cache.requestKey(
+            method, url, params=kwargs.get('params'), data=kwargs.get('data'), json=kwargs.get('json')
+        )
+        resp, is_fresh = self.cache.get(key)
+
+        if resp is None:
+            return self._sendAndStore(key, method, url, **kwargs)
+
+        host = urlparser.urlsplit(url).hostname
+        HTTP_STATS.record(host, 'cache_hits')
+        if not is_fresh:
+            HTTP_STATS.record(host, 'stale_hits')
+            self._revalidate(key, method, url, **kwargs)
+        return resp
+
+    #----------------------------------------------------
+    # _send:
+    # Send the request, retrying it with backoff when the server asks us to, or
+    # when the connection fails or times out.
+    #----------------------------------------------------
+    def _send(self, method, url, **kwargs):
+        host = urlparser.urlsplit(url).hostname
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(host)
+            try:
+                resp = self._session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                HTTP_STATS.record(host, 'requests')
+                if (attempt >= min(self.max_retries, self.connection_retries)):
+                    raise
+
+                # Only this request waits, as the other ones may get through
+                time.sleep(self.backoff * (2 ** attempt))
+                HTTP_STATS.record(host, 'retries')
+                attempt += 1
+                continue
+            HTTP_STATS.record(host, 'requests')
+
+            if (resp.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries):
+                return resp
+
+            delay = parseRetryAfter(resp.headers.get('Retry-After'))
+            if delay is None:
+                delay = self.backoff * (2 ** attempt)
+
+            # Pause every request to this host, not only this one
+            self.rate_limiter.block(host, delay)
+            HTTP_STATS.record(host, 'retries')
+            attempt += 1
+
+    #----------------------------------------------------
+    # _sendAndStore:
+    # Send the request and store the response in the cache if it was successful.
+    #----------------------------------------------------
+    def _sendAndStore(self, key, method, url, **kwargs):
+        resp = self._send(method, url, **kwargs)
+        if (resp.status_code == 200):
+            self.cache.set(key, resp)
+        return resp
+
+    #----------------------------------------------------
+    # _revalidate:
+    # Refresh an expired cache entry in a background thread. Only one refresh per
+    # entry runs at a time.
+    #----------------------------------------------------
+    def _revalidate(self, key, method, url, **kwargs):
+        with self._revalidating_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def revalidate():
+            try:
+                self._sendAndStore(key, method, url, **kwargs)
+            except requests.RequestException:
+                pass # keep serving the stale response
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(target=revalidate, daemon=True).start()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
@@ -0,0 +1,147 @@
+#-----------------------------------------------------------------------------
+# id_crosswalk.py:
+# Persistent crosswalk between the identifiers of a publication (pm_id, pmc_id
+# and doi), stored in SQLite. It is filled in bulk from the NCBI ID converter
+# and from esummary records, and consulted before asking NCBI again.
+#-----------------------------------------------------------------------------
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+DEFAULT_CROSSWALK_PATH = os.path.join('.cache', 'id_crosswalk.sqlite')
+
+ID_TYPES = ('pm_id', 'pmc_id', 'doi')
+
+#----------------------------------------------------
+# normalizeId:
+# Normalize an identifier of the given type: pmc_ids are stored without their
+# 'PMC' prefix, and empty values (or PubMed's '0') become None.
+#----------------------------------------------------
+def normalizeId(id_type, id):
+    if id is None:
+        return None
+
+    id = str(id).strip()
+    if (id_type == 'pmc_id' and id.upper().startswith('PMC')):
+        id = id[3:]
+    if id in ('', '0'):
+        return None
+    return id
+
+class IDCrosswalk:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'path' is the SQLite file holding the crosswalk.
+    #----------------------------------------------------
+    def __init__(self, path=DEFAULT_CROSSWALK_PATH):
+        self.path  = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self.__connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            # 'complete' is 1 when the row comes from a full NCBI record, in which case
+            # a missing doi means the publication has no doi.
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS ids ('
+                ' pm_id TEXT UNIQUE, pmc_id TEXT UNIQUE, doi TEXT, complete INTEGER, updated_at REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ids_doi ON ids (doi)')
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    #----------------------------------------------------
+    # addMany:
+    # Add entries to the crosswalk. Each entry is a dict with any of 'pm_id',
+    # 'pmc_id' and 'doi', and optionally 'complete' (see __init__). An entry sharing
+    # an identifier with existing rows is merged with them.
+    #----------------------------------------------------
+    def addMany(self, entries):
+        with self._lock, closing(self.__connect()) as conn, conn:
+            for entry in entries:
+                self.__add(conn, entry)
+
+    def add(self, pm_id=None, pmc_id=None, doi=None, complete=False):
+        self.addMany([{'pm_id': pm_id, 'pmc_id': pmc_id, 'doi': doi, 'complete': complete}])
+
+    def __add(self, conn, entry):
+        merged = {id_type: normalizeId(id_type, entry.get(id_type)) for id_type in ID_TYPES}
+        if (merged['pm_id'] is None and merged['pmc_id'] is None):
+            return # nothing to look the doi up by
+
+        complete = bool(entry.get('complete'))
+        rows     = conn.execute(
+            'SELECT rowid, pm_id, pmc_id, doi, complete FROM ids WHERE pm_id = ? OR pmc_id = ?',
+            (merged['pm_id'], merged['pmc_id'])
+        ).fetchall()
+
+        for rowid, pm_id, pmc_id, doi, row_complete in rows:
+            merged['pm_id']  = merged['pm_id'] or pm_id
+            merged['pmc_id'] = merged['pmc_id'] or pmc_id
+            merged['doi']    = merged['doi'] or doi
+            complete         = complete or bool(row_complete)
+            conn.execute('DELETE FROM ids WHERE rowid = ?', (rowid,))
+
+        conn.execute(
+            'INSERT INTO ids (pm_id, pmc_id, doi, complete, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (merged['pm_id'], merged['pmc_id'], merged['doi'], int(complete), time.time())
+        )
+
+    #----------------------------------------------------
+    # lookupMany:
+    # Return the known identifiers of the given ids of type 'id_type' ('pm_id',
+    # 'pmc_id' or 'doi'), as a dict keyed by the given ids. Each value is a dict with
+    # 'pm_id', 'pmc_id', 'doi' and 'complete'. Unknown ids are left out.
+    #----------------------------------------------------
+    def lookupMany(self, id_type, ids):
+        if id_type not in ID_TYPES:
+            raise ValueError(f'Unknown id type: {id_type}')
+
+        wanted = {}
+        for id in ids:
+            normalized = normalizeId(id_type, id)
+            if normalized is not None:
+                wanted.setdefault(normalized, []).append(id)
+
+        found      = {}
+        normalized = list(wanted)
+        with closing(self.__connect()) as conn:
+            for start in range(0, len(normalized), 500):
+                batch = normalized[start:start + 500]
+                rows  = conn.execute(
+                    f'SELECT pm_id, pmc_id, doi, complete FROM ids WHERE {id_type} IN ({",".join("?" * len(batch))})',
+                    batch
+                )
+                for pm_id, pmc_id, doi, complete in rows:
+                    entry = {'pm_id': pm_id, 'pmc_id': pmc_id, 'doi': doi, 'complete': bool(complete)}
+                    for id in wanted.get(entry[id_type], []):
+                        found[id] = entry
+
+        return found
+
+    def lookup(self, id_type, id):
+        return self.lookupMany(id_type, [id]).get(id)
+
+_shared_crosswalk      = None
+_shared_crosswalk_lock = threading.Lock()
+
+#----------------------------------------------------
+# getSharedIDCrosswalk:
+# Return the crosswalk shared by every client in this process, stored in
+# ID_CROSSWALK_PATH (environment variable) or .cache/id_crosswalk.sqlite.
+#----------------------------------------------------
+def getSharedIDCrosswalk():
+    global _shared_crosswalk
+
+    with _shared_crosswalk_lock:
+        if _shared_crosswalk is None:
+            _shared_crosswalk = IDCrosswalk(os.environ.get('ID_CROSSWALK_PATH', DEFAULT_CROSSWALK_PATH))
+        return _shared_crosswalk
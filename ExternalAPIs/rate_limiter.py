@@ -0,0 +1,231 @@
+#-----------------------------------------------------------------------------
+# rate_limiter.py:
+# Per-host token bucket rate limiter shared by the clients of the external APIs.
+# The buckets can be shared between threads, and between worker processes
+# through a lock-protected state file.
+#-----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import uuid
+import threading
+
+try:
+    import fcntl
+except ImportError: # not available on Windows; state is then only shared between threads
+    fcntl = None
+
+NCBI_HOST        = 'eutils.ncbi.nlm.nih.gov'
+NCBI_IDCONV_HOST = 'www.ncbi.nlm.nih.gov'
+NIH_REPORTER_API = 'api.reporter.nih.gov'
+NIH_REPORTER     = 'reporter.nih.gov'
+PENNSIEVE_HOST   = 'api.pennsieve.io'
+PROTOCOLS_IO     = 'www.protocols.io'
+
+#----------------------------------------------------
+# defaultRates:
+# Request rates (requests per second) stipulated by the API providers.
+# NCBI allows 3 requests per second, or 10 requests per second with an API key,
+# and protocols.io 100 requests per minute.
+#----------------------------------------------------
+def defaultRates(ncbi_api_key=None):
+    return {
+        NCBI_HOST: 10 if ncbi_api_key else 3,
+        NCBI_IDCONV_HOST: 3,
+        NIH_REPORTER_API: 1,
+        NIH_REPORTER: 1,
+        PROTOCOLS_IO: 100 / 60,
+    }
+
+# Seconds after which the rate of a limiter that stopped sending requests to a
+# host no longer counts in the shared state (see RateLimiter.reserve)
+RATE_TTL = 60
+
+#----------------------------------------------------
+# applyNCBIRates:
+# Set the NCBI rates of 'rate_limiter' for a client with the given API key. The
+# limiter is shared by every client of the process, so a rate is only raised
+# (with a key), never lowered: a client without a key created after one with a
+# key does not slow the other clients down.
+#----------------------------------------------------
+def applyNCBIRates(rate_limiter, ncbi_api_key=None):
+    rates = defaultRates(ncbi_api_key)
+    for host in (NCBI_HOST, NCBI_IDCONV_HOST):
+        current = rate_limiter.getRate(host)
+        if (current is None or rates[host] > current):
+            rate_limiter.setRate(host, rates[host])
+
+class RateLimiter:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'rates' maps a host name to the number of requests allowed per second.
+    # Hosts that are not in 'rates' are not limited. If 'state_file' is given, the
+    # buckets are kept in that file so that every process using the same file shares
+    # the same budget, along with the rate of each limiter: a shared bucket is
+    # refilled at the lowest rate of the limiters using it, so that a process
+    # without an NCBI API key and one with a key do not refill it at different rates.
+    #----------------------------------------------------
+    def __init__(self, rates=None, state_file=None):
+        self._rates      = dict(rates) if rates is not None else defaultRates()
+        self._state_file = state_file
+        self._buckets    = {} # host -> [tokens, timestamp, blocked_until, {limiter id: [rate, last request]}]
+        self._lock       = threading.Lock()
+        self._id         = uuid.uuid4().hex
+
+    #----------------------------------------------------
+    # setRate:
+    # Change the number of requests per second allowed for 'host'. 'None' removes the limit.
+    #----------------------------------------------------
+    def setRate(self, host, requests_per_second):
+        with self._lock:
+            if requests_per_second is None:
+                self._rates.pop(host, None)
+            else:
+                self._rates[host] = requests_per_second
+
+    #----------------------------------------------------
+    # getRate:
+    # Return the number of requests per second allowed for 'host' by this limiter,
+    # or None if unlimited.
+    #----------------------------------------------------
+    def getRate(self, host):
+        return self._rates.get(host)
+
+    #----------------------------------------------------
+    # reserve:
+    # Take a token from the bucket of 'host' and return the number of seconds the
+    # caller has to wait before sending its request. The caller is responsible for
+    # waiting, which lets blocking and asyncio clients share the same limiter.
+    # The bucket is refilled at the lowest rate of the limiters that sent requests
+    # to 'host' in the last RATE_TTL seconds (only this one without a state file).
+    #----------------------------------------------------
+    def reserve(self, host):
+        rate = self._rates.get(host)
+
+        with self._lock, self.__sharedState() as buckets:
+            now = time.time()
+            tokens, timestamp, blocked_until, rates = self.__bucket(buckets, host, now)
+
+            wait = max(0.0, blocked_until - now)
+            if rate is not None:
+                rates = {id: entry for id, entry in rates.items() if now - entry[1] < RATE_TTL}
+                rates[self._id] = [rate, now]
+                shared_rate = min(entry[0] for entry in rates.values())
+
+                tokens = min(self.__burst(), tokens + (now - timestamp) * shared_rate) - 1
+                if (tokens < 0):
+                    wait = max(wait, -tokens / shared_rate)
+
+            buckets[host] = [tokens, now, blocked_until, rates]
+
+        return wait
+
+    #----------------------------------------------------
+    # acquire:
+    # Block until a request can be sent to 'host'.
+    #----------------------------------------------------
+    def acquire(self, host):
+        wait = self.reserve(host)
+        if (wait > 0):
+            time.sleep(wait)
+
+    #----------------------------------------------------
+    # block:
+    # Stop all requests to 'host' for the next 'seconds' seconds. Used when the
+    # server asks us to back off (HTTP 429 / Retry-After).
+    #----------------------------------------------------
+    def block(self, host, seconds):
+        with self._lock, self.__sharedState() as buckets:
+            now = time.time()
+            tokens, timestamp, blocked_until, rates = self.__bucket(buckets, host, now)
+            buckets[host] = [tokens, timestamp, max(blocked_until, now + seconds), rates]
+
+    #----------------------------------------------------
+    # __burst:
+    # Number of requests that can be sent back to back after a quiet period. A
+    # single request, so that a host allowing N requests per second never gets more
+    # than N requests in any second.
+    #----------------------------------------------------
+    def __burst(self):
+        return 1.0
+
+    #----------------------------------------------------
+    # __bucket:
+    # Return [tokens, timestamp, blocked_until, rates] of 'host'. A new bucket
+    # starts full. The buckets of older state files have no rates.
+    #----------------------------------------------------
+    def __bucket(self, buckets, host, now):
+        bucket = buckets.get(host, [self.__burst(), now, 0.0, {}])
+        return bucket[:3] + [bucket[3] if len(bucket) > 3 else {}]
+
+    #----------------------------------------------------
+    # __sharedState:
+    # Context manager giving the bucket states. With a state file, the file is locked,
+    # read on entry and written back on exit; otherwise the in-memory dict is used.
+    #----------------------------------------------------
+    def __sharedState(self):
+        if self._state_file is None or fcntl is None:
+            return _InMemoryState(self._buckets)
+        return _FileState(self._state_file)
+
+class _InMemoryState:
+    def __init__(self, buckets):
+        self._buckets = buckets
+
+    def __enter__(self):
+        return self._buckets
+
+    def __exit__(self, *exc):
+        return False
+
+class _FileState:
+    def __init__(self, path):
+        self._path = path
+
+    def __enter__(self):
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+        content = b''
+        while True:
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                break
+            content += chunk
+
+        try:
+            self._buckets = json.loads(content) if content else {}
+        except ValueError:
+            self._buckets = {} # corrupted state, start again with full buckets
+        return self._buckets
+
+    def __exit__(self, *exc):
+        try:
+            content = json.dumps(self._buckets).encode()
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            os.ftruncate(self._fd, 0)
+            os.write(self._fd, content)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        return False
+
+_shared_limiter      = None
+_shared_limiter_lock = threading.Lock()
+
+#----------------------------------------------------
+# getSharedRateLimiter:
+# Return the rate limiter shared by every client in this process. The first call
+# creates it; 'state_file' (or the RATE_LIMIT_STATE_FILE environment variable)
+# additionally shares it with other processes.
+#----------------------------------------------------
+def getSharedRateLimiter(state_file=None):
+    global _shared_limiter
+
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            state_file = state_file or os.environ.get('RATE_LIMIT_STATE_FILE')
+            _shared_limiter = RateLimiter(state_file=state_file)
+        return _shared_limiter
@@ -1,4 +1,10 @@
 # -*- coding: utf-8 -*-
+#-----------------------------------------------------------------------------
+# scholar_api.py:
+# API to search Google Scholar through SerpAPI. Every search is paid for, so
+# the responses are kept in the on-disk response cache of the process, and the
+# searches actually sent are counted against a monthly budget.
+#-----------------------------------------------------------------------------
 
 ## Example response
 ## always returned as a list of datasets
@@ -35,19 +41,251 @@
 
 
 ### Import required python modules
-from serpapi import GoogleSearch
-import pandas as pd
+import os
+import re
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+import requests
+
+from ExternalAPIs.http_cache import HTTPCache, buildResponse, getSharedHTTPCache
+from ExternalAPIs.http_client import HTTPClient
+
+SERPAPI_URL = 'https://serpapi.com/search.json'
+
+DEFAULT_BUDGET_PATH = os.path.join('.cache', 'serpapi_budget.sqlite')
+
+# Searches allowed per month by the free SerpAPI plan
+DEFAULT_MONTHLY_BUDGET = 100
+
+# A doi in a link or a snippet, e.g. https://doi.org/10.1038/s41598-020-63049-y
+DOI_PATTERN = re.compile(r'10\.\d{4,9}/[^\s?#&"\'<>]+')
+
+class ScholarBudgetExceeded(Exception):
+    pass
+
+class SearchBudget:
+
+    #----------------------------------------------------
+    # __init__:
+    # Number of searches sent each month, stored in SQLite so that every run (and
+    # every process using the same file) shares the budget. 'monthly_limit' is the
+    # number of searches allowed per calendar month (UTC), or None for no limit.
+    #----------------------------------------------------
+    def __init__(self, path=DEFAULT_BUDGET_PATH, monthly_limit=DEFAULT_MONTHLY_BUDGET):
+        self.path          = path
+        self.monthly_limit = monthly_limit
+        self._lock         = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self.__connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS searches (month TEXT PRIMARY KEY, count INTEGER)')
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    @staticmethod
+    def month(now=None):
+        return time.strftime('%Y-%m', time.gmtime(now))
+
+    #----------------------------------------------------
+    # used:
+    # Number of searches sent during the month of 'now'.
+    #----------------------------------------------------
+    def used(self, now=None):
+        with closing(self.__connect()) as conn:
+            row = conn.execute('SELECT count FROM searches WHERE month = ?', (self.month(now),)).fetchone()
+        return row[0] if row is not None else 0
+
+    #----------------------------------------------------
+    # remaining:
+    # Number of searches left this month, or None if there is no limit.
+    #----------------------------------------------------
+    def remaining(self, now=None):
+        if self.monthly_limit is None:
+            return None
+        return max(0, self.monthly_limit - self.used(now))
+
+    #----------------------------------------------------
+    # check:
+    # Raise ScholarBudgetExceeded if the budget of the month is used up.
+    #----------------------------------------------------
+    def check(self, now=None):
+        if (self.remaining(now) == 0):
+            raise ScholarBudgetExceeded(f'the SerpAPI budget of {self.monthly_limit} searches for {self.month(now)} is used up')
+
+    #----------------------------------------------------
+    # spend:
+    # Count one search, once SerpAPI answered it.
+    #----------------------------------------------------
+    def spend(self, now=None):
+        month = self.month(now)
+        with self._lock, closing(self.__connect()) as conn, conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row  = conn.execute('SELECT count FROM searches WHERE month = ?', (month,)).fetchone()
+            used = row[0] if row is not None else 0
+            conn.execute('INSERT OR REPLACE INTO searches VALUES (?, ?)', (month, used + 1))
+
+class ScholarAPI:
+
+    _PAGE_SIZE = 20 # maximum number of results in one Google Scholar page
+
+    #----------------------------------------------------
+    # __init__:
+    # 'api_key' is the SerpAPI key (SERPAPI_KEY in .env). Responses are kept in the
+    # on-disk cache of the process (see http_cache.py) unless another HTTPCache is
+    # given, or 'cache' is False; a cached search is not sent, nor paid for, again.
+    # 'budget' is the SearchBudget the searches are counted against; by default it
+    # allows SERPAPI_MONTHLY_BUDGET (environment variable) searches per month.
+    #----------------------------------------------------
+    def __init__(self, api_key, cache=None, budget=None, rate_limiter=None):
+        self._api_key = api_key
+
+        if cache is None:
+            cache = getSharedHTTPCache()
+        self._cache = cache or None
+        self._http  = HTTPClient(rate_limiter)
+
+        if budget is None:
+            budget = SearchBudget(monthly_limit=int(os.environ.get('SERPAPI_MONTHLY_BUDGET', DEFAULT_MONTHLY_BUDGET)))
+        self.budget = budget
+
+    #----------------------------------------------------
+    # search:
+    # Send a Google Scholar search with the given SerpAPI parameters (e.g. 'q',
+    # 'cites', 'start') and return its json result. The api key is left out of the
+    # cache key, so the cache is kept when the key changes. Raises
+    # ScholarBudgetExceeded when the search is not cached and the budget is used up.
+    # Only the searches that SerpAPI answered are charged to the budget.
+    #----------------------------------------------------
+    def search(self, params):
+        params = dict(params, engine='google_scholar')
+        key    = HTTPCache.requestKey('GET', SERPAPI_URL, params=params)
+
+        if self._cache is not None:
+            resp, _ = self._cache.get(key)
+            if resp is not None:
+                return resp.json()
+
+        self.budget.check()
+        resp = self._http.get(SERPAPI_URL, params=dict(params, api_key=self._api_key))
+        resp.raise_for_status()
+        self.budget.spend()
+
+        if self._cache is not None:
+            public_url = requests.Request('GET', SERPAPI_URL, params=params).prepare().url
+            self._cache.set(key, buildResponse(public_url, resp.status_code, dict(resp.headers), resp.content))
+        return resp.json()
+
+    #----------------------------------------------------
+    # searchPages:
+    # Yield the json result of every page of a search, following the pagination of
+    # SerpAPI until a page has no next page (or no result), or 'max_pages' pages
+    # were read.
+    #----------------------------------------------------
+    def searchPages(self, params, max_pages=None):
+        start = 0
+        pages = 0
+        while (max_pages is None or pages < max_pages):
+            result = self.search(dict(params, start=start, num=self._PAGE_SIZE))
+            pages += 1
+            yield result
+
+            organic_results = result.get('organic_results') or []
+            if (not organic_results or 'next' not in (result.get('serpapi_pagination') or {})):
+                return
+            start += len(organic_results)
+
+    #----------------------------------------------------
+    # getPublications:
+    # Search Google Scholar for a doi (or any search term), and return the paper
+    # records of the first page of results (see generateRecord).
+    #----------------------------------------------------
+    def getPublications(self, search_term):
+        result = self.search({'q': search_term})
+        return [self.generateRecord(item) for item in result.get('organic_results') or []]
+
+    #----------------------------------------------------
+    # getCitingPapers:
+    # Paper records of every paper citing the publication identified by 'cites_id'
+    # (the 'cites_id' of a paper record), across all the pages of citers.
+    #----------------------------------------------------
+    def getCitingPapers(self, cites_id, max_pages=None):
+        records = []
+        for result in self.searchPages({'cites': cites_id}, max_pages):
+            records.extend(self.generateRecord(item) for item in result.get('organic_results') or [])
+        return records
+
+    #----------------------------------------------------
+    # getCitedBy:
+    # Same as getCitingPapers, as a dict of the citing papers with doi as the key,
+    # like NIH_NCBI.getCitedBy. Papers without a doi are ignored.
+    #----------------------------------------------------
+    def getCitedBy(self, cites_id, max_pages=None):
+        return {record['doi']: record for record in self.getCitingPapers(cites_id, max_pages) if 'doi' in record}
+
+    #----------------------------------------------------
+    # generateRecord:
+    # Generate a paper record from an organic result of Google Scholar, with the
+    # fields of the NIH_NCBI publication records ('title', 'journal', 'year',
+    # 'author_list' and 'doi' when one is found in the link), along with its
+    # Google Scholar 'cites_id' and number of citations ('cited_by').
+    #----------------------------------------------------
+    def generateRecord(self, item):
+        publication_info = item.get('publication_info') or {}
+
+        # e.g. 'LC Gleim, S Decker - MEPDaW@ ISWC, 2020 - ceur-ws.org'
+        parts   = [part.strip() for part in publication_info.get('summary', '').split(' - ')]
+        source  = parts[1] if len(parts) > 2 else ''
+        year    = re.search(r'\b(1[89]|20)\d{2}\b', source)
+        journal = re.sub(r',?\s*\b(1[89]|20)\d{2}\b$', '', source).strip()
+
+        authors = [author['name'] for author in publication_info.get('authors') or []]
+        if (not authors and parts[0]):
+            authors = [name.strip() for name in parts[0].split(',')]
+
+        data = {
+            'title': item.get('title', ''),
+            'journal': journal,
+            'year': year.group(0) if year else '',
+            'author_list': ', '.join(authors),
+        }
+
+        doi = DOI_PATTERN.search(item.get('link') or '')
+        if doi is not None:
+            data['doi'] = doi.group(0).rstrip('.')
+
+        cited_by = (item.get('inline_links') or {}).get('cited_by') or {}
+        if 'cites_id' in cited_by:
+            data['cites_id'] = cited_by['cites_id']
+            data['cited_by'] = cited_by.get('total', 0)
+
+        return data
+
+_shared_clients      = {} # api key -> ScholarAPI
+_shared_clients_lock = threading.Lock()
+
+#----------------------------------------------------
+# getSharedScholarAPI:
+# Return the ScholarAPI of the process for 'api_key', created on first use, so
+# the functions below share its HTTP session and budget instead of building a
+# new client for every search.
+#----------------------------------------------------
+def getSharedScholarAPI(api_key):
+    with _shared_clients_lock:
+        if api_key not in _shared_clients:
+            _shared_clients[api_key] = ScholarAPI(api_key)
+        return _shared_clients[api_key]
 
 # Function that takes originatingArticleDOI scaraped from Pennsieve as input and searches
 
 def get_fromoriginatingdoi(originatingArticleDOI, authorization_key):
-    params = {
-        "engine": "google_scholar",
-        "q": originatingArticleDOI,
-        "api_key": authorization_key
-    }
-    search = GoogleSearch(params)
-    return search.get_json()
+    return getSharedScholarAPI(authorization_key).search({'q': originatingArticleDOI})
 
 # results = get_fromoriginatingdoi("10.13003/5jchdy")
 # output below
@@ -122,19 +360,21 @@ def get_fromoriginatingdoi(originatingArticleDOI, authorization_key):
 '''
 
 
+
 # Taking publication information and citation information from scraped data
 def getcitationandpubinfo(results):
     record = {}
-    for item in results['organic_results']:
+    for item in results.get('organic_results') or []:
+        cited_by = (item.get('inline_links') or {}).get('cited_by') or {}
         data = {
             'title': item['title'],
-            'author_info': item['publication_info'],
-            'citation_info': item['inline_links'],
-            'cites_id': item['inline_links']['cited_by']['cites_id'],
+            'author_info': item.get('publication_info', {}),
+            'citation_info': item.get('inline_links', {}),
+            'cites_id': cited_by.get('cites_id'),
         }
 
         record[item['position']] = data
-        return record
+    return record
 
 
 #response = getcitationandpubinfo(results)
@@ -201,12 +441,14 @@ def getcitationandpubinfo(results):
 }
 '''
 
-# Function to use cites_id and search all related items
+# Function to use cites_id and search all related items, across every page of
+# citers. The organic results of all the pages are merged into one result.
 def get_fromcitesid(cites_id, authorization_key):
-    params = {
-        "engine": "google_scholar",
-        "cites": cites_id,
-        "api_key": authorization_key
-    }
-    search = GoogleSearch(params)
-    return search.get_json()
+    organic_results = []
+    result = {}
+    for result in getSharedScholarAPI(authorization_key).searchPages({'cites': cites_id}):
+        organic_results.extend(result.get('organic_results') or [])
+
+    result = dict(result, organic_results=organic_results)
+    result.pop('serpapi_pagination', None)
+    return result
@@ -0,0 +1,148 @@
+#-----------------------------------------------------------------------------
+# single_flight.py:
+# Request coalescing. Identical calls (same name and key) share one execution:
+# a call made while an identical one is in flight waits for its result, and a
+# call made after it completed reuses its non-empty result. Counters report how
+# many calls were saved.
+#-----------------------------------------------------------------------------
+
+import copy
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+class SingleFlight:
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._calls = {} # (name, key) -> _Call
+        self._stats = {} # name -> {'calls', 'executed', 'hits', 'waits'}
+
+    #----------------------------------------------------
+    # do:
+    # Return the result of fn(), executing it only if no identical call (same 'name'
+    # and 'key') is in flight or completed. Every caller gets its own deep copy of
+    # the result, so callers can modify it freely. If fn() raises, the waiting
+    # callers get the same exception and the call is forgotten, so it can be retried.
+    # An empty result (None, {} or []) is given to the waiting callers but forgotten
+    # too, as the lookups return one when they fail.
+    #----------------------------------------------------
+    def do(self, name, key, fn):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'calls': 0, 'executed': 0, 'hits': 0, 'waits': 0})
+            stats['calls'] += 1
+
+            call  = self._calls.get((name, key))
+            owner = call is None
+            if owner:
+                call = _Call()
+                self._calls[(name, key)] = call
+                stats['executed'] += 1
+            elif call.done.is_set():
+                stats['hits'] += 1
+            else:
+                stats['waits'] += 1
+
+        if owner:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                self.__forget(name, key, call)
+                raise
+            finally:
+                call.done.set()
+            if not call.result:
+                self.__forget(name, key, call)
+        else:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+        return copy.deepcopy(call.result)
+
+    #----------------------------------------------------
+    # doMany:
+    # Batch version of do. 'fn' is called once with the list of the keys that no
+    # identical call has claimed yet, and must return a dict keyed by them (a missing
+    # key gives None). The results of the other keys come from the earlier calls,
+    # and the empty results are forgotten as in do. Returns a dict with a deep copy
+    # of the result of every key.
+    #----------------------------------------------------
+    def doMany(self, name, keys, fn):
+        keys = list(dict.fromkeys(keys))
+
+        owned, calls = [], {}
+        with self._lock:
+            stats = self._stats.setdefault(name, {'calls': 0, 'executed': 0, 'hits': 0, 'waits': 0})
+            for key in keys:
+                stats['calls'] += 1
+
+                call = self._calls.get((name, key))
+                if call is None:
+                    call = _Call()
+                    self._calls[(name, key)] = call
+                    owned.append(key)
+                    stats['executed'] += 1
+                elif call.done.is_set():
+                    stats['hits'] += 1
+                else:
+                    stats['waits'] += 1
+                calls[key] = call
+
+        if owned:
+            try:
+                results = fn(owned)
+                for key in owned:
+                    calls[key].result = results.get(key)
+            except BaseException as e:
+                for key in owned:
+                    calls[key].error = e
+                    self.__forget(name, key, calls[key])
+                raise
+            finally:
+                for key in owned:
+                    calls[key].done.set()
+            for key in owned:
+                if not calls[key].result:
+                    self.__forget(name, key, calls[key])
+
+        results = {}
+        for key, call in calls.items():
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            results[key] = copy.deepcopy(call.result)
+
+        return results
+
+    #----------------------------------------------------
+    # __forget:
+    # Forget 'call', so that the next identical call is executed again.
+    #----------------------------------------------------
+    def __forget(self, name, key, call):
+        with self._lock:
+            if self._calls.get((name, key)) is call:
+                del self._calls[(name, key)]
+
+    #----------------------------------------------------
+    # getStats:
+    # Counters of each name: 'calls' made, calls 'executed', and calls answered by a
+    # completed call ('hits') or by waiting for one in flight ('waits').
+    #----------------------------------------------------
+    def getStats(self):
+        with self._lock:
+            return copy.deepcopy(self._stats)
+
+    #----------------------------------------------------
+    # reset:
+    # Forget the completed calls and the counters, e.g. at the start of a new run.
+    #----------------------------------------------------
+    def reset(self):
+        with self._lock:
+            self._calls = {key: call for key, call in self._calls.items() if not call.done.is_set()}
+            self._stats = {}
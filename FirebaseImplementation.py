@@ -7,12 +7,29 @@
 #--------------------------------------------------------------
 
 from collections import UserString
+import os
+import sys
+import json
+import math
+import argparse
+import contextlib
 import time
+import threading
 from pyasn1_modules.rfc2459 import Time
-import pyrebase
 from dotenv import dotenv_values
 
 from ExternalAPIs.NIH_NCBI import NIH_NCBI
+from ExternalAPIs.rate_limiter import NCBI_HOST, NIH_REPORTER_API, PENNSIEVE_HOST, PROTOCOLS_IO, getSharedRateLimiter
+from GraphStore.delta_sync import planSync, pushUpdates
+from GraphStore.graph_store import markUpdated
+from GraphStore.firebase_store import FirebaseStore
+from GraphStore.sqlite_store import SQLiteStore, DEFAULT_STORE_PATH
+from GraphStore.write_buffer import WriteBuffer
+from Harvest.citation_expansion import CitationExpander
+from Harvest.citation_refresh import isDue
+from Harvest.run_journal import RunJournal, DEFAULT_JOURNAL_PATH
+from Harvest.run_report import RunReport
+from Harvest.scheduler import BatchQueue, Scheduler
 import SPARC.metadata_extraction as SPARC
 
 #******************* Update with firebase API key*******************#
@@ -30,318 +47,559 @@ firebaseConfig = {
 
 ENV_CONFIG = dotenv_values('.env')
 
-firebase = pyrebase.initialize_app(firebaseConfig)
-auth     = firebase.auth()
-
-email    = input('Enter email: ')
-passw    = input('Enter password: ')
-user     = auth.sign_in_with_email_and_password(email, passw)
-
-db = firebase.database()
-NN = NIH_NCBI()
-
-disallowed_chars = {ord(c):None for c in "$#[]/. "}
-Timestamp = time.time()
-
 #--------------------------------------------------------------
-# uploadDatasets:
-# Retrieve datasets from SPARC pennsieve and associated papers,
-# and upload to firebase. It returns a list of award ids to look for awards
+# config:
+# Value of a setting, taken from the environment or from .env.
 #--------------------------------------------------------------
-def uploadDatasets(skip=0):
-    print('Processing datasets...')
-
-    global user
-    global Timestamp
-
-    award_list = {}
-
-    # Get all the datasets from Sparc Portal
-    sparc_dataset_list = []
-    sparc_dataset_list = SPARC.get_list_of_datasets_with_metadata(sparc_dataset_list)
-
-    curr_dataset = 0
-    for dataset in sparc_dataset_list:
-        curr_dataset += 1
-        if (curr_dataset < skip):
-            continue
+def config(name, default=None):
+    return os.environ.get(name) or ENV_CONFIG.get(name) or default
 
-        print("--- Processing dataset: {0} ({1}/{2})".format(dataset['datasetDOI'], curr_dataset, len(sparc_dataset_list)))
+NN = NIH_NCBI(api_key=config('NCBI_API_KEY'))
 
-        # update the user token if its been more than 30 min
-        dt = time.time() - Timestamp
-        if (dt > 1800):
-            refreshed_user       = auth.refresh(user['refreshToken'])
-            user['idToken']      = refreshed_user['idToken']
-            user['refreshToken'] = refreshed_user['refreshToken']
-            Timestamp = time.time()
+# The graph is written to 'store' (see GraphStore) through 'buffer', which sends
+# the writes as multi-path updates of FIREBASE_BATCH_SIZE paths. The units of work
+# completed are recorded in 'journal' every time the buffer is flushed, so that a
+# restarted run skips them. All three are set by useStore.
+store   = None
+buffer  = None
+journal = None
 
-        # Insert the dataset to the database
-        dataset_key = dataset['datasetDOI'].translate(disallowed_chars)
-
-        dataset_record = {
-            'doi': dataset['datasetDOI'],
-            'name': dataset['name'],
-            'description': dataset['description'],
-            'award': dataset['properties']['award_id'],
-            'protocols': [
-                p.translate(disallowed_chars)
-                if (p.find('org') == -1)
-                else p.split('.org/')[1].translate(disallowed_chars)
-                for p in dataset['protocolsDOI']
-            ],
-        }
-
-        dataset_record['tags']          = dataset['tags']
-
-        db.child(user['localId']).child('Datasets').update({dataset_key: dataset_record}, user['idToken'])
-
-        # Add originating article if available
-        originating_articles = {}
-        for doi in dataset['originatingArticleDOI']:
-            if (doi.find('org') != -1):
-                doi = doi.split('.org/')[1]
-            originating_articles |= NN.getPublicationWithSearchTerm('{0}[doi]'.format(doi))
-
-        # Add protocols used by the dataset
-        uploadDatasetProtocols(dataset['protocolsDOI'])
-
-        # Find papers associated with the dataset. i.e. papers that mention the dataset doi. Upload.
-        dataset_pub_records = NN.getPublicationWithSearchTerm('"{0}"'.format(dataset_record['doi'].split('.org/')[1]))
-        dataset_pub_records.update(originating_articles)
+disallowed_chars = {ord(c):None for c in "$#[]/. "}
 
-        for i, k in enumerate(dataset_pub_records, start=1):
-            print("---- Uploading paper : {0} / {1}".format(i, len(dataset_pub_records)))
+STAGES = ('datasets', 'awards', 'protocols', 'citations')
 
-            paper_key = k.translate(disallowed_chars)
-            dataset_pub_records[k]['datasets'] = [dataset_key]
-            dataset_pub_records[k]['citations']= 0
-            dataset_pub_records[k]['direct']   = True # indicate that this paper is directly associated with SPARC
+#--------------------------------------------------------------
+# useStore:
+# Write the graph to the given GraphStore. Unless 'resume' is False, the
+# last run against the same store that did not finish (see RUN_JOURNAL_PATH
+# in .env) is resumed.
+#--------------------------------------------------------------
+def useStore(graph_store, batch_size=None, resume=True):
+    global store
+    global buffer
+    global journal
+
+    store   = graph_store
+    buffer  = WriteBuffer(store, batch_size=batch_size or int(config('FIREBASE_BATCH_SIZE', 500)))
+    journal = RunJournal(config('RUN_JOURNAL_PATH', DEFAULT_JOURNAL_PATH), resume=resume, store=store.storeId())
+    buffer.addFlushListener(journal.commit)
+
+    if journal.resumed:
+        print('Resuming the previous run')
+    return
 
-            uploadPaperOrUpdate(paper_key, 'datasets', dataset_pub_records[k])
+#--------------------------------------------------------------
+# syncToFirebase:
+# Push the records of 'local_store' that are new or changed to Firebase, after
+# showing a summary of the changes (see GraphStore/delta_sync.py).
+#--------------------------------------------------------------
+def syncToFirebase(local_store, firebase_store):
+    updates, summary = planSync(local_store, firebase_store)
+    for node, counts in summary['nodes'].items():
+        print('--- {0}: {1} added, {2} changed, {3} deleted'.format(node, counts['added'], counts['changed'], counts['deleted']))
+    print('--- {0} paths to write ({1} bytes)'.format(summary['paths'], summary['bytes']))
 
-        award_list[dataset_key] = dataset_record['award']
+    if (summary['paths'] == 0 or input('Push the changes? [y/N]: ').lower() != 'y'):
+        return
 
-    return award_list
+    pushUpdates(firebase_store, updates, int(config('FIREBASE_BATCH_SIZE', 500)))
+    print('{0} paths pushed'.format(len(updates)))
+    return
 
 #--------------------------------------------------------------
-# uploadAwards:
-# Retrieve information about a given list of awards from NIH reporter, 
-# find associated papers, and upload to firebase.
+# connectFirebase:
+# Sign in to Firebase with FIREBASE_EMAIL/FIREBASE_PASSWORD (environment or
+# .env), or else with the email/password entered by the user if 'interactive'.
 #--------------------------------------------------------------
-def uploadAwards(award_list):
-    print('Processing awards...')
-
-    global user
-    global Timestamp
+def connectFirebase(interactive=True):
+    email = config('FIREBASE_EMAIL')
+    passw = config('FIREBASE_PASSWORD')
 
-    for curr_dataset, dataset_key in enumerate(award_list, start=1):
-        # update the user token if its been more than 30 min
-        dt = time.time() - Timestamp
-        if (dt > 1800):
-            refreshed_user       = auth.refresh(user['refreshToken'])
-            user['idToken']      = refreshed_user['idToken']
-            user['refreshToken'] = refreshed_user['refreshToken']
-            Timestamp = time.time()
+    if (not email or not passw):
+        if not interactive:
+            raise SystemExit('FIREBASE_EMAIL and FIREBASE_PASSWORD must be set in the environment or in .env')
+        email = input('Enter email: ')
+        passw = input('Enter password: ')
 
-        award_num = award_list[dataset_key]
+    return FirebaseStore(firebaseConfig, email, passw)
 
-        print("--- Processing award of dataset: {0} ({1}/{2})".format(dataset_key, curr_dataset, len(award_list)))
-        award_record = NN.generateRecord(NN.getProjectFundingDetails([ award_num ]))
-        db.child(user['localId']).child('Awards').update({award_num: award_record}, user['idToken'])
-
-        # Collect papers associated with the award
-        award_pub = {}
-        for k in award_record:
-            sub_award = award_record[k]
-            pubs = NN.getPublications(sub_award['appl_id'])
-            award_pub |= pubs
+#--------------------------------------------------------------
+# openLocalStore:
+# Local SQLite database, stored in GRAPH_STORE_PATH (.env) or .cache/graph.sqlite.
+#--------------------------------------------------------------
+def openLocalStore():
+    return SQLiteStore(config('GRAPH_STORE_PATH', DEFAULT_STORE_PATH))
 
-        for i, (k, v) in enumerate(award_pub.items(), start=1):
-            print("---- Uploading paper: {0} / {1}".format(i, len(award_pub)))
+#--------------------------------------------------------------
+# uploadDataset:
+# Insert a dataset to the database. Returns its key and record.
+#--------------------------------------------------------------
+def uploadDataset(dataset):
+    dataset_key = dataset['datasetDOI'].translate(disallowed_chars)
+
+    dataset_record = {
+        'doi': dataset['datasetDOI'],
+        'name': dataset['name'],
+        'description': dataset['description'],
+        'award': dataset['properties']['award_id'],
+        'protocols': [
+            p.translate(disallowed_chars)
+            if (p.find('org') == -1)
+            else p.split('.org/')[1].translate(disallowed_chars)
+            for p in dataset['protocolsDOI']
+        ],
+    }
+
+    dataset_record['tags']          = dataset['tags']
+
+    buffer.update(f'Datasets/{dataset_key}', dataset_record)
+    return dataset_key, dataset_record
 
-            paper_key = k.translate(disallowed_chars)
-            award_pub[k]['awards']   = [award_num]
-            award_pub[k]['citations']= 0
-            award_pub[k]['direct']   = True # indicate that the paper is directly associated with SPARC
+#--------------------------------------------------------------
+# uploadDatasetPapers:
+# Upload the originating articles of a dataset, and the papers that mention the
+# dataset doi. Returns the uploaded papers, keyed by paper key.
+#--------------------------------------------------------------
+def uploadDatasetPapers(dataset_key, dataset):
+    # Add originating article if available
+    originating_articles = {}
+    for doi in dataset['originatingArticleDOI']:
+        if (doi.find('org') != -1):
+            doi = doi.split('.org/')[1]
+        originating_articles |= NN.getPublicationWithSearchTerm('{0}[doi]'.format(doi))
 
-            uploadPaperOrUpdate(paper_key, 'awards', v)
+    # Find papers associated with the dataset. i.e. papers that mention the dataset doi. Upload.
+    dataset_pub_records = NN.getPublicationWithSearchTerm('"{0}"'.format(dataset['datasetDOI'].split('.org/')[1]))
+    dataset_pub_records.update(originating_articles)
 
-    return
+    return uploadDirectPapers(dataset_pub_records, 'datasets', dataset_key)
 
 #--------------------------------------------------------------
-# uploadDatasetProtocols:
-# Upload the protocols given in the dataset. This is done here because 
-# the protocols may not be from SPARC. If it is a SPARC protocol, 
-# it will be updated in the protocol step.
+# uploadAward:
+# Upload the record of an award and the papers associated with it. Returns the
+# uploaded papers, keyed by paper key.
 #--------------------------------------------------------------
-def uploadDatasetProtocols(dataset_protocol_list):
-    # Add protocols.
-    for protocol_doi in dataset_protocol_list:
-        protocol_key = ''
-        if (protocol_doi.find('org') != -1):
-            protocol_doi_only = protocol_doi.split('.org/')[1]
+def uploadAward(award_num, award_record):
+    buffer.update(f'Awards/{award_num}', award_record)
 
-        protocol_key = protocol_doi_only.translate(disallowed_chars)
-        protocol_record = db.child(user['localId']).child('Protocols').child(protocol_key).get(user['idToken']).val()
+    # Collect papers associated with the award
+    award_pub = {}
+    for k in award_record:
+        sub_award = award_record[k]
+        pubs = NN.getPublications(sub_award['appl_id'])
+        award_pub |= pubs
 
-        if protocol_record is None:
-            # protocol doesn't exist
-            db.child(user['localId']).child('Protocols').update({protocol_key: {'url': protocol_doi, 'doi': protocol_doi_only}}, user['idToken'])
+    return uploadDirectPapers(award_pub, 'awards', award_num)
 
-        # Add papers associated with the protocol
-        protocol_pub_records = NN.getPublicationWithSearchTerm('"{0}"'.format(protocol_doi_only))
+#--------------------------------------------------------------
+# uploadDatasetProtocol:
+# Upload one of the protocols given in a dataset, and the papers associated with
+# it. Returns the uploaded papers, keyed by paper key.
+#--------------------------------------------------------------
+def uploadDatasetProtocol(protocol_doi):
+    protocol_key = ''
+    if (protocol_doi.find('org') != -1):
+        protocol_doi_only = protocol_doi.split('.org/')[1]
 
-        for i, k in enumerate(protocol_pub_records, start=1):
-            print("---- Uploading protocol papers : {0} / {1}".format(i, len(protocol_pub_records)))
+    protocol_key = protocol_doi_only.translate(disallowed_chars)
+    protocol_record = buffer.get(f'Protocols/{protocol_key}')
 
-            paper_key = k.translate(disallowed_chars)
-            protocol_pub_records[k]['protocols'] = [protocol_key]
-            protocol_pub_records[k]['citations']= 0
-            protocol_pub_records[k]['direct']   = True # indicate that this paper is directly associated with SPARC
+    if protocol_record is None:
+        # protocol doesn't exist
+        buffer.update(f'Protocols/{protocol_key}', {'url': protocol_doi, 'doi': protocol_doi_only})
 
-            uploadPaperOrUpdate(paper_key, 'protocols', protocol_pub_records[k])
-            
+    # Add papers associated with the protocol
+    protocol_pub_records = NN.getPublicationWithSearchTerm('"{0}"'.format(protocol_doi_only))
 
+    return uploadDirectPapers(protocol_pub_records, 'protocols', protocol_key)
 
 #--------------------------------------------------------------
-# uploadProtocols:
-# Retrieve protocol information from SPARC protocols.io, and upload to firebase
+# protocolKey:
+# Database key of a protocol from protocols.io, or None if it doesn't have a doi.
 #--------------------------------------------------------------
-def uploadProtocols():
-    global user
-    global Timestamp
+def protocolKey(protocol):
+    if 'doi' not in protocol:
+        return None
 
-    print('Processing protocols...')
+    if (protocol['doi'].find('org') != -1):
+        protocol['doi'] = protocol['doi'].split('./org')[1]
 
-    sparc_protocol_list = SPARC.parsing_protocols(ENV_CONFIG['PROTOCOLS_IO_KEY'])
+    return protocol['doi'].translate(disallowed_chars)
 
-    curr_protocol = 0
-    for protocol in sparc_protocol_list:
-        curr_protocol += 1
-
-        # update the user token if its been more than 30 min
-        dt = time.time() - Timestamp
-        if (dt > 1800):
-            refreshed_user       = auth.refresh(user['refreshToken'])
-            user['idToken']      = refreshed_user['idToken']
-            user['refreshToken'] = refreshed_user['refreshToken']
-            Timestamp = time.time()
-
-        # Ignore if the protocol doesn't have a doi
-        if 'doi' not in protocol:
-            continue
-
-        if (protocol['doi'].find('org') != -1):
-            protocol['doi'] = protocol['doi'].split('./org')[1]
-
-        protocol_key = protocol['doi'].translate(disallowed_chars)
+#--------------------------------------------------------------
+# uploadProtocol:
+# Upload a protocol from protocols.io and the papers associated with it.
+# Returns the uploaded papers, keyed by paper key.
+#--------------------------------------------------------------
+def uploadProtocol(protocol):
+    protocol_key = protocolKey(protocol)
 
-        print("--- Processing protocol {0} / {1}".format(curr_protocol, len(sparc_protocol_list)))
+    protocol_record = {
+        'title': protocol['title'],
+        'authors': protocol['authors'],
+        'url': protocol['url'],
+        'doi': protocol['doi'],
+    }
 
-        protocol_record = {
-            'title': protocol['title'],
-            'authors': protocol['authors'],
-            'url': protocol['url'],
-            'doi': protocol['doi'],
-        }
+    buffer.update(f'Protocols/{protocol_key}', protocol_record)
 
-        db.child(user['localId']).child('Protocols').update({protocol_key: protocol_record}, user['idToken'])
+    # Find papers associated with the protocol
 
-        # Find papers associated with the protocol
+    protocol_pub_records   = NN.getPublicationWithSearchTerm('"{0}"'.format(protocol_record['doi']))
+    protocol_pub_records_2 = NN.getPublicationWithSearchTerm('"{0}"'.format(protocol_record['url']))
+    protocol_pub_records.update(protocol_pub_records_2)
 
-        protocol_pub_records   = NN.getPublicationWithSearchTerm('"{0}"'.format(protocol_record['doi']))
-        protocol_pub_records_2 = NN.getPublicationWithSearchTerm('"{0}"'.format(protocol_record['url']))
-        protocol_pub_records.update(protocol_pub_records_2)
+    return uploadDirectPapers(protocol_pub_records, 'protocols', protocol_key)
 
-        for i, k in enumerate(protocol_pub_records, start=1):
-            print("---- Uploading paper : {0} / {1}".format(i, len(protocol_pub_records)))
+#--------------------------------------------------------------
+# uploadDirectPapers:
+# Upload papers directly associated with SPARC through 'edge_key' (the value of
+# their 'edge_field': datasets, awards or protocols). 'pub_records' is keyed by
+# doi. Returns the uploaded papers, keyed by paper key.
+#--------------------------------------------------------------
+def uploadDirectPapers(pub_records, edge_field, edge_key):
+    papers = {}
+    for i, k in enumerate(pub_records, start=1):
+        print("---- Uploading paper : {0} / {1}".format(i, len(pub_records)))
 
-            paper_key = k.translate(disallowed_chars)
-            protocol_pub_records[k]['protocols'] = [protocol_key]
-            protocol_pub_records[k]['citations']= 0
-            protocol_pub_records[k]['direct']   = True # indicate that this paper is directly associated with SPARC
+        paper_key = k.translate(disallowed_chars)
+        pub_records[k][edge_field] = [edge_key]
+        pub_records[k]['citations']= 0
+        pub_records[k]['direct']   = True # indicate that this paper is directly associated with SPARC
+        pub_records[k]['hops']     = 0
 
-            uploadPaperOrUpdate(paper_key, 'protocols', protocol_pub_records[k])
+        uploadPaperOrUpdate(paper_key, edge_field, pub_records[k])
+        papers[paper_key] = pub_records[k]
 
-    return
+    return papers
 
 #--------------------------------------------------------------
-# uploadCitations:
-# Find the citations for each direct paper in firebase, and uplaod them.
+# directPaperId:
+# Id used to find the citations of a paper (None if it has none).
 #--------------------------------------------------------------
-def uploadCitations(skip=0):
-    global user
-    global Timestamp
+def directPaperId(paper):
+    # 'pubmed' and 'pmid' are the pm_ids of the records of citing papers
+    for field in ('pm_id', 'pubmed', 'pmid'):
+        if (field in paper):
+            return str(paper[field])
+    if ('pmc_id' in paper):
+        return str(paper['pmc_id'])
+    return None
 
-    print('Processing citations...')
+#--------------------------------------------------------------
+# lookupCitations:
+# Find the citations of 'papers' (paper key -> id, see directPaperId), at 'hop'
+# hops from the direct papers, for the CitationExpander. The papers finished
+# before a restart are answered from the run journal, and with 'incremental' the
+# papers not due for a refresh are skipped. Returns the key -> id of the papers
+# citing each paper.
+#--------------------------------------------------------------
+def lookupCitations(papers, hop, incremental=False):
+    found   = {}
+    to_find = {}
+    for paper_key, paper_id in papers.items():
+        if journal.isDone('citations', paper_key):
+            found[paper_key] = journal.result('citations', paper_key) or {}
+        elif (not incremental or isDue(buffer.get(f'Papers/{paper_key}') or {})):
+            to_find[paper_key] = paper_id
+
+    found.update(uploadCitationsOf(to_find, hop))
+    return found
 
-    papers = db.child(user['localId']).child('Papers').get(user['idToken']).val()
+#--------------------------------------------------------------
+# uploadCitationsOf:
+# Find and upload the citations of papers at 'hop' hops from the direct papers.
+# 'direct_ids' maps the key of each paper to its id (see directPaperId). Only the
+# summaries of the citing papers missing from the database are fetched; the papers
+# already there only get the new edge. The number of citations and the time they
+# were checked are stored with each paper, and the smallest hop at which each
+# paper was reached in 'hops'. Returns the key -> id of the papers citing each paper.
+#--------------------------------------------------------------
+def uploadCitationsOf(direct_ids, hop=0):
+    checked_at  = int(time.time())
+    citedby_all = NN.getNewCitedByMany(
+        'pm_id', [id for id in direct_ids.values() if id is not None],
+        lambda doi: buffer.get('Papers/' + doi.translate(disallowed_chars)) is not None
+    )
 
-    curr_paper = 0
-    for paper_key in papers:
-        curr_paper += 1
+    found = {}
+    for curr_paper, paper_key in enumerate(direct_ids, start=1):
+        print("--- Processing paper ({0}/{1})".format(curr_paper, len(direct_ids)))
 
-        if (curr_paper < skip):
-            continue
+        citedby = citedby_all.get(direct_ids[paper_key], {})
 
-        # update the user token if its been more than 30 min
-        dt = time.time() - Timestamp
-        if (dt > 1800):
-            refreshed_user       = auth.refresh(user['refreshToken'])
-            user['idToken']      = refreshed_user['idToken']
-            user['refreshToken'] = refreshed_user['refreshToken']
-            Timestamp = time.time()
+        buffer.update(f'Papers/{paper_key}/citations', len(citedby))
+        buffer.update(f'Papers/{paper_key}/citations_checked_at', checked_at)
+        updateHops(paper_key, hop)
 
-        paper = papers[paper_key]
+        citers = {}
+        for i, kk in enumerate(citedby, start=1):
+            print("---- Uploading citation {0}/{1}".format(i, len(citedby)))
 
-        # Ignore if the paper is not directly connected to SPARC
-        if ('direct' not in paper or paper['direct'] != True):
-            continue
+            # Known papers (None) only need the edge to this paper
+            citation = citedby[kk] or {}
+            citation['papers'] = [paper_key]
+            citation['direct'] = False
+            citation['hops']   = hop + 1
 
-        print("--- Processing paper ({0}/{1})".format(curr_paper, len(papers)))
+            citer_key = kk.translate(disallowed_chars)
+            uploadPaperOrUpdate(citer_key, 'papers', citation)
+            updateHops(citer_key, hop + 1)
 
-        citedby = {}
-        if ('pm_id' in paper):
-            citedby = NN.getCitedBy('pm_id', paper['pm_id'])
-        elif ('pmc_id' in paper):
-            citedby = NN.getCitedBy('pm_id', paper['pmc_id'])
+            citers[citer_key] = directPaperId(buffer.get(f'Papers/{citer_key}') or citation)
 
-        db.child(user['localId']).child('Papers').child(paper_key).update({'citations': len(citedby)}, user['idToken'])
+        # The citing papers are kept so that a restarted run can expand them
+        journal.markDone('citations', paper_key, citers)
+        found[paper_key] = citers
+    return found
 
-        for i, kk in enumerate(citedby, start=1):
-            print("---- Uploading citation {0}/{1}".format(i, len(citedby)))
-
-            citedby[kk]['papers']   = [paper_key]
-            citedby[kk]['direct']   = False
-            uploadPaperOrUpdate(kk.translate(disallowed_chars), 'papers', citedby[kk])
+#--------------------------------------------------------------
+# updateHops:
+# Store 'hop' as the hop distance of a paper from the direct papers, unless it
+# was reached at a smaller hop before. Direct papers are at hop 0.
+#--------------------------------------------------------------
+def updateHops(paper_key, hop):
+    paper = buffer.get(f'Papers/{paper_key}') or {}
+    if (paper.get('direct') == True):
+        hop = 0
 
+    if (paper.get('hops') is None or hop < paper['hops']):
+        buffer.update(f'Papers/{paper_key}/hops', hop)
     return
 
 #-----------------------------------------------------------------------------------
 # uploadPaperOrUpdate:
 # Upload the given paper record 'newPaper' to the database if does not exist. If it
 # exists, update the field (list) stipulated by 'update_key' (which can be datasets,
-# awards, or papers) by appending the values in 'newPaper'.
+# awards, or papers) by appending the values in 'newPaper'. The write is buffered,
+# and the paper is looked up in the snapshot of the buffer instead of the database.
 #-----------------------------------------------------------------------------------
 def uploadPaperOrUpdate (paper_key, update_key, newPaper):
-    # See if the db already has this paper
-    pub_data = db.child(user['localId']).child('Papers').child(paper_key).get(user['idToken']).val()
-    if pub_data is None:
-        # The db does not have this paper
-        db.child(user['localId']).child('Papers').update({paper_key: newPaper}, user['idToken'])
-    else:
-        # The db has this paper. Only update the datasets field
-        if (update_key in pub_data):
-            update_field = pub_data[update_key]
-            update_field += newPaper[update_key]
-        else:
-            update_field = newPaper[update_key]
-        
-        update_field = set(update_field) # remove duplicates
-        db.child(user['localId']).child('Papers').child(paper_key).update({update_key: list(update_field)}, user['idToken'])
+    buffer.mergePaper(paper_key, update_key, newPaper)
     return
 
+#--------------------------------------------------------------
+# runPipeline:
+# Run the given stages ('datasets', 'awards', 'protocols', 'citations')
+# concurrently on a Scheduler. Each dataset submits the search of its papers and
+# protocols as soon as it is uploaded, and its award is searched with the next
+# HARVEST_AWARD_BATCH_SIZE awards; the citations of a direct paper are searched
+# as soon as the paper is known, HARVEST_CITATION_BATCH_SIZE papers at a time.
+# At most 'max_workers' tasks run at once, and at most as many tasks per host as
+# the host allows requests per second. The units of work are recorded in
+# 'report' (a new RunReport if None), which is returned. With 'incremental',
+# only the papers due for a refresh have their citations checked. With a
+# 'max_depth' (HARVEST_CITATION_DEPTH) above 1, the citations found are then
+# expanded hop by hop, until 'call_budget' (HARVEST_CALL_BUDGET) requests were
+# sent by the expansion (see Harvest/citation_expansion.py).
+#--------------------------------------------------------------
+def runPipeline(stages=STAGES, max_workers=None, citation_batch_size=None, report=None, incremental=False,
+                max_depth=None, call_budget=None):
+    print('Processing {0}...'.format(', '.join(stages)))
+
+    report = report or RunReport()
+
+    max_workers         = max_workers or int(config('HARVEST_CONCURRENCY', 8))
+    citation_batch_size = citation_batch_size or int(config('HARVEST_CITATION_BATCH_SIZE', 200))
+    award_batch_size    = int(config('HARVEST_AWARD_BATCH_SIZE', 50))
+    max_depth           = max_depth or int(config('HARVEST_CITATION_DEPTH', 1))
+    if (call_budget is None and config('HARVEST_CALL_BUDGET')):
+        call_budget = int(config('HARVEST_CALL_BUDGET'))
+
+    rate_limiter = getSharedRateLimiter()
+    limits = {host: max(1, math.ceil(rate_limiter.getRate(host))) for host in (NCBI_HOST, NIH_REPORTER_API)}
+
+    with Scheduler(max_workers=max_workers, limits=limits, default_limit=max(1, max_workers // 2)) as scheduler:
+        lock      = threading.Lock()
+        awards    = set()
+        citations = set()
+        cited     = {} # key -> id of the papers citing the direct papers (hop 1)
+
+        def addCited(found):
+            with lock:
+                for citers in found.values():
+                    cited.update(citers)
+
+        def harvestCitations(batch):
+            with report.unit('citations', len(batch)):
+                addCited(uploadCitationsOf(dict(batch)))
+
+        citation_queue = BatchQueue(scheduler, harvestCitations, citation_batch_size, resource=NCBI_HOST)
+
+        def addCitations(papers):
+            if 'citations' not in stages:
+                return papers
+            for paper_key, paper in papers.items():
+                if (max_depth > 1 and journal.isDone('citations', paper_key)):
+                    addCited({paper_key: journal.result('citations', paper_key) or {}})
+                with lock:
+                    if (paper_key in citations or journal.isDone('citations', paper_key)):
+                        continue
+                    if (incremental and not isDue(buffer.get(f'Papers/{paper_key}') or paper)):
+                        continue
+                    citations.add(paper_key)
+                citation_queue.add((paper_key, directPaperId(paper)))
+            return papers
+
+        def addAward(award_num):
+            with lock:
+                if (not award_num or award_num in awards or journal.isDone('awards', award_num)):
+                    return
+                awards.add(award_num)
+            award_queue.add(award_num)
+
+        def harvestAwards(batch):
+            award_records = NN.getProjectFundingDetailsMany(batch)
+            for award_num in batch:
+                with report.unit('awards'):
+                    addCitations(uploadAward(award_num, award_records.get(award_num, {})))
+                    journal.markDone('awards', award_num)
+
+        award_queue = BatchQueue(scheduler, harvestAwards, award_batch_size, resource=NIH_REPORTER_API)
+
+        def datasetDone(dataset_key, dataset_record):
+            journal.markDone('datasets', dataset_key, {'award': dataset_record['award']})
+            report.unitDone('datasets')
+
+        def harvestDataset(dataset):
+            report.unitStarted('datasets')
+            dataset_key, dataset_record = uploadDataset(dataset)
+
+            tasks = [scheduler.submit(lambda: addCitations(uploadDatasetPapers(dataset_key, dataset)), resource=NCBI_HOST)]
+            tasks += [
+                scheduler.submit(lambda doi: addCitations(uploadDatasetProtocol(doi)), protocol_doi, resource=NCBI_HOST)
+                for protocol_doi in dataset['protocolsDOI']
+            ]
+            scheduler.whenAll(tasks, lambda: datasetDone(dataset_key, dataset_record))
+
+            if 'awards' in stages:
+                addAward(dataset_record['award'])
+
+        def harvestDatasets():
+            # Each dataset is uploaded as soon as it is downloaded
+            for dataset in SPARC.iter_datasets_with_metadata():
+                dataset_key = dataset['datasetDOI'].translate(disallowed_chars)
+
+                # Skip the datasets finished before a restart, but not their awards
+                if journal.isDone('datasets', dataset_key):
+                    if 'awards' in stages:
+                        addAward(journal.result('datasets', dataset_key)['award'])
+                    continue
+
+                scheduler.submit(harvestDataset, dataset)
+
+        def expandCitations(papers, hop):
+            with report.unit('citations', len(papers)):
+                return lookupCitations(papers, hop, incremental)
+
+        def harvestProtocol(protocol):
+            with report.unit('protocols'):
+                addCitations(uploadProtocol(protocol))
+                journal.markDone('protocols', protocolKey(protocol))
+
+        def harvestProtocols():
+            # Each page of protocols is uploaded as soon as it arrives
+            for protocol in SPARC.iter_protocols(config('PROTOCOLS_IO_KEY')):
+                protocol_key = protocolKey(protocol)
+                if (protocol_key is not None and not journal.isDone('protocols', protocol_key)):
+                    scheduler.submit(harvestProtocol, protocol, resource=NCBI_HOST)
+
+        # The direct papers already in the database need their citations too
+        addCitations({key: paper for key, paper in (buffer.get('Papers') or {}).items() if paper.get('direct') == True})
+
+        if ('datasets' in stages):
+            scheduler.submit(harvestDatasets, resource=PENNSIEVE_HOST)
+        if ('protocols' in stages):
+            scheduler.submit(harvestProtocols, resource=PROTOCOLS_IO)
+
+        try:
+            scheduler.wait()
+
+            # The next hops are expanded once all the direct papers are known
+            if ('citations' in stages and max_depth > 1):
+                expander = CitationExpander(expandCitations, max_depth, call_budget, batch_size=citation_batch_size)
+                expander.visit(citations, 0)
+                expander.expand({key: id for key, id in cited.items() if key not in citations}, hop=1)
+                report.addSection('expansion', expander.stats)
+        finally:
+            buffer.flush()
+
+            # Readers of the graph poll its version instead of downloading it
+            if buffer.flushed:
+                markUpdated(store)
+
+    return report
+
+#--------------------------------------------------------------
+# headless:
+# Non-interactive entry point (see README.md). The credentials and settings are
+# read from the environment or .env, and the stages and store from the command
+# line. Progress goes to stderr, and a JSON report of the run (see RunReport) to
+# stdout and, optionally, to a file.
+#--------------------------------------------------------------
+def headless(argv=None):
+    parser = argparse.ArgumentParser(description='Harvest the SPARC graph without prompts.')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='Comma separated stages to run, among {0} (default: all)'.format(', '.join(STAGES)))
+    parser.add_argument('--store', choices=('firebase', 'local', 'sync'), default='local',
+                        help='Write to Firebase, to the local database, or to the local database and then push the changes to Firebase')
+    parser.add_argument('--concurrency', type=int, help='Number of concurrent tasks (default: HARVEST_CONCURRENCY or 8)')
+    parser.add_argument('--batch-size', type=int, help='Paths per write to the store (default: FIREBASE_BATCH_SIZE or 500)')
+    parser.add_argument('--citation-batch-size', type=int,
+                        help='Papers per citation search (default: HARVEST_CITATION_BATCH_SIZE or 200)')
+    parser.add_argument('--fresh', action='store_true', help='Start a new run instead of resuming the last unfinished one')
+    parser.add_argument('--depth', type=int,
+                        help='Hops of citations to find from the direct papers (default: HARVEST_CITATION_DEPTH or 1)')
+    parser.add_argument('--call-budget', type=int,
+                        help='Maximum number of requests sent to expand the citations beyond the first hop (default: HARVEST_CALL_BUDGET)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only check the citations of the papers due for a refresh (recent papers more often)')
+    parser.add_argument('--dry-run', action='store_true', help='With --store sync, report the changes without pushing them')
+    parser.add_argument('--report', help='Also write the report to this file')
+    args = parser.parse_args(argv)
+
+    stages = tuple(stage.strip() for stage in args.stages.split(',') if stage.strip())
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if (unknown or not stages):
+        parser.error('unknown stages: {0}'.format(', '.join(unknown) or args.stages))
+
+    firebase_store = None
+    if (args.store == 'firebase'):
+        graph_store = connectFirebase(interactive=False)
+    else:
+        graph_store = openLocalStore()
+        if (args.store == 'sync'):
+            firebase_store = connectFirebase(interactive=False)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        useStore(graph_store, batch_size=args.batch_size, resume=not args.fresh)
+        report = runPipeline(
+            stages, max_workers=args.concurrency, citation_batch_size=args.citation_batch_size, incremental=args.incremental,
+            max_depth=args.depth, call_budget=args.call_budget
+        )
+        journal.finishRun()
+
+        sync_summary = None
+        if firebase_store is not None:
+            updates, sync_summary = planSync(store, firebase_store)
+            sync_summary['dry_run'] = args.dry_run
+            if not args.dry_run:
+                pushUpdates(firebase_store, updates, args.batch_size or int(config('FIREBASE_BATCH_SIZE', 500)))
+
+    result = report.build()
+    result['run_id'] = journal.run_id
+    result['resumed'] = journal.resumed
+    result['writes'] = {'updates': buffer.writes, 'paths': buffer.flushed}
+    result['dedup'] = NN.getDedupStats()
+    if sync_summary is not None:
+        result['sync'] = sync_summary
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(output)
+    return result
 
 def main():
     print('-------------------------------------')
@@ -352,21 +610,49 @@ def main():
     print('[2] Protocols')
     print('[3] Citations')
     print('[4] Datasets + Awards + Protocols + Citations')
+    print('[5] Push the changes of the local database to Firebase')
 
     x = input(': ')
+    if (x == '5'):
+        syncToFirebase(openLocalStore(), connectFirebase())
+        return
+
+    print('Enter the database to write to.')
+    print('[1] Firebase')
+    print('[2] Local database ({0})'.format(config('GRAPH_STORE_PATH', DEFAULT_STORE_PATH)))
+    print('[3] Local database, then push the changes to Firebase')
+
+    y = input(': ')
+    firebase_store = None
+    if (y == '2' or y == '3'):
+        useStore(openLocalStore())
+        if (y == '3'):
+            firebase_store = connectFirebase()
+    else:
+        useStore(connectFirebase())
+
+    # The stages run concurrently (see runPipeline)
     if (x == '1'):
-        award_list = uploadDatasets()
-        uploadAwards(award_list)
+        runPipeline(('datasets', 'awards'))
     elif (x == '2'):
-        uploadProtocols()
+        runPipeline(('protocols',))
     elif (x == '3'):
-        uploadCitations()
+        runPipeline(('citations',))
     else:
-        award_list = uploadDatasets()
-        uploadAwards(award_list)
-        uploadProtocols()
-        uploadCitations()
+        runPipeline(STAGES)
+
+    journal.finishRun()
+
+    if firebase_store is not None:
+        syncToFirebase(store, firebase_store)
+
+    for method, stats in NN.getDedupStats().items():
+        print(f"{method}: {stats['hits'] + stats['waits']} of {stats['calls']} calls deduplicated")
     return
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Any argument selects the headless entry point
+    if (len(sys.argv) > 1):
+        headless()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,121 @@
+#-----------------------------------------------------------------------------
+# delta_sync.py:
+# Push only what changed. The desired graph (e.g. a harvest staged in a local
+# SQLiteStore) is compared with one snapshot of the target store, and only the
+# added or changed paths are written, down to the fields of each record.
+#-----------------------------------------------------------------------------
+
+import json
+
+from GraphStore.graph_store import NODES, markUpdated, prune, splitPath
+
+#----------------------------------------------------
+# _normalize:
+# Comparable form of a value. Firebase returns a list with missing indices as a
+# dict keyed by index, and the lists of the graph (edges, tags, ...) are sets,
+# so lists are compared regardless of their order.
+#----------------------------------------------------
+def _normalize(value):
+    if (isinstance(value, dict) and value and all(str(k).isdigit() for k in value)):
+        value = [value[k] for k in sorted(value, key=int)]
+
+    if isinstance(value, list):
+        return sorted(json.dumps(_normalize(v), sort_keys=True) for v in value)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    return value
+
+#----------------------------------------------------
+# diffGraph:
+# Multi-path update (path -> value) turning 'current' into 'desired', two graphs
+# as returned by GraphStore.snapshot. Records and fields are compared
+# recursively, and a value is only written if it is new or different. Values
+# missing from 'desired' are kept, unless 'delete' is True.
+#----------------------------------------------------
+def diffGraph(current, desired, delete=False):
+    updates = {}
+    _diff(prune(current) or {}, prune(desired) or {}, [], updates, delete)
+    return updates
+
+def _diff(current, desired, parts, updates, delete):
+    for key, value in desired.items():
+        path = parts + [str(key)]
+        old  = current.get(key)
+
+        if (isinstance(value, dict) and isinstance(old, dict)):
+            _diff(old, value, path, updates, delete)
+        elif (_normalize(old) != _normalize(value)):
+            updates['/'.join(path)] = value
+
+    if delete:
+        for key in current:
+            if key not in desired:
+                updates['/'.join(parts + [str(key)])] = None
+
+#----------------------------------------------------
+# summarizeDiff:
+# Number of records added, changed and deleted in each node by the update
+# 'updates' of the graph 'current', along with the number of paths written and
+# the size of the update in bytes.
+#----------------------------------------------------
+def summarizeDiff(current, updates):
+    nodes = {node: {'added': 0, 'changed': 0, 'deleted': 0} for node in NODES}
+
+    changed = set()
+    for path, value in updates.items():
+        parts = splitPath(path)
+        node  = nodes.setdefault(parts[0], {'added': 0, 'changed': 0, 'deleted': 0})
+
+        if (len(parts) == 1):
+            node['added']   += len(value or {})
+            node['deleted'] += len(current.get(parts[0]) or {}) if value is None else 0
+        elif (value is None and len(parts) == 2):
+            node['deleted'] += 1
+        elif ((current.get(parts[0]) or {}).get(parts[1]) is None):
+            node['added'] += 1
+        elif (parts[0], parts[1]) not in changed:
+            changed.add((parts[0], parts[1]))
+            node['changed'] += 1
+
+    return {
+        'nodes': nodes,
+        'paths': len(updates),
+        'bytes': len(json.dumps(updates).encode()),
+    }
+
+#----------------------------------------------------
+# planSync:
+# Compare one snapshot of 'target' with the graph of 'source'. Returns the
+# update to write to 'target' (see diffGraph) and its summary (see summarizeDiff).
+#----------------------------------------------------
+def planSync(source, target, delete=False):
+    current = target.snapshot()
+    updates = diffGraph(current, source.snapshot(), delete=delete)
+    return updates, summarizeDiff(current, updates)
+
+#----------------------------------------------------
+# pushUpdates:
+# Write a multi-path update to 'target', 'batch_size' paths at a time, then
+# update its version (see markUpdated) if anything was written.
+#----------------------------------------------------
+def pushUpdates(target, updates, batch_size=500):
+    paths = list(updates)
+    for start in range(0, len(paths), batch_size):
+        target.bulkUpdate({path: updates[path] for path in paths[start:start + batch_size]})
+
+    if paths:
+        markUpdated(target)
+
+#----------------------------------------------------
+# deltaSync:
+# Write to 'target' the changes needed for it to hold the graph of 'source'.
+# With 'dry_run', nothing is written. Returns the summary of the changes (see
+# summarizeDiff).
+#----------------------------------------------------
+def deltaSync(source, target, dry_run=False, delete=False, batch_size=500):
+    updates, summary = planSync(source, target, delete=delete)
+    summary['dry_run'] = dry_run
+
+    if not dry_run:
+        pushUpdates(target, updates, batch_size)
+    return summary
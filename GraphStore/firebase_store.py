@@ -0,0 +1,80 @@
+#-----------------------------------------------------------------------------
+# firebase_store.py:
+# GraphStore kept in the Firebase real-time database, under the node of the
+# signed in user. The id token is refreshed before it expires.
+#-----------------------------------------------------------------------------
+
+import time
+import threading
+import pyrebase
+
+from GraphStore.graph_store import GraphStore, NODES, splitPath
+
+TOKEN_LIFETIME = 1800 # refresh the id token after 30 minutes (it expires after one hour)
+
+class FirebaseStore(GraphStore):
+
+    #----------------------------------------------------
+    # __init__:
+    # Sign in to the Firebase app given by 'config' (see firebaseConfig in
+    # FirebaseImplementation.py) with an email and password.
+    #----------------------------------------------------
+    def __init__(self, config, email, password):
+        firebase   = pyrebase.initialize_app(config)
+        self._url  = config.get('databaseURL')
+        self._auth = firebase.auth()
+        self._db   = firebase.database()
+
+        # pyrebase builds the path of a request in the database object itself, so
+        # requests are sent one at a time
+        self._lock      = threading.Lock()
+        self._user      = self._auth.sign_in_with_email_and_password(email, password)
+        self._signed_in = time.time()
+
+    #----------------------------------------------------
+    # _token:
+    # The id token of the user, refreshed if it is more than TOKEN_LIFETIME old.
+    #----------------------------------------------------
+    def _token(self):
+        if (time.time() - self._signed_in > TOKEN_LIFETIME):
+            refreshed_user             = self._auth.refresh(self._user['refreshToken'])
+            self._user['idToken']      = refreshed_user['idToken']
+            self._user['refreshToken'] = refreshed_user['refreshToken']
+            self._signed_in            = time.time()
+        return self._user['idToken']
+
+    def storeId(self):
+        return 'firebase:{0}/{1}'.format(self._url, self._user['localId'])
+
+    def _ref(self, path):
+        return self._db.child(self._user['localId'], *splitPath(path))
+
+    def get(self, path):
+        with self._lock:
+            return self._ref(path).get(self._token()).val()
+
+    def update(self, path, fields):
+        with self._lock:
+            self._ref(path).update(fields, self._token())
+
+    #----------------------------------------------------
+    # bulkUpdate:
+    # Send all the paths as a single multi-path update.
+    #----------------------------------------------------
+    def bulkUpdate(self, updates):
+        if not updates:
+            return
+
+        with self._lock:
+            self._ref('').update(updates, self._token())
+
+    #----------------------------------------------------
+    # snapshot:
+    # See GraphStore.snapshot. The whole graph is read with a single request.
+    #----------------------------------------------------
+    def snapshot(self, node=None):
+        if node is not None:
+            return super().snapshot(node)
+
+        graph = self.get('') or {}
+        return {node: graph.get(node) or {} for node in NODES}
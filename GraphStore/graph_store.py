@@ -0,0 +1,115 @@
+#-----------------------------------------------------------------------------
+# graph_store.py:
+# Interface of the databases holding the SPARClink graph. The graph is a tree
+# with the Datasets, Awards, Protocols and Papers nodes at the top, each holding
+# one record per key (e.g. 'Papers/<paper_key>'). Paths are '/' separated, and
+# the semantics are those of the Firebase real-time database: writing None (or
+# an empty list or dict) deletes a value.
+#-----------------------------------------------------------------------------
+
+import time
+from abc import ABC, abstractmethod
+
+NODES = ('Datasets', 'Awards', 'Protocols', 'Papers')
+
+# Small node changed with every write of a harvest or sync, so that readers
+# (e.g. the search index) can tell whether the graph changed without
+# downloading it. It is not part of the graph (see NODES).
+VERSION_PATH = 'Meta/version'
+
+#----------------------------------------------------
+# splitPath:
+# List of the parts of a path, ignoring leading, trailing and repeated '/'.
+#----------------------------------------------------
+def splitPath(path):
+    return [part for part in str(path or '').split('/') if part]
+
+#----------------------------------------------------
+# prune:
+# Remove the None values and empty lists and dicts from a value, as Firebase
+# does when storing it. Returns None if nothing is left.
+#----------------------------------------------------
+def prune(value):
+    if isinstance(value, dict):
+        value = {k: v for k, v in ((k, prune(v)) for k, v in value.items()) if v is not None}
+    elif isinstance(value, (list, tuple)):
+        value = [v for v in (prune(v) for v in value) if v is not None]
+    else:
+        return value
+
+    return value if value else None
+
+#----------------------------------------------------
+# markUpdated:
+# Set the version of the graph held by 'store' to the current time (in ms).
+#----------------------------------------------------
+def markUpdated(store):
+    store.bulkUpdate({VERSION_PATH: int(time.time() * 1000)})
+
+class GraphStore(ABC):
+
+    #----------------------------------------------------
+    # get:
+    # Value at 'path' (e.g. 'Papers/<key>' or 'Papers/<key>/datasets'), or None if
+    # there is none.
+    #----------------------------------------------------
+    @abstractmethod
+    def get(self, path):
+        pass
+
+    #----------------------------------------------------
+    # update:
+    # Set the children of 'path' given in the dict 'fields', leaving the other
+    # children untouched.
+    #----------------------------------------------------
+    def update(self, path, fields):
+        self.bulkUpdate({'/'.join(splitPath(path) + [str(key)]): value for key, value in fields.items()})
+
+    #----------------------------------------------------
+    # bulkUpdate:
+    # Set the value of every path of the dict 'updates' (path -> value) at once. No
+    # path may be the ancestor of another.
+    #----------------------------------------------------
+    @abstractmethod
+    def bulkUpdate(self, updates):
+        pass
+
+    #----------------------------------------------------
+    # storeId:
+    # Identity of the database the store writes to, e.g. the file of a SQLiteStore.
+    # A run journal only resumes a run made against the same store.
+    #----------------------------------------------------
+    def storeId(self):
+        return type(self).__name__
+
+    #----------------------------------------------------
+    # snapshot:
+    # Value of a top level node (e.g. 'Papers'), or of the whole graph (a dict keyed
+    # by node) if 'node' is None. Empty nodes are returned as empty dicts.
+    #----------------------------------------------------
+    def snapshot(self, node=None):
+        if node is None:
+            return {node: self.snapshot(node) for node in NODES}
+        return self.get(node) or {}
+
+#----------------------------------------------------
+# copyGraph:
+# Copy every record of 'source' to 'target', e.g. to push a harvest staged in a
+# local SQLiteStore to Firebase. The records are sent 'batch_size' at a time.
+# Returns the number of records copied.
+#----------------------------------------------------
+def copyGraph(source, target, batch_size=500):
+    updates = {}
+    copied  = 0
+    for node in NODES:
+        for key, record in source.snapshot(node).items():
+            updates[f'{node}/{key}'] = record
+            if (len(updates) >= batch_size):
+                target.bulkUpdate(updates)
+                copied += len(updates)
+                updates = {}
+
+    if updates:
+        target.bulkUpdate(updates)
+        copied += len(updates)
+    return copied
@@ -0,0 +1,131 @@
+#-----------------------------------------------------------------------------
+# sqlite_store.py:
+# GraphStore kept in a local SQLite file, with the same semantics as the
+# Firebase database. Each record (e.g. 'Papers/<key>') is a JSON document in
+# one row, indexed by node and key, so a harvest can be run, tested and
+# profiled offline, and pushed to Firebase afterwards (see copyGraph).
+#-----------------------------------------------------------------------------
+
+import os
+import json
+import sqlite3
+import threading
+from contextlib import closing
+
+from GraphStore.graph_store import GraphStore, NODES, prune, splitPath
+
+DEFAULT_STORE_PATH = os.path.join('.cache', 'graph.sqlite')
+
+class SQLiteStore(GraphStore):
+
+    #----------------------------------------------------
+    # __init__:
+    # 'path' is the SQLite file holding the graph.
+    #----------------------------------------------------
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path  = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self.__connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS records ('
+                ' node TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (node, key))'
+                ' WITHOUT ROWID'
+            )
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def storeId(self):
+        return 'sqlite:' + os.path.abspath(self.path)
+
+    #----------------------------------------------------
+    # get:
+    # See GraphStore.get. The root path ('') gives the whole graph.
+    #----------------------------------------------------
+    def get(self, path):
+        parts = splitPath(path)
+
+        with closing(self.__connect()) as conn:
+            if not parts:
+                graph = {node: self.__node(conn, node) for node in NODES}
+                return prune(graph)
+
+            if (len(parts) == 1):
+                return self.__node(conn, parts[0]) or None
+
+            value = self.__record(conn, parts[0], parts[1])
+
+        for part in parts[2:]:
+            if isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                value = value[int(part)]
+            elif isinstance(value, dict):
+                value = value.get(part)
+            else:
+                return None
+        return value
+
+    #----------------------------------------------------
+    # bulkUpdate:
+    # See GraphStore.bulkUpdate. All the paths are written in one transaction.
+    #----------------------------------------------------
+    def bulkUpdate(self, updates):
+        with self._lock, closing(self.__connect()) as conn, conn:
+            for path, value in updates.items():
+                self.__set(conn, splitPath(path), value)
+
+    def __node(self, conn, node):
+        rows = conn.execute('SELECT key, value FROM records WHERE node = ?', (node,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def __record(self, conn, node, key):
+        row = conn.execute('SELECT value FROM records WHERE node = ? AND key = ?', (node, key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    #----------------------------------------------------
+    # __set:
+    # Set the value at the path given by 'parts'. Values below a record are set by
+    # rewriting the whole record.
+    #----------------------------------------------------
+    def __set(self, conn, parts, value):
+        value = prune(value)
+
+        if not parts:
+            conn.execute('DELETE FROM records')
+            for node, records in (value or {}).items():
+                self.__set(conn, [node], records)
+            return
+
+        if (len(parts) == 1):
+            conn.execute('DELETE FROM records WHERE node = ?', (parts[0],))
+            for key, record in (value or {}).items():
+                self.__set(conn, [parts[0], str(key)], record)
+            return
+
+        node, key = parts[0], parts[1]
+        if (len(parts) > 2):
+            record = self.__record(conn, node, key)
+            if not isinstance(record, dict):
+                record = {} if not isinstance(record, list) else {str(i): v for i, v in enumerate(record)}
+
+            parent = record
+            for part in parts[2:-1]:
+                if isinstance(parent.get(part), list):
+                    parent[part] = {str(i): v for i, v in enumerate(parent[part])}
+                elif not isinstance(parent.get(part), dict):
+                    parent[part] = {}
+                parent = parent[part]
+            parent[parts[-1]] = value
+            value = prune(record)
+
+        if value is None:
+            conn.execute('DELETE FROM records WHERE node = ? AND key = ?', (node, key))
+        else:
+            conn.execute(
+                'INSERT OR REPLACE INTO records (node, key, value) VALUES (?, ?, ?)', (node, key, json.dumps(value))
+            )
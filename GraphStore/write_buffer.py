@@ -0,0 +1,169 @@
+#-----------------------------------------------------------------------------
+# write_buffer.py:
+# Write-behind buffer for a GraphStore. Writes are kept in memory and
+# sent as multi-path updates ({'Papers/<key>/datasets': [...], ...}) once
+# 'batch_size' paths are pending. The edge lists of the papers (datasets,
+# awards, protocols, papers) are merged locally with set semantics, against a
+# snapshot of the node read once, instead of reading every paper before
+# updating it.
+#-----------------------------------------------------------------------------
+
+import copy
+import threading
+
+#----------------------------------------------------
+# asList:
+# Values of a list stored in the database. Firebase returns a list with
+# missing indices as a dict, so both forms are accepted.
+#----------------------------------------------------
+def asList(value):
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        return list(value.values())
+    if isinstance(value, (list, tuple, set)):
+        return [v for v in value if v is not None]
+    return [value]
+
+class WriteBuffer:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'store'      : GraphStore the writes are sent to.
+    # 'batch_size' : Number of pending paths after which the buffer is flushed.
+    #----------------------------------------------------
+    def __init__(self, store, batch_size=500):
+        self.store      = store
+        self.batch_size = batch_size
+
+        self._lock      = threading.RLock()
+        self._nodes     = {} # top level node -> local view of its value, read on first use
+        self._pending   = {} # path -> value, with no path being the ancestor of another
+        self._listeners = []
+
+        self.writes  = 0 # number of multi-path updates sent
+        self.flushed = 0 # number of paths sent
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    #----------------------------------------------------
+    # get:
+    # Value at 'path' (e.g. 'Papers/<key>'), including the writes not yet flushed.
+    # Returns None if there is no value.
+    #----------------------------------------------------
+    def get(self, path):
+        with self._lock:
+            parts = path.split('/')
+            value = self.__node(parts[0])
+            for part in parts[1:]:
+                if not isinstance(value, dict):
+                    return None
+                value = value.get(part)
+            return copy.deepcopy(value)
+
+    #----------------------------------------------------
+    # update:
+    # Set the value at 'path', replacing what was there. Flushes the buffer once
+    # 'batch_size' paths are pending.
+    #----------------------------------------------------
+    def update(self, path, value):
+        with self._lock:
+            parts = path.split('/')
+            self.__setLocal(parts, value)
+            self.__setPending(parts, value)
+
+            if (len(self._pending) >= self.batch_size):
+                self.flush()
+
+    #----------------------------------------------------
+    # mergePaper:
+    # Add the paper record 'new_paper' to the Papers node if it is not there yet.
+    # If it is, add the values of its 'edge_field' list (datasets, awards, protocols
+    # or papers) to the values already stored, without duplicates. Nothing is
+    # written if the paper already has all of them.
+    #----------------------------------------------------
+    def mergePaper(self, paper_key, edge_field, new_paper):
+        with self._lock:
+            paper = self.get(f'Papers/{paper_key}')
+            if paper is None:
+                self.update(f'Papers/{paper_key}', new_paper)
+                return
+
+            existing = asList(paper.get(edge_field))
+            merged   = list(dict.fromkeys(existing + asList(new_paper.get(edge_field))))
+            if (merged != existing):
+                self.update(f'Papers/{paper_key}/{edge_field}', merged)
+
+    #----------------------------------------------------
+    # addFlushListener:
+    # Call 'listener' (without arguments) after every flush, once all the writes
+    # made so far are stored.
+    #----------------------------------------------------
+    def addFlushListener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    #----------------------------------------------------
+    # flush:
+    # Send the pending writes to the database as a single multi-path update.
+    #----------------------------------------------------
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self.store.bulkUpdate(self._pending)
+                self.writes  += 1
+                self.flushed += len(self._pending)
+                self._pending = {}
+
+            for listener in self._listeners:
+                listener()
+
+    def __node(self, node):
+        if node not in self._nodes:
+            self._nodes[node] = self.store.snapshot(node)
+        return self._nodes[node]
+
+    #----------------------------------------------------
+    # __setLocal:
+    # Apply a write to the local view of the database.
+    #----------------------------------------------------
+    def __setLocal(self, parts, value):
+        if (len(parts) == 1):
+            self._nodes[parts[0]] = copy.deepcopy(value) or {}
+            return
+
+        parent = self.__node(parts[0])
+        for part in parts[1:-1]:
+            if not isinstance(parent.get(part), dict):
+                parent[part] = {}
+            parent = parent[part]
+        parent[parts[-1]] = copy.deepcopy(value)
+
+    #----------------------------------------------------
+    # __setPending:
+    # Add a write to the pending paths. A multi-path update may not contain a path
+    # and one of its ancestors, so a write below a pending path is applied to the
+    # pending value, and a write above pending paths replaces them.
+    #----------------------------------------------------
+    def __setPending(self, parts, value):
+        for i in range(1, len(parts)):
+            ancestor = '/'.join(parts[:i])
+            if ancestor in self._pending:
+                parent = self._pending[ancestor]
+                if not isinstance(parent, dict):
+                    parent = self._pending[ancestor] = {}
+                for part in parts[i:-1]:
+                    if not isinstance(parent.get(part), dict):
+                        parent[part] = {}
+                    parent = parent[part]
+                parent[parts[-1]] = copy.deepcopy(value)
+                return
+
+        path = '/'.join(parts)
+        for pending_path in [p for p in self._pending if p.startswith(path + '/')]:
+            del self._pending[pending_path]
+        self._pending[path] = copy.deepcopy(value)
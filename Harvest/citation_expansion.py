@@ -0,0 +1,122 @@
+#-----------------------------------------------------------------------------
+# citation_expansion.py:
+# Breadth-first expansion of the citation graph, hop by hop: the direct papers
+# are at hop 0, the papers citing them at hop 1, the papers citing those at hop
+# 2, and so on. Every paper is visited once, at its smallest hop, and the
+# papers of a hop are looked up in batches. The expansion stops at 'max_depth'
+# hops, or once 'call_budget' HTTP requests were sent by the lookups: the
+# batches are shrunk to the papers the rest of the budget can pay for, at the
+# number of requests per paper of the last lookup. The budget is a soft limit,
+# as a lookup may cost more per paper than the previous one.
+#-----------------------------------------------------------------------------
+
+from ExternalAPIs.http_client import HTTP_STATS
+
+#----------------------------------------------------
+# httpRequests:
+# Number of HTTP requests sent so far by the calling thread (see HTTP_STATS), so
+# that the requests of other clients and of the background refreshes of the
+# cache are not charged to the expansion.
+#----------------------------------------------------
+def httpRequests():
+    return HTTP_STATS.threadRequests()
+
+class CitationExpander:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'lookup'      : lookup(papers, hop) finds the citations of 'papers' (paper key
+    #                 -> id), all at 'hop', and returns, for each of them, a dict of
+    #                 the key -> id of the papers citing it (the id is None if their
+    #                 citations cannot be looked up).
+    # 'max_depth'   : Largest hop to reach (1 to only find the citations of the seeds).
+    # 'call_budget' : Maximum number of HTTP requests to send (None for no limit).
+    # 'calls'       : calls() is the number of requests sent so far (see httpRequests);
+    #                 only its increase during each lookup counts.
+    # 'batch_size'  : Largest number of papers per lookup.
+    #----------------------------------------------------
+    def __init__(self, lookup, max_depth=1, call_budget=None, calls=httpRequests, batch_size=200):
+        self.lookup      = lookup
+        self.max_depth   = max_depth
+        self.call_budget = call_budget
+        self.calls       = calls
+        self.batch_size  = batch_size
+
+        self.cost    = 1.0 # requests per paper of the last lookup that sent any
+        self.visited = set()
+        self.hops    = {} # paper key -> hop at which it was first reached
+
+        self.stats = {'hops': {}, 'lookups': 0, 'calls': 0, 'truncated': False, 'unexpanded': 0}
+
+    #----------------------------------------------------
+    # visit:
+    # Mark papers (keys) as reached at 'hop', e.g. the ones already expanded by
+    # another part of the harvest. Returns the keys that were not visited before.
+    #----------------------------------------------------
+    def visit(self, keys, hop):
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.visited]
+        for key in new_keys:
+            self.visited.add(key)
+            self.hops[key] = hop
+        self.stats['hops'][hop] = self.stats['hops'].get(hop, 0) + len(new_keys)
+        return new_keys
+
+    #----------------------------------------------------
+    # expand:
+    # Expand the graph from 'frontier' (paper key -> id), a set of papers at 'hop',
+    # until 'max_depth' or the budget is reached. The papers of the frontier that
+    # were already visited are expanded anyway, as they may have been visited
+    # without being looked up (see visit). Returns the hop of every visited paper.
+    #----------------------------------------------------
+    def expand(self, frontier, hop=0):
+        self.visit(frontier, hop)
+        spent = 0 # requests sent by the lookups of this expansion
+
+        while (frontier and hop < self.max_depth):
+            papers   = [(key, id) for key, id in frontier.items() if id is not None]
+            frontier = {}
+
+            offset = 0
+            while (offset < len(papers)):
+                size = self.__batchSize(spent)
+                if (size < 1):
+                    self.stats['truncated']   = True
+                    self.stats['unexpanded'] += len(papers) - offset
+                    break
+
+                before    = self.calls()
+                citations = self.lookup(dict(papers[offset:offset + size]), hop)
+                self.stats['lookups'] += 1
+
+                sent   = self.calls() - before
+                spent += sent
+                if (sent > 0):
+                    self.cost = sent / len(papers[offset:offset + size])
+                offset += size
+
+                # The next frontier only holds the papers never reached before
+                for citers in citations.values():
+                    for key in self.visit(citers, hop + 1):
+                        frontier[key] = citers[key]
+
+            hop += 1
+
+            if self.stats['truncated']:
+                # The papers reached by the last lookups are not expanded either
+                if (hop < self.max_depth):
+                    self.stats['unexpanded'] += len(frontier)
+                break
+
+        self.stats['calls'] += spent
+        return self.hops
+
+    #----------------------------------------------------
+    # __batchSize:
+    # Number of papers to look up next, once 'spent' requests were sent. Without a
+    # budget this is 'batch_size'; otherwise, at most the papers the rest of the
+    # budget is expected to pay for (0 if it cannot pay for one).
+    #----------------------------------------------------
+    def __batchSize(self, spent):
+        if (self.call_budget is None):
+            return self.batch_size
+        return min(self.batch_size, int((self.call_budget - spent) / self.cost))
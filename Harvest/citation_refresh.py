@@ -0,0 +1,54 @@
+#-----------------------------------------------------------------------------
+# citation_refresh.py:
+# Schedule of the incremental citation refresh. Each direct paper keeps the
+# time its citations were last checked ('citations_checked_at') and the number
+# of citing papers found then ('citations'). Recent papers gain citations
+# quickly and are checked often; older papers rarely change and are checked
+# less often.
+#-----------------------------------------------------------------------------
+
+import time
+
+DAY = 24 * 60 * 60
+
+# (maximum age of the paper in years, days between two checks), by increasing age
+REFRESH_SCHEDULE = ((2, 7), (5, 30), (None, 90))
+
+# Days between two checks of a paper whose year is unknown
+DEFAULT_REFRESH_DAYS = 30
+
+#----------------------------------------------------
+# paperYear:
+# Year of publication of a paper record (its 'year' field, e.g. '2020'), or None.
+#----------------------------------------------------
+def paperYear(paper):
+    year = str(paper.get('year') or '')[:4]
+    return int(year) if year.isdigit() else None
+
+#----------------------------------------------------
+# refreshInterval:
+# Seconds between two checks of the citations of 'paper', given its age.
+#----------------------------------------------------
+def refreshInterval(paper, now=None):
+    now  = time.time() if now is None else now
+    year = paperYear(paper)
+    if year is None:
+        return DEFAULT_REFRESH_DAYS * DAY
+
+    age = time.gmtime(now).tm_year - year
+    for max_age, days in REFRESH_SCHEDULE:
+        if (max_age is None or age <= max_age):
+            return days * DAY
+    return REFRESH_SCHEDULE[-1][1] * DAY
+
+#----------------------------------------------------
+# isDue:
+# True if the citations of 'paper' were never checked, or were checked longer
+# ago than its refresh interval.
+#----------------------------------------------------
+def isDue(paper, now=None):
+    now     = time.time() if now is None else now
+    checked = paper.get('citations_checked_at')
+    if checked is None:
+        return True
+    return (now - checked >= refreshInterval(paper, now))
@@ -0,0 +1,138 @@
+#-----------------------------------------------------------------------------
+# run_journal.py:
+# Durable journal of a harvest run, stored in SQLite. It records the units of
+# work completed in each stage (a dataset, an award, a protocol, a paper),
+# along with their intermediate results, so that a run restarted after a
+# failure skips the units it already finished. Units are marked done once
+# their writes are buffered, but only committed to the journal when the
+# buffer is flushed (see WriteBuffer.addFlushListener), so a crash never
+# records a unit whose writes were lost.
+#-----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import closing
+
+DEFAULT_JOURNAL_PATH = os.path.join('.cache', 'run_journal.sqlite')
+
+class RunJournal:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'path' is the SQLite file holding the journal. 'store' identifies the
+    # database the run writes to (see GraphStore.storeId). The last run against
+    # the same store that was not finished (see finishRun) is resumed, unless
+    # 'resume' is False, in which case a new run is started. A run against
+    # another store is never resumed, as its units were not written to this one.
+    #----------------------------------------------------
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, resume=True, store=None):
+        self.path  = path
+        self.store = store
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self.__connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, started_at REAL, finished_at REAL, store TEXT)')
+            if 'store' not in [column[1] for column in conn.execute('PRAGMA table_info(runs)')]:
+                conn.execute('ALTER TABLE runs ADD COLUMN store TEXT')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS units ('
+                ' run_id TEXT, stage TEXT, unit TEXT, result TEXT, completed_at REAL, PRIMARY KEY (run_id, stage, unit))'
+            )
+
+            row = None
+            if resume:
+                row = conn.execute(
+                    'SELECT run_id FROM runs WHERE finished_at IS NULL AND store IS ? ORDER BY started_at DESC LIMIT 1', (store,)
+                ).fetchone()
+
+            if row is None:
+                self.run_id  = uuid.uuid4().hex
+                self.resumed = False
+                conn.execute('INSERT INTO runs VALUES (?, ?, NULL, ?)', (self.run_id, time.time(), store))
+            else:
+                self.run_id  = row[0]
+                self.resumed = True
+
+            self._done = {
+                (stage, unit): json.loads(result)
+                for stage, unit, result in conn.execute('SELECT stage, unit, result FROM units WHERE run_id = ?', (self.run_id,))
+            }
+
+        self._pending = {} # (stage, unit) -> result, marked done but not committed yet
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    #----------------------------------------------------
+    # isDone:
+    # True if the unit was completed by this run (before a restart), or marked done.
+    #----------------------------------------------------
+    def isDone(self, stage, unit):
+        with self._lock:
+            key = (stage, str(unit))
+            return key in self._done or key in self._pending
+
+    #----------------------------------------------------
+    # result:
+    # Intermediate result recorded with a completed unit, or None.
+    #----------------------------------------------------
+    def result(self, stage, unit):
+        with self._lock:
+            key = (stage, str(unit))
+            return self._pending.get(key, self._done.get(key))
+
+    #----------------------------------------------------
+    # completed:
+    # Number of units of 'stage' completed by this run.
+    #----------------------------------------------------
+    def completed(self, stage):
+        with self._lock:
+            return len({unit for s, unit in list(self._done) + list(self._pending) if s == stage})
+
+    #----------------------------------------------------
+    # markDone:
+    # Mark a unit of 'stage' as done, with an optional JSON serializable result.
+    # It is written to the journal by the next commit.
+    #----------------------------------------------------
+    def markDone(self, stage, unit, result=None):
+        with self._lock:
+            self._pending[(stage, str(unit))] = result
+
+    #----------------------------------------------------
+    # commit:
+    # Write the units marked done to the journal. Call it once their writes are
+    # stored, e.g. after every flush of the write buffer.
+    #----------------------------------------------------
+    def commit(self):
+        with self._lock:
+            if not self._pending:
+                return
+
+            now = time.time()
+            with closing(self.__connect()) as conn, conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?)',
+                    [(self.run_id, stage, unit, json.dumps(result), now) for (stage, unit), result in self._pending.items()]
+                )
+
+            self._done.update(self._pending)
+            self._pending = {}
+
+    #----------------------------------------------------
+    # finishRun:
+    # Commit the pending units and mark the run as finished, so that the next run
+    # starts from scratch.
+    #----------------------------------------------------
+    def finishRun(self):
+        self.commit()
+        with self._lock, closing(self.__connect()) as conn, conn:
+            conn.execute('UPDATE runs SET finished_at = ? WHERE run_id = ?', (time.time(), self.run_id))
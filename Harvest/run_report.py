@@ -0,0 +1,110 @@
+#-----------------------------------------------------------------------------
+# run_report.py:
+# Throughput and timing report of a harvest run. The stages record the units
+# of work they complete, and the report gives, per stage, the number of items,
+# the wall time from the first unit started to the last one finished (stages
+# overlap, so they do not add up to the run time) and the items per second,
+# along with the HTTP requests and cache hits of each host.
+#-----------------------------------------------------------------------------
+
+import time
+import threading
+from contextlib import contextmanager
+
+from ExternalAPIs.http_client import HTTP_STATS
+
+class RunReport:
+
+    def __init__(self):
+        self.started = time.time()
+
+        self._lock   = threading.Lock()
+        self._stages = {} # stage -> {'items', 'first_start', 'last_end'}
+        self._http   = HTTP_STATS.snapshot() # counters before the run
+
+        self._sections = {}
+
+    def __stage(self, stage):
+        return self._stages.setdefault(stage, {'items': 0, 'first_start': None, 'last_end': None})
+
+    #----------------------------------------------------
+    # unitStarted:
+    # Record that a unit of work of 'stage' started.
+    #----------------------------------------------------
+    def unitStarted(self, stage):
+        with self._lock:
+            stats = self.__stage(stage)
+            if stats['first_start'] is None:
+                stats['first_start'] = time.time()
+
+    #----------------------------------------------------
+    # unitDone:
+    # Record that 'items' units of work of 'stage' finished.
+    #----------------------------------------------------
+    def unitDone(self, stage, items=1):
+        with self._lock:
+            stats = self.__stage(stage)
+            stats['items']   += items
+            stats['last_end'] = time.time()
+
+    #----------------------------------------------------
+    # unit:
+    # Context manager recording one unit of work of 'stage', if it succeeds.
+    #----------------------------------------------------
+    @contextmanager
+    def unit(self, stage, items=1):
+        self.unitStarted(stage)
+        yield
+        self.unitDone(stage, items)
+
+    #----------------------------------------------------
+    # addSection:
+    # Add a JSON serializable 'value' to the report under 'name' (e.g. the
+    # statistics of a stage).
+    #----------------------------------------------------
+    def addSection(self, name, value):
+        with self._lock:
+            self._sections[name] = value
+
+    #----------------------------------------------------
+    # build:
+    # The report, as a JSON serializable dict.
+    #----------------------------------------------------
+    def build(self):
+        now = time.time()
+
+        stages = {}
+        with self._lock:
+            for stage, stats in self._stages.items():
+                wall_time = 0.0
+                if (stats['first_start'] is not None and stats['last_end'] is not None):
+                    wall_time = stats['last_end'] - stats['first_start']
+                stages[stage] = {
+                    'items': stats['items'],
+                    'wall_time': round(wall_time, 3),
+                    'items_per_sec': round(stats['items'] / wall_time, 3) if wall_time > 0 else None,
+                }
+
+        # Only count the requests of this run
+        http = {}
+        for host, counters in HTTP_STATS.snapshot().items():
+            before = self._http.get(host, {})
+            http[host] = {name: value - before.get(name, 0) for name, value in counters.items()}
+
+        requests   = sum(counters['requests'] for counters in http.values())
+        cache_hits = sum(counters['cache_hits'] for counters in http.values())
+
+        with self._lock:
+            sections = dict(self._sections)
+
+        return {
+            **sections,
+            'wall_time': round(now - self.started, 3),
+            'stages': stages,
+            'http': http,
+            'cache': {
+                'hits': cache_hits,
+                'requests_sent': requests,
+                'hit_rate': round(cache_hits / (cache_hits + requests), 3) if (cache_hits + requests) else None,
+            },
+        }
@@ -0,0 +1,185 @@
+#-----------------------------------------------------------------------------
+# scheduler.py:
+# Work queue running the tasks of a harvest on a thread pool. Tasks can submit
+# more tasks (e.g. a dataset submits the search of its papers), so the stages
+# overlap instead of running one after another. Each task can name the
+# resource (usually the host) it uses, and at most 'limit' tasks of a resource
+# run at once; the others wait in its queue without holding a thread.
+#-----------------------------------------------------------------------------
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class Scheduler:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'max_workers'   : Number of threads running the tasks.
+    # 'limits'        : Maximum number of tasks running at once per resource.
+    # 'default_limit' : Limit of the resources missing from 'limits' (None for no
+    #                   limit other than 'max_workers').
+    #----------------------------------------------------
+    def __init__(self, max_workers=8, limits=None, default_limit=None):
+        self.max_workers   = max_workers
+        self.limits        = dict(limits or {})
+        self.default_limit = default_limit
+
+        self._executor   = ThreadPoolExecutor(max_workers=max_workers)
+        self._cond       = threading.Condition()
+        self._queues     = {} # resource -> deque of the tasks waiting for a slot
+        self._running    = {} # resource -> number of tasks running
+        self._pending    = 0  # tasks submitted and not finished
+        self._idle_hooks = []
+
+        self.errors = []
+        self.stats  = {} # resource -> {'tasks': finished tasks, 'busy': seconds spent running them}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    #----------------------------------------------------
+    # submit:
+    # Queue fn(*args, **kwargs) as a task using 'resource'. Returns a Future of its
+    # result. Can be called from within a task.
+    #----------------------------------------------------
+    def submit(self, fn, *args, resource=None, **kwargs):
+        future = Future()
+        with self._cond:
+            self._pending += 1
+            self._queues.setdefault(resource, deque()).append((future, fn, args, kwargs))
+            self.__dispatch(resource)
+        return future
+
+    #----------------------------------------------------
+    # whenAll:
+    # Call fn() once all the given futures completed successfully (or right away if
+    # there are none). fn is not called if one of them failed.
+    #----------------------------------------------------
+    def whenAll(self, futures, fn):
+        futures = list(futures)
+        if not futures:
+            fn()
+            return
+
+        lock      = threading.Lock()
+        remaining = [len(futures)]
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                if (remaining[0] > 0):
+                    return
+            if all(f.exception() is None for f in futures):
+                fn()
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    #----------------------------------------------------
+    # addIdleHook:
+    # Call hook() every time the scheduler runs out of tasks while waiting (see
+    # wait), e.g. to submit a partial batch. It may submit more tasks.
+    #----------------------------------------------------
+    def addIdleHook(self, hook):
+        with self._cond:
+            self._idle_hooks.append(hook)
+
+    #----------------------------------------------------
+    # wait:
+    # Block until every task, including the tasks they submitted, is finished.
+    # Raises the first exception raised by a task, if any.
+    #----------------------------------------------------
+    def wait(self):
+        while True:
+            with self._cond:
+                while self._pending:
+                    self._cond.wait()
+                hooks = list(self._idle_hooks)
+
+            for hook in hooks:
+                hook()
+
+            with self._cond:
+                if (self._pending == 0):
+                    break
+
+        if self.errors:
+            raise self.errors[0]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __limit(self, resource):
+        if resource is None:
+            return None
+        return self.limits.get(resource, self.default_limit)
+
+    #----------------------------------------------------
+    # __dispatch:
+    # Start the queued tasks of 'resource' while it has free slots. Called with
+    # the lock held.
+    #----------------------------------------------------
+    def __dispatch(self, resource):
+        queue = self._queues.get(resource)
+        limit = self.__limit(resource)
+        while queue and (limit is None or self._running.get(resource, 0) < limit):
+            self._running[resource] = self._running.get(resource, 0) + 1
+            self._executor.submit(self.__run, resource, *queue.popleft())
+
+    def __run(self, resource, future, fn, args, kwargs):
+        start = time.time()
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    with self._cond:
+                        self.errors.append(e)
+                    future.set_exception(e)
+        finally:
+            with self._cond:
+                stats = self.stats.setdefault(resource, {'tasks': 0, 'busy': 0.0})
+                stats['tasks'] += 1
+                stats['busy']  += time.time() - start
+
+                self._running[resource] -= 1
+                self._pending -= 1
+                self.__dispatch(resource)
+                self._cond.notify_all()
+
+class BatchQueue:
+
+    #----------------------------------------------------
+    # __init__:
+    # Collect items and submit fn(items) to 'scheduler' as a task using 'resource'
+    # every 'batch_size' items. The last partial batch is submitted when the
+    # scheduler runs out of other tasks.
+    #----------------------------------------------------
+    def __init__(self, scheduler, fn, batch_size, resource=None):
+        self.scheduler  = scheduler
+        self.fn         = fn
+        self.batch_size = batch_size
+        self.resource   = resource
+
+        self._lock  = threading.Lock()
+        self._items = []
+        scheduler.addIdleHook(self.flush)
+
+    def add(self, item):
+        with self._lock:
+            self._items.append(item)
+            if (len(self._items) < self.batch_size):
+                return
+            batch, self._items = self._items, []
+        self.scheduler.submit(self.fn, batch, resource=self.resource)
+
+    def flush(self):
+        with self._lock:
+            batch, self._items = self._items, []
+        if batch:
+            self.scheduler.submit(self.fn, batch, resource=self.resource)
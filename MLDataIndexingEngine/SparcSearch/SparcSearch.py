@@ -1,5 +1,9 @@
 #import
 import re, os
+import time
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from collections import Counter
 from symspellpy.symspellpy import SymSpell as SymSpellPy, Verbosity
 from gensim.models import Word2Vec
@@ -14,6 +18,11 @@ import matplotlib.pyplot as plt
 import requests as req
 from gensim.models import KeyedVectors
 import json
+import hashlib
+try:
+    import fcntl
+except ImportError: # not available on Windows
+    fcntl = None
 from gensim.scripts.glove2word2vec import glove2word2vec
 
 class SpellCheck:
@@ -151,16 +160,102 @@ def generate_model_our_Data(title):
     # define training data
     sentences = title
     #print(sentences)
-    # train model
+    # train model, in memory only (see train_model for the saved model)
     model = Word2Vec(sentences, min_count=1)
     # summarize the loaded model
     # summarize vocabulary
     #words = list(model.wv.key_to_index)
     #print(words)
-    # save model
-    model.save('model_short.bin')
+    return model
 
-    return Word2Vec.load('model_short.bin')
+MODEL_DIR = os.environ.get('SPARCSEARCH_MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+MODEL_MANIFEST = 'latest.json'
+MODEL_LOCK = 'train.lock'
+MODEL_VERSIONS_KEPT = 2
+
+def read_model_manifest(model_dir=MODEL_DIR):
+    "Manifest of the latest model version: its 'version', 'file' and the lookup keys of the 'documents' it was trained on."
+    path = os.path.join(model_dir, MODEL_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+@contextmanager
+def model_dir_lock(model_dir=MODEL_DIR):
+    "Exclusive lock of the model directory, held across processes with fcntl (where it is available)."
+    if not os.path.exists(model_dir):
+        os.makedirs(model_dir, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(model_dir, MODEL_LOCK), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def train_model(title, lookup, model_dir=MODEL_DIR):
+    '''
+        Offline training step. The latest saved model is trained further on the
+        documents (titles) whose lookup key it has not seen yet, with
+        build_vocab(update=True) and train, and saved as a new version; the first
+        model is trained from scratch. Returns the manifest of the latest version,
+        which is left as it is if there is no new document. Several processes
+        (e.g. the workers of the web app) can build the index at once, so the
+        training runs under an exclusive lock of the model directory, and the
+        manifest is read once the lock is held: a process that waited for another
+        one finds its documents already trained, and trains nothing.
+    '''
+    with model_dir_lock(model_dir):
+        manifest = read_model_manifest(model_dir)
+        known = set(manifest['documents']) if manifest else set()
+        new_title = [t for t, key in zip(title, lookup) if key not in known]
+        if manifest is not None and not new_title:
+            return manifest
+
+        if manifest is None:
+            model = Word2Vec(title, min_count=1)
+            version = 1
+        else:
+            # loaded without mmap, as the vectors are updated
+            model = Word2Vec.load(os.path.join(model_dir, manifest['file']))
+            model.build_vocab(new_title, update=True)
+            model.train(new_title, total_examples=len(new_title), epochs=model.epochs)
+            version = manifest['version'] + 1
+
+        # every array is saved in its own .npy file, so that it can be memory-mapped
+        file_name = f'word2vec-v{version}.model'
+        model.save(os.path.join(model_dir, file_name), sep_limit=0)
+
+        manifest = {
+            'version': version,
+            'file': file_name,
+            'documents': sorted(known | set(lookup)),
+            'trained_at': time.time(),
+        }
+        tmp_path = os.path.join(model_dir, MODEL_MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_path, os.path.join(model_dir, MODEL_MANIFEST))
+
+        remove_old_models(model_dir, version)
+        return manifest
+
+def remove_old_models(model_dir, version):
+    "Remove the files of the versions older than the last MODEL_VERSIONS_KEPT ones."
+    for file_name in os.listdir(model_dir):
+        match = re.match(r'word2vec-v(\d+)\.model', file_name)
+        if match and int(match.group(1)) <= version - MODEL_VERSIONS_KEPT:
+            os.remove(os.path.join(model_dir, file_name))
+
+def load_model(model_dir=MODEL_DIR):
+    "Latest saved model, memory-mapped read-only, along with its manifest; (None, None) if there is none."
+    manifest = read_model_manifest(model_dir)
+    if manifest is None:
+        return None, None
+    return Word2Vec.load(os.path.join(model_dir, manifest['file']), mmap='r'), manifest
 
 def get_glove2wv():
     glove_input_file = '/content/glove.6B.100d.txt'
@@ -176,18 +271,20 @@ def work_with_glove(new_model):
     return model 
 
 def run_spellrecomender(title_word = False):
-    corpus = []
-    for line in fetch_20newsgroups().data:
-        line = line.replace('\n', ' ').replace('\t', ' ').lower()
-        line = re.sub('[^a-z ]', ' ', line)
-        tokens = line.split(' ')
-        tokens = [token for token in tokens if len(token) > 0]
-        corpus.extend(tokens)
-    corpus = Counter(corpus)
     corpus_dir = '../../data/'
     corpus_file_name = 'spell_check_dictionary.txt'
     if title_word:
         corpus = title_word
+    else:
+        # the 20 newsgroups vocabulary is only needed without our own words
+        corpus = []
+        for line in fetch_20newsgroups().data:
+            line = line.replace('\n', ' ').replace('\t', ' ').lower()
+            line = re.sub('[^a-z ]', ' ', line)
+            tokens = line.split(' ')
+            tokens = [token for token in tokens if len(token) > 0]
+            corpus.extend(tokens)
+        corpus = Counter(corpus)
     symspell = SymSpell(verbose=10)
     symspell.build_vocab(dictionary=corpus, file_dir=corpus_dir, file_name=corpus_file_name)
     symspell.load_vocab(corpus_file_path=corpus_dir+corpus_file_name)
@@ -219,8 +316,9 @@ def create_titleandlookup(dat3):
 def get_stopwords():
     nltk.download('stopwords')
 
+@lru_cache(maxsize=1)
 def set_stopwrds():
-    return set(stopwords.words('english'))
+    return frozenset(stopwords.words('english'))
 
 def find_recomendation( title, lookup, word_list, new_model, full_model):
     distance = []
@@ -248,10 +346,146 @@ def getRecomendation(string, dat3, full_model, recomendation):
     fr = find_recomendation( title, lookup, correct_spell, new_model, full_model)
     return fr, correct_spell
 
+SNAPSHOT_URL = "https://sparclink-f151d-default-rtdb.firebaseio.com/ikP4sIT5PJMWFNCKG5eof5RN2Em1.json"
+
+'''
+    Search index kept in memory for the lifetime of the process. The snapshot of
+    the database is downloaded once, and the titles, lookup keys, spell checker and
+    word2vec model built from it are reused by every search. Firebase answers
+    every plain GET with the whole database, so a background thread only reads
+    the version of the graph (Meta/version, set by every harvest and sync, see
+    GraphStore/graph_store.py) every 'refresh_interval' seconds, and downloads
+    the snapshot when it changed. The snapshot is also downloaded at least every
+    'full_refresh_interval' seconds, for the writes that did not set the version;
+    the index is only rebuilt when its content changed. Searches keep using the
+    previous index while a new one is being built. The word2vec model is the
+    saved one (see train_model), memory-mapped; it is only trained further when
+    the snapshot holds new papers or datasets.
+'''
+class SearchIndex:
+    def __init__(self, url=SNAPSHOT_URL, refresh_interval=300, model_dir=MODEL_DIR, full_refresh_interval=3600):
+        self.url = url
+        self.model_dir = model_dir
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.version = None
+        self.digest = None
+        self.downloaded_at = None
+        self.state = None
+        self.glove_model = None
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        "Load the snapshot, then keep it up to date in a background thread."
+        with self.start_lock:
+            if self.state is None:
+                self.refresh()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print("SearchIndex: refresh failed, keeping the current index:", e)
+
+    def snapshot_version(self):
+        "Version of the graph (Meta/version), read with shallow=true; None if it was never set."
+        base = self.url[:-len(".json")] if self.url.endswith(".json") else self.url
+        response = req.get(base + "/Meta/version.json", params={"shallow": "true"}, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    def refresh(self):
+        "Download the snapshot if its version changed or a full refresh is due, and rebuild the index if it changed. Returns True if it was rebuilt."
+        version = self.snapshot_version()
+        due = self.downloaded_at is None or time.monotonic() - self.downloaded_at >= self.full_refresh_interval
+        if self.state is not None and version == self.version and not due:
+            return False
+
+        response = req.get(self.url, timeout=60)
+        response.raise_for_status()
+        self.downloaded_at = time.monotonic()
+
+        digest = hashlib.sha1(response.content).hexdigest()
+        if self.state is not None and digest == self.digest:
+            self.version = version
+            return False
+
+        state = self.build(response.json())
+        with self.lock:
+            self.state = state
+            self.version = version
+            self.digest = digest
+            self.glove_model = None
+        return True
+
+    def build(self, dat3):
+        title, lookup = create_titleandlookup(dat3)
+
+        # the saved model is only trained further when there are new documents
+        model, manifest = load_model(self.model_dir)
+        if manifest is None or not set(lookup) <= set(manifest['documents']):
+            train_model(title, lookup, self.model_dir)
+            model, manifest = load_model(self.model_dir)
+
+        return {
+            'title': title,
+            'lookup': lookup,
+            'symspell': run_spellrecomender(get_title_word_freq_dict(title)),
+            'model': model,
+            'model_version': manifest['version'],
+        }
+
+    def full_model(self, state):
+        "Our model extended with GloVe, built on the first search that needs it."
+        with self.lock:
+            if state is not self.state:
+                return work_with_glove(state['model'])
+            if self.glove_model is None:
+                self.glove_model = work_with_glove(state['model'])
+            return self.glove_model
+
+    def search(self, string, full_model = False, recomendation = True):
+        if self.state is None:
+            self.start()
+        state = self.state
+
+        fr = []
+        en_stops = set_stopwrds()
+        string = remove_punctuation(text_lowercase(string)).split(" ")
+        string = [i for i in string if i not in en_stops]
+        correct_spell = [check_spell(state['symspell'], i)[0]["word"] for i in string]
+        if not recomendation:
+           return fr, correct_spell
+        new_model = state['model']
+        if full_model:
+           new_model = self.full_model(state)
+        fr = find_recomendation(state['title'], state['lookup'], correct_spell, new_model, full_model)
+        return fr, correct_spell
+
+search_index = None
+search_index_lock = threading.Lock()
+
+def get_search_index():
+    "Search index shared by the process, loaded and refreshed on first use."
+    global search_index
+    with search_index_lock:
+        if search_index is None:
+            search_index = SearchIndex().start()
+        return search_index
+
 def SparcSearch(string, full_model = False, recomendation = True):
-    response = req.get("https://sparclink-f151d-default-rtdb.firebaseio.com/ikP4sIT5PJMWFNCKG5eof5RN2Em1.json")
-    dat3 = response.json()
-    ret, correct_spelling = getRecomendation(string, dat3, full_model, recomendation)
+    ret, correct_spelling = get_search_index().search(string, full_model, recomendation)
     json_string = json.dumps(ret)
     with open('data.json', 'w') as jsonfile:
          json.dump(json_string, jsonfile)
@@ -259,3 +493,10 @@ def SparcSearch(string, full_model = False, recomendation = True):
 
 # if __name__ == '__main__':
 #    jj, cs = SparcSearch("Identification of peripheral neural cercuit",False, True)
+
+# Offline training step: python SparcSearch.py train
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] == ['train']:
+        title, lookup = create_titleandlookup(req.get(SNAPSHOT_URL, timeout=60).json())
+        print(train_model(title, lookup)['file'])
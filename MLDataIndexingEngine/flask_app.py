@@ -2,13 +2,16 @@
 # A very simple Flask Hello World app for you to get started with...
 
 from flask import Flask, request, jsonify
-from Sparcsearch import SparcSearch
+from Sparcsearch import SparcSearch, get_search_index
 from WordCloud import Wordcloud
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app)
 
+# Load the search index once, at startup; it refreshes itself in the background
+get_search_index()
+
 @app.route('/')
 def hello_world():
     return 'Hello from Flask!'
@@ -0,0 +1,200 @@
+#-----------------------------------------------------------------------------
+# dataset_description.py:
+# Parser of the dataset_description file of a SPARC dataset, in any of the
+# formats allowed by the SPARC Data Structure (xlsx, csv or json). The file is
+# read from memory; xlsx files are streamed row by row in read-only mode, and
+# only the rows of the originating articles and protocols are searched for DOIs.
+# Failures are returned as structured errors instead of being raised.
+#-----------------------------------------------------------------------------
+
+import io
+import re
+import csv
+import json
+import zipfile
+
+import openpyxl
+
+DESCRIPTION_FORMATS = ('xlsx', 'csv', 'json')
+
+# Fields of the parsed description, and the metadata elements they come from
+DOI_FIELDS = {
+    'originatingArticleDOI': 'originating article',
+    'protocolsDOI': 'protocol',
+}
+
+# A DOI link, e.g. https://doi.org/10.1038/xyz or dx.doi.org/10.17504/protocols.io.abc
+DOI_LINK = re.compile(r'(?:https?://)?(?:dx\.)?doi\.org/[^\s,;"\'<>]+', re.IGNORECASE)
+
+# Closing brackets that may end a DOI link, and their opening bracket
+BRACKETS = {')': '(', ']': '['}
+
+# Columns of the xlsx/csv templates before the values: element, description, example
+VALUE_COLUMN = 3
+
+#----------------------------------------------------
+# description_error:
+# Structured error of a description that could not be parsed.
+# 'code' is one of 'missing', 'unsupported_format', 'unreadable' and 'no_sheet'.
+#----------------------------------------------------
+def description_error(code, message, file_format=None):
+    return {'code': code, 'format': file_format, 'message': message}
+
+#----------------------------------------------------
+# find_doi_links:
+# DOI links found in a cell value, in order. Trailing punctuation is removed,
+# along with closing brackets that have no opening bracket in the link, so that
+# e.g. 10.1016/S0140-6736(20)30183-5 is kept whole.
+#----------------------------------------------------
+def find_doi_links(value):
+    if not isinstance(value, str):
+        return []
+    return [strip_doi_link(link) for link in DOI_LINK.findall(value)]
+
+def strip_doi_link(link):
+    while link:
+        last = link[-1]
+        if (last == '.'):
+            link = link[:-1]
+        elif (last in BRACKETS and link.count(last) > link.count(BRACKETS[last])):
+            link = link[:-1]
+        else:
+            break
+    return link
+
+#----------------------------------------------------
+# empty_description:
+# Parsed description without any DOI, with the given errors.
+#----------------------------------------------------
+def empty_description(errors=None):
+    description = {field: [] for field in DOI_FIELDS}
+    description['errors'] = list(errors or [])
+    return description
+
+#----------------------------------------------------
+# parse_dataset_description:
+# Parse the bytes of a dataset_description file. 'file_format' is 'xlsx', 'csv'
+# or 'json'; if None, it is guessed from 'file_name' or from the content. A zip
+# archive (as returned by zipit for several paths) is searched for the first
+# dataset_description file it holds. Returns a dict with the DOIs of each of
+# DOI_FIELDS, and a list of 'errors' (see description_error).
+#----------------------------------------------------
+def parse_dataset_description(content, file_format=None, file_name=None):
+    if not content:
+        return empty_description([description_error('missing', 'empty dataset_description file', file_format)])
+
+    if (file_format is None and file_name is not None):
+        file_format = file_name.rsplit('.', 1)[-1].lower()
+
+    if (file_format is None or file_format == 'zip'):
+        content, file_format, error = unpack_description(content)
+        if error is not None:
+            return empty_description([error])
+
+    if file_format not in DESCRIPTION_FORMATS:
+        return empty_description([
+            description_error('unsupported_format', f'unsupported dataset_description format: {file_format}', file_format)
+        ])
+
+    try:
+        if (file_format == 'xlsx'):
+            return parse_rows(read_xlsx_rows(content))
+        elif (file_format == 'csv'):
+            return parse_rows(read_csv_rows(content))
+        else:
+            return parse_json(json.loads(content.decode('utf-8-sig')))
+    except NoSheetError as e:
+        return empty_description([description_error('no_sheet', str(e), file_format)])
+    except Exception as e:
+        return empty_description([description_error('unreadable', f'{type(e).__name__}: {e}', file_format)])
+
+#----------------------------------------------------
+# unpack_description:
+# Find out the format of 'content': an xlsx file is itself a zip archive, while
+# any other archive is searched for a dataset_description file. Returns the
+# content of the description, its format and an error (or None).
+#----------------------------------------------------
+def unpack_description(content):
+    if not zipfile.is_zipfile(io.BytesIO(content)):
+        stripped = content.lstrip()
+        file_format = 'json' if stripped[:1] in (b'{', b'[') else 'csv'
+        return content, file_format, None
+
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        names = archive.namelist()
+        if ('[Content_Types].xml' in names):
+            return content, 'xlsx', None
+
+        for file_format in DESCRIPTION_FORMATS:
+            for name in names:
+                if name.lower().endswith(f'dataset_description.{file_format}'):
+                    return archive.read(name), file_format, None
+
+    return None, None, description_error('missing', 'no dataset_description file in the archive', 'zip')
+
+class NoSheetError(Exception):
+    pass
+
+#----------------------------------------------------
+# read_xlsx_rows:
+# Rows (tuples of cell values) of the description sheet of an xlsx file, read
+# in streaming mode. The sheet is 'Sheet1' if there is one, else the first sheet.
+#----------------------------------------------------
+def read_xlsx_rows(content):
+    workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        if not workbook.sheetnames:
+            raise NoSheetError('the workbook has no sheet')
+        sheet = workbook['Sheet1'] if 'Sheet1' in workbook.sheetnames else workbook.worksheets[0]
+        for row in sheet.iter_rows(values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+def read_csv_rows(content):
+    return csv.reader(io.StringIO(content.decode('utf-8-sig', errors='replace')))
+
+#----------------------------------------------------
+# parse_rows:
+# DOIs of the rows of an xlsx or csv description, whose first column is the
+# metadata element, followed by its description, an example and the values.
+# Only the values of the originating article and protocol rows are searched.
+#----------------------------------------------------
+def parse_rows(rows):
+    description = empty_description()
+
+    for row in rows:
+        if not row or not isinstance(row[0], str):
+            continue
+
+        element = row[0].lower()
+        for field, name in DOI_FIELDS.items():
+            if name in element:
+                for value in row[VALUE_COLUMN:]:
+                    description[field].extend(find_doi_links(value))
+
+    return description
+
+#----------------------------------------------------
+# parse_json:
+# DOIs of a json description. Every value under a key naming an originating
+# article or a protocol is searched, at any depth.
+#----------------------------------------------------
+def parse_json(data):
+    description = empty_description()
+    collect_json_dois(data, None, description)
+    return description
+
+def collect_json_dois(value, field, description):
+    if isinstance(value, dict):
+        for key, child in value.items():
+            child_field = field
+            for name_field, name in DOI_FIELDS.items():
+                if name.replace(' ', '') in re.sub(r'[\s_-]', '', str(key).lower()):
+                    child_field = name_field
+            collect_json_dois(child, child_field, description)
+    elif isinstance(value, list):
+        for child in value:
+            collect_json_dois(child, field, description)
+    elif field is not None:
+        description[field].extend(find_doi_links(value))
@@ -0,0 +1,106 @@
+#-----------------------------------------------------------------------------
+# dataset_manifest.py:
+# Local manifest of the SPARC datasets already harvested, stored in SQLite and
+# keyed by datasetId + version. It holds the metadata parsed from the details
+# and the dataset_description file of each version, so that a version is only
+# downloaded and parsed once. A new version of a dataset gets a new entry.
+#-----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+DEFAULT_MANIFEST_PATH = os.path.join('.cache', 'dataset_manifest.sqlite')
+
+# Fields of a dataset kept in the manifest
+MANIFEST_FIELDS = (
+    'name', 'description', 'version', 'versionPublishedAt', 'datasetDOI', 'tags', 'contributors',
+    'originatingArticleDOI', 'protocolsDOI', 'descriptionErrors',
+)
+
+class DatasetManifest:
+
+    #----------------------------------------------------
+    # __init__:
+    # 'path' is the SQLite file holding the manifest.
+    #----------------------------------------------------
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path  = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self.__connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS datasets ('
+                ' dataset_id TEXT, version INTEGER, metadata TEXT, harvested_at REAL, PRIMARY KEY (dataset_id, version))'
+            )
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    #----------------------------------------------------
+    # get:
+    # Metadata stored for the given version of a dataset, or None if that version
+    # was never harvested.
+    #----------------------------------------------------
+    def get(self, dataset_id, version):
+        if version is None:
+            return None
+
+        with closing(self.__connect()) as conn:
+            row = conn.execute(
+                'SELECT metadata FROM datasets WHERE dataset_id = ? AND version = ?', (str(dataset_id), int(version))
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    #----------------------------------------------------
+    # put:
+    # Store the metadata of a version of a dataset (see MANIFEST_FIELDS). The
+    # entries of its older versions are removed.
+    #----------------------------------------------------
+    def put(self, dataset_id, version, dataset):
+        metadata = {field: dataset.get(field) for field in MANIFEST_FIELDS}
+
+        with self._lock, closing(self.__connect()) as conn, conn:
+            conn.execute('DELETE FROM datasets WHERE dataset_id = ? AND version < ?', (str(dataset_id), int(version)))
+            conn.execute(
+                'INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?)',
+                (str(dataset_id), int(version), json.dumps(metadata), time.time())
+            )
+
+    #----------------------------------------------------
+    # versions:
+    # Latest version harvested of every dataset in the manifest, keyed by datasetId.
+    #----------------------------------------------------
+    def versions(self):
+        with closing(self.__connect()) as conn:
+            rows = conn.execute('SELECT dataset_id, MAX(version) FROM datasets GROUP BY dataset_id').fetchall()
+        return {dataset_id: version for dataset_id, version in rows}
+
+_shared_manifest      = None
+_shared_manifest_lock = threading.Lock()
+
+#----------------------------------------------------
+# get_shared_manifest:
+# Return the manifest shared by the process, stored in DATASET_MANIFEST_PATH
+# (environment variable) or .cache/dataset_manifest.sqlite. Setting
+# DATASET_MANIFEST_PATH to 'off' disables it, in which case None is returned.
+#----------------------------------------------------
+def get_shared_manifest():
+    global _shared_manifest
+
+    path = os.environ.get('DATASET_MANIFEST_PATH', DEFAULT_MANIFEST_PATH)
+    if (path.lower() == 'off'):
+        return None
+
+    with _shared_manifest_lock:
+        if _shared_manifest is None:
+            _shared_manifest = DatasetManifest(path)
+        return _shared_manifest
@@ -35,176 +35,222 @@
 
 
 ### Import required python modules
-import requests
-import pandas as pd
+import os
+import threading
+from collections import deque
+from itertools import islice
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def get_list_of_datasets_with_metadata(list_of_datasets):
-    
-    # get list of datasets with awards associated with it
+from ExternalAPIs.http_cache import getSharedHTTPCache
+from ExternalAPIs.http_client import HTTPClient
+from SPARC.dataset_description import DESCRIPTION_FORMATS, description_error, parse_dataset_description
+from SPARC.dataset_manifest import get_shared_manifest
+
+_http      = None
+_http_lock = threading.Lock()
+
+# All the requests to Pennsieve and protocols.io go through one client, so that
+# they share the rate limiter and the on-disk response cache of the process.
+def get_http_client():
+    global _http
+
+    with _http_lock:
+        if _http is None:
+            _http = HTTPClient(cache=getSharedHTTPCache())
+        return _http
+
+# Metadata of the datasets come from the local manifest when their version was
+# already harvested (see dataset_manifest.py); only the new datasets and the new
+# versions are downloaded and parsed. 'manifest=False' ignores the manifest.
+# The datasets are fetched concurrently (see iter_datasets_with_metadata), and
+# returned in the order of the search.
+def get_list_of_datasets_with_metadata(list_of_datasets, manifest=None, max_workers=None):
+    list_of_datasets = []
+
+    # the records are kept in the order of the search, and filled in place
+    def records():
+        for item in iter_dataset_records():
+            list_of_datasets.append(item)
+            yield item
+
+    for item in iter_datasets_with_metadata(records(), manifest, max_workers):
+        pass
+
+    return list_of_datasets
+
+# Number of search records per request to Pennsieve
+PENNSIEVE_PAGE_SIZE = 100
+
+# Number of pages of search records requested ahead of the one being consumed
+PENNSIEVE_PREFETCH = 2
+
+# Yield the search records of all the datasets with awards associated with them,
+# page by page (limit/offset, 'page_size' records per page). The first page gives
+# the total number of records; the next 'prefetch' pages are always being
+# downloaded while the records of the current one are consumed.
+def iter_dataset_records(page_size=PENNSIEVE_PAGE_SIZE, prefetch=PENNSIEVE_PREFETCH):
+    page = get_dataset_records_page(0, page_size)
+    total_count = page["totalCount"]
+    yield from page["records"]
+
+    offsets = iter(range(page_size, total_count, page_size))
+    pending = deque()
+
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    try:
+        for offset in islice(offsets, prefetch):
+            pending.append(executor.submit(get_dataset_records_page, offset, page_size))
+
+        while pending:
+            page = pending.popleft().result()
+            for offset in islice(offsets, 1):
+                pending.append(executor.submit(get_dataset_records_page, offset, page_size))
+            yield from page["records"]
+    finally:
+        # the consumer may stop early
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# One page of the search records of the datasets with awards.
+def get_dataset_records_page(offset, limit):
     url = "https://api.pennsieve.io/discover/search/records"
-    querystring = {"model": "award"}
+    querystring = {"model": "award", "offset": offset, "limit": limit}
     headers = {"Accept": "application/json"}
 
-    #test request to find out how many total datsets are present
-    response = requests.request(
+    response = get_http_client().request(
         "GET", url, headers=headers, params=querystring)
     response.raise_for_status()
-    response = response.json()
+    return response.json()
 
-    # get all
-    querystring = {"limit": response["totalCount"], "model": "award"}
-    response = requests.request(
-        "GET", url, headers=headers, params=querystring)
-    response.raise_for_status()
-    response = response.json()
-    list_of_datasets = response["records"].copy()
+# Yield the datasets of the given search records (all of them if None, see
+# iter_dataset_records) with their metadata, as soon as each one is ready. The
+# records are consumed as they arrive: the versions found in the manifest are
+# yielded right away, and the others are downloaded (details and
+# dataset_description files) by 'max_workers' threads (PENNSIEVE_CONCURRENCY,
+# 8 by default) while the next records are still being searched.
+def iter_datasets_with_metadata(records=None, manifest=None, max_workers=None):
+    if records is None:
+        records = iter_dataset_records()
+    if manifest is None:
+        manifest = get_shared_manifest()
+    manifest = manifest or None
+    max_workers = max_workers or int(os.environ.get('PENNSIEVE_CONCURRENCY', 8))
+
+    progress = tqdm(total=len(records) if hasattr(records, '__len__') else None)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending  = set()
+    try:
+        for item in records:
+            if apply_manifest(item, manifest):
+                progress.update()
+                yield item
+            else:
+                pending.add(executor.submit(harvest_dataset, item, manifest))
 
-    url = ""
-    querystring = ""
-    headers = ""
-    response = ""
+            # datasets downloaded while the records were being searched
+            done = {future for future in pending if future.done()}
+            pending -= done
+            for future in done:
+                progress.update()
+                yield future.result()
 
+        for future in as_completed(pending):
+            progress.update()
+            yield future.result()
+    finally:
+        # the consumer may stop early
+        executor.shutdown(wait=True, cancel_futures=True)
+        progress.close()
+
+# Get the details and the dataset_description file of a dataset, and store its
+# metadata in the manifest.
+def harvest_dataset(item, manifest):
     # get latest version of each dataset
-    for item in tqdm(list_of_datasets):
-        url = f"https://api.pennsieve.io/discover/datasets/{item['datasetId']}"
-        headers = {"Accept": "application/json"}
-        response = requests.request("GET", url, headers=headers)
-        response.raise_for_status()
-        response = response.json()
-        item['name'] = response['name']
-        item['description'] = response['description']
-        item['version'] = response['version']
-        item['versionPublishedAt'] = response['versionPublishedAt']
-        item['datasetDOI'] = 'https://dx.doi.org/' + response['doi']
-        item['tags'] = response['tags']
-        item['contributors'] = response['contributors']
-
-    local_filename = "dataset_description.xlsx"
-    # extract metadata information
-    for item in tqdm(list_of_datasets):
-        # get the actual dataset_description.xlsx file.
-        # seems to be the best way for pandas to read
-        url = "https://api.pennsieve.io/zipit/discover"
+    get_dataset_details(item)
+
+    # a record may lag behind the latest version, which may be in the manifest already
+    if apply_manifest(item, manifest):
+        return item
+
+    get_dataset_description_dois(item)
+
+    if (manifest is not None and 'protocolsDOI' in item):
+        manifest.put(item['datasetId'], item['version'], item)
+    return item
+
+# Fill in the originating article and protocol DOIs of a dataset from its
+# dataset_description file (see dataset_description.py). The xlsx file is tried
+# first, then the csv and json variants. The file is kept in memory, so that
+# several datasets can be downloaded at once. The problems met are listed in
+# 'descriptionErrors'. Only a 404 means the file is missing; any other failed
+# request raises, so that the version is not stored in the manifest as having
+# no dataset_description file.
+def get_dataset_description_dois(item):
+    url = "https://api.pennsieve.io/zipit/discover"
+
+    errors = []
+    for file_format in DESCRIPTION_FORMATS:
         payload = {"data": {
-            "paths": ["files/dataset_description.xlsx"],
+            "paths": [f"files/dataset_description.{file_format}"],
             "version": item['version'],
             "datasetId": item['datasetId']
         }}
-        response = requests.request("POST", url, json=payload)
+        response = get_http_client().request("POST", url, json=payload)
+        if response.status_code == 404:
+            continue
         response.raise_for_status()
-        # write binary data to a file that is readable in pandas
-        if response.status_code == 200:
-            totalbits = 0
-
-            with open(local_filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        totalbits += 1024
-                        # print("Downloaded",totalbits*1025,"KB...")
-                        f.write(chunk)
-
-            # only reading through xlsx files at the moment.
-            # could be extended for json and csv (rare instances by SPARC curation standards) if time permits
-            try:
-                xl = pd.ExcelFile("dataset_description.xlsx")
-                df = xl.parse("Sheet1")
-
-                # arrays to hold dois for each dataset
-                originating_article_array = []
-                protocol_array = []
-
-                # get all dois from dataframe
-                for index, row in df.iterrows():
-                    row_val = row['Metadata element']
-                    if (row_val.find('Originating Article') != -1):
-                        count = 0
-                        for col_val in row:
-                            if (count > 2):
-                                try:
-                                    if col_val.find('doi.org') != -1:
-                                        pos = col_val.find('http')
-                                        if pos != -1:
-                                            col_val = col_val[pos:]
-                                        originating_article_array.append(
-                                            col_val)
-                                except:
-                                    pass
-                            count = count + 1
-                    if (row_val.find('Protocol') != -1):
-                        count = 0
-                        for col_val in row:
-                            if (count > 2):
-                                try:
-                                    if (col_val.find('doi.org') != -1):
-                                        pos = col_val.find('http')
-                                        if pos != -1:
-                                            col_val = col_val[pos:]
-                                        protocol_array.append(col_val)
-                                except:
-                                    pass
-                            count = count + 1
-                item["originatingArticleDOI"] = originating_article_array
-                item["protocolsDOI"] = protocol_array
-            except:
-                # for any xlsx files that are corrupted or cannot be read, ignore
-                item["originatingArticleDOI"] = []
-                item["protocolsDOI"] = []
 
-    return list_of_datasets
+        description = parse_dataset_description(response.content, file_format)
+        item["originatingArticleDOI"] = description["originatingArticleDOI"]
+        item["protocolsDOI"] = description["protocolsDOI"]
+        item["descriptionErrors"] = description["errors"]
+        return item
 
-def parsing_protocols(authorization_key):
-    url = "https://www.protocols.io/api/v3/groups/sparc/protocols"
-    querystring = {
-        "Authorization": authorization_key}
-    headers = {
-        "Accept": "*/*",
-        "Content-Type": "application/json"
-    }
+    # no dataset_description file
+    item["originatingArticleDOI"] = []
+    item["protocolsDOI"] = []
+    item["descriptionErrors"] = [description_error('missing', 'no dataset_description file in the dataset')]
+    return item
+
+# Fill in a search record with the latest details of its dataset.
+def get_dataset_details(item):
+    url = f"https://api.pennsieve.io/discover/datasets/{item['datasetId']}"
+    headers = {"Accept": "application/json"}
+    response = get_http_client().request("GET", url, headers=headers)
+    response.raise_for_status()
+    response = response.json()
+    item['name'] = response['name']
+    item['description'] = response['description']
+    item['version'] = response['version']
+    item['versionPublishedAt'] = response['versionPublishedAt']
+    item['datasetDOI'] = 'https://dx.doi.org/' + response['doi']
+    item['tags'] = response['tags']
+    item['contributors'] = response['contributors']
+    return item
 
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    protocols = response.json()
+# Fill in a search record with the metadata stored in the manifest for its
+# version. Returns False if that version was not harvested yet.
+def apply_manifest(item, manifest):
+    if manifest is None:
+        return False
 
-    list_of_protocols = []
+    metadata = manifest.get(item['datasetId'], item.get('version'))
+    if metadata is None:
+        return False
 
-    # total pages
-    total_pages = protocols['pagination']['total_pages']
+    item.update(metadata)
+    return True
 
-    # loop through pages
-    for i in tqdm(range(1, total_pages+1)):
-        querystring = {
-            "Authorization": authorization_key, "page_id": i}
-        response = requests.request(
-            "GET", url, headers=headers, params=querystring)
-        protocols = response.json()
-
-        # number of items in the page
-        num_items = len(protocols['items'])
-
-        # for each item
-        for j in range(num_items):
-            item_dict = {
-                'id': protocols['items'][j]['id'],
-                'title': protocols['items'][j]['title'],
-                'image': protocols['items'][j]['image'],
-                'uri': protocols['items'][j]['uri'],
-                'stats': protocols['items'][j]['stats'],
-                'authors': protocols['items'][j]['authors'],
-                'total_collections': protocols['items'][j][
-                    'total_collections'
-                ],
-                'number_of_steps': protocols['items'][j]['number_of_steps'],
-                'url': protocols['items'][j]['url'],
-            }
-
-
-            try:
-                if ((protocols['items'][j]['doi']).find('doi') != -1):
-                    item_dict['doi'] = protocols['items'][j]['doi']
-                    item_dict['doi'] = item_dict['doi'][11:]
-                    list_of_protocols.append(item_dict)
-            except:
-                pass
+# Largest page size allowed by protocols.io
+PROTOCOLS_PAGE_SIZE = 100
+
+# All the protocols of the SPARC workspace, in the order of their pages.
+def parsing_protocols(authorization_key, max_workers=None):
+    pages = sorted(iter_protocol_pages(authorization_key, max_workers), key=lambda page: page[0])
+
+    list_of_protocols = []
+    for page_id, protocols in pages:
+        list_of_protocols.extend(protocols)
 #    delete_protocols = []
 #    for protocol in list_of_protocols:
 #        for dataset in dataset_list:
@@ -220,6 +266,76 @@ def parsing_protocols(authorization_key):
 #    return prot_list
     return list_of_protocols
 
+# Yield the protocols of the SPARC workspace as each page arrives (see
+# iter_protocol_pages), so that they can be uploaded without waiting for the
+# other pages.
+def iter_protocols(authorization_key, max_workers=None):
+    for page_id, protocols in iter_protocol_pages(authorization_key, max_workers):
+        yield from protocols
+
+# Yield (page number, protocols) for every page of the SPARC workspace. The
+# first page gives the number of pages, and the other pages are then fetched
+# by 'max_workers' threads (PROTOCOLS_CONCURRENCY, 4 by default), within the
+# rate limit of protocols.io, and yielded as they arrive.
+def iter_protocol_pages(authorization_key, max_workers=None):
+    max_workers = max_workers or int(os.environ.get('PROTOCOLS_CONCURRENCY', 4))
+
+    protocols = get_protocols_page(authorization_key, 1)
+    total_pages = protocols['pagination']['total_pages']
+    yield 1, protocols_of_page(protocols)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(get_protocols_page, authorization_key, page_id): page_id
+            for page_id in range(2, total_pages + 1)
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            yield futures[future], protocols_of_page(future.result())
+    finally:
+        # the consumer may stop early
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# One page of the protocols of the SPARC workspace, as returned by protocols.io.
+def get_protocols_page(authorization_key, page_id):
+    url = "https://www.protocols.io/api/v3/groups/sparc/protocols"
+    querystring = {
+        "Authorization": authorization_key, "page_id": page_id, "page_size": PROTOCOLS_PAGE_SIZE}
+    headers = {
+        "Accept": "*/*",
+        "Content-Type": "application/json"
+    }
+
+    response = get_http_client().request(
+        "GET", url, headers=headers, params=querystring)
+    response.raise_for_status()
+    return response.json()
+
+# Protocol records of a page, leaving out the protocols without a doi.
+def protocols_of_page(protocols):
+    list_of_protocols = []
+
+    # for each item
+    for item in protocols['items']:
+        item_dict = {
+            'id': item['id'],
+            'title': item['title'],
+            'image': item['image'],
+            'uri': item['uri'],
+            'stats': item['stats'],
+            'authors': item['authors'],
+            'total_collections': item['total_collections'],
+            'number_of_steps': item['number_of_steps'],
+            'url': item['url'],
+        }
+
+        doi = item.get('doi')
+        if (isinstance(doi, str) and doi.find('doi') != -1):
+            item_dict['doi'] = doi[11:]
+            list_of_protocols.append(item_dict)
+
+    return list_of_protocols
+
 
 # dataset_list = []
 # dataset_list = get_list_of_datasets_with_metadata(dataset_list)
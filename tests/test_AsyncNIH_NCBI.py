@@ -0,0 +1,194 @@
+import os
+import json
+import asyncio
+import inspect
+import tempfile
+import threading
+import unittest
+import aiohttp
+from ExternalAPIs.NIH_NCBI import NIH_NCBI
+from ExternalAPIs.AsyncNIH_NCBI import AsyncNIH_NCBI
+from ExternalAPIs.http_cache import HTTPCache
+from ExternalAPIs.rate_limiter import NCBI_HOST, RateLimiter
+
+ESUMMARY_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi'
+
+class FakeResponse:
+
+    def __init__ (self, url, status, body, headers=None):
+        self.url     = url
+        self.status  = status
+        self.body    = body
+        self.headers = headers or {'Content-Type': 'application/json'}
+
+    async def __aenter__ (self):
+        return self
+
+    async def __aexit__ (self, *exc):
+        return False
+
+    async def read (self):
+        return self.body
+
+class FakeSession:
+
+    #----------------------------------------------------
+    # __init__:
+    # aiohttp session answering every request after 'delay' seconds. 'statuses'
+    # are the status codes of the first responses (200 afterwards), and the
+    # connection of the first 'failures' requests fails.
+    #----------------------------------------------------
+    def __init__ (self, statuses=(), delay=0, failures=0):
+        self.statuses = list(statuses)
+        self.delay    = delay
+        self.failures = failures
+        self.requests = []
+        self.running  = 0
+        self.peak     = 0
+
+    def request (self, method, url, params=None, data=None, headers=None):
+        self.requests.append((method, url, params))
+        if (self.failures > 0):
+            self.failures -= 1
+            raise aiohttp.ClientConnectionError('connection reset')
+        return self.respond(url)
+
+    def respond (self, url):
+        session = self
+        status  = self.statuses.pop(0) if self.statuses else 200
+        body    = json.dumps({'result': {'uids': []}}).encode()
+
+        class DelayedResponse(FakeResponse):
+            async def __aenter__ (self):
+                session.running += 1
+                session.peak     = max(session.peak, session.running)
+                await asyncio.sleep(session.delay)
+                session.running -= 1
+                return self
+
+        return DelayedResponse(url, status, body, {'Content-Type': 'application/json', 'Retry-After': '0'})
+
+    async def close (self):
+        return
+
+class ThreadRecordingLimiter(RateLimiter):
+
+    #----------------------------------------------------
+    # reserve:
+    # Record the thread reserving each request.
+    #----------------------------------------------------
+    def reserve (self, host):
+        self.threads = getattr(self, 'threads', []) + [threading.current_thread()]
+        return super().reserve(host)
+
+class TestAsyncNIH_NCBI(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache   = HTTPCache(os.path.join(self.tmp_dir.name, 'cache.sqlite'))
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    # The rate limit is high enough not to space the requests out
+    def client (self, session, **kwargs):
+        NN = AsyncNIH_NCBI(rate_limiter=RateLimiter({NCBI_HOST: 1000}), cache=kwargs.pop('cache', False), crosswalk=False, backoff=0, **kwargs)
+        NN._session = session
+        return NN
+
+    #----------------------------------------------------
+    # test_Construction:
+    # The inherited state is set up, and every method of NIH_NCBI that sends
+    # requests is a coroutine.
+    #----------------------------------------------------
+    def test_Construction (self):
+        NN = AsyncNIH_NCBI(cache=False, crosswalk=False)
+        self.assertEqual(NN.getDedupStats(), {})
+
+        for name in ('getCitedBy', 'getCitedByMany', 'getNewCitedByMany', 'getCitingIdsMany', 'getPublicationsBatch',
+                     'convertIds', 'getDOIs', 'getProjectFundingDetails', 'getProjectFundingDetailsMany', 'getPublications',
+                     'getPublicationWithSearchTerm', '_getCitedByMany', '_getProjectFundingDetails',
+                     '_getProjectFundingDetailsMany', '_getPublications', '_getEutils', '_requestIDConv'):
+            self.assertTrue(hasattr(NIH_NCBI, name))
+            self.assertTrue(inspect.iscoroutinefunction(getattr(NN, name)), name)
+        return
+
+    #----------------------------------------------------
+    # test_CacheHit:
+    # A cached response is returned without sending the request again.
+    #----------------------------------------------------
+    def test_CacheHit (self):
+        session = FakeSession()
+
+        async def run():
+            async with self.client(session, cache=self.cache) as NN:
+                first  = await NN._request('GET', ESUMMARY_URL, params={'id': '1'})
+                second = await NN._request('GET', ESUMMARY_URL, params={'id': '1'})
+                return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(len(session.requests), 1)
+        self.assertTrue(second.from_cache)
+        self.assertEqual(second.content, first.content)
+        return
+
+    #----------------------------------------------------
+    # test_RetryOn429:
+    # A request rejected with HTTP 429 is sent again, and the final response
+    # is returned.
+    #----------------------------------------------------
+    def test_RetryOn429 (self):
+        session = FakeSession(statuses=[429, 429])
+
+        async def run():
+            async with self.client(session) as NN:
+                return await NN._request('GET', ESUMMARY_URL, params={'id': '1'})
+
+        resp = asyncio.run(run())
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(session.requests), 3)
+        return
+
+    #----------------------------------------------------
+    # test_ConnectionRetry:
+    # A request whose connection fails is sent again, up to 'connection_retries'
+    # times, and the rate limiter is used off the event loop.
+    #----------------------------------------------------
+    def test_ConnectionRetry (self):
+        session = FakeSession(failures=2)
+        limiter = ThreadRecordingLimiter({NCBI_HOST: 1000})
+
+        async def run(**kwargs):
+            NN = AsyncNIH_NCBI(rate_limiter=limiter, cache=False, crosswalk=False, backoff=0, **kwargs)
+            NN._session = session
+            async with NN:
+                return await NN._request('GET', ESUMMARY_URL, params={'id': '1'})
+
+        resp = asyncio.run(run())
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(session.requests), 3)
+        self.assertNotIn(threading.main_thread(), limiter.threads)
+
+        session.failures = 2
+        with self.assertRaises(aiohttp.ClientConnectionError):
+            asyncio.run(run(connection_retries=1))
+        return
+
+    #----------------------------------------------------
+    # test_HostSemaphore:
+    # No more requests than allowed are in flight to a host at once.
+    #----------------------------------------------------
+    def test_HostSemaphore (self):
+        session = FakeSession(delay=0.02)
+
+        async def run():
+            async with self.client(session, host_concurrency={NCBI_HOST: 2}) as NN:
+                await asyncio.gather(*[NN._request('GET', ESUMMARY_URL, params={'id': str(i)}) for i in range(6)])
+
+        asyncio.run(run())
+        self.assertEqual(len(session.requests), 6)
+        self.assertEqual(session.peak, 2)
+        return
+
+if __name__ == '__main__':
+    unittest.main()
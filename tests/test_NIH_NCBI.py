@@ -1,9 +1,52 @@
+import os
 import json
+import tempfile
 import unittest
+import requests
 from ExternalAPIs.NIH_NCBI import NIH_NCBI
+from ExternalAPIs.http_cache import HTTPCache, buildResponse
+from ExternalAPIs.id_crosswalk import IDCrosswalk
+
+class FakeEutils:
+
+    #----------------------------------------------------
+    # __init__:
+    # NCBI eutils with 'count' hits for any search, of which only 'max_ids' are
+    # listed by esearch. esummary answers with 'summary_status'.
+    #----------------------------------------------------
+    def __init__ (self, count, max_ids=10000, summary_status=200):
+        self.count          = count
+        self.max_ids        = max_ids
+        self.summary_status = summary_status
+        self.requests       = []
+
+    def request (self, method, url, params=None, **kwargs):
+        tool = url.rsplit('/', 1)[1].split('.')[0]
+        self.requests.append((tool, dict(params)))
+
+        if (tool == 'esearch'):
+            data = {'esearchresult': {'count': str(self.count), 'idlist': [str(i) for i in range(min(self.count, self.max_ids))]}}
+            if (params.get('usehistory') == 'y'):
+                data['esearchresult'].update({'webenv': 'MCID_1', 'querykey': '1'})
+        else:
+            if 'id' in params:
+                uids = params['id'].split(',')
+            else:
+                uids = [str(i) for i in range(params['retstart'], min(params['retstart'] + params['retmax'], self.count))]
+            data = {'result': {'uids': uids}}
+            for uid in uids:
+                data['result'][uid] = {'title': f'Paper {uid}', 'source': 'Journal', 'pubdate': '2020 Jan', 'authors': [],
+                                       'articleids': [{'idtype': 'doi', 'value': f'10.1000/{uid}'}, {'idtype': 'pmcid', 'value': uid}]}
+
+        url = requests.Request(method, url, params=params).prepare().url
+        status = 200 if (tool == 'esearch') else self.summary_status
+        return buildResponse(url, status, {'Content-Type': 'application/json'}, json.dumps(data).encode())
 
 class TestNIH_NCBI(unittest.TestCase, NIH_NCBI):
 
+    def setUp (self):
+        NIH_NCBI.__init__(self)
+
     #----------------------------------------------------
     # test_NIHFundingDetailsPayload:
     # Generate POST request payloads for 2 examples in the NIH reporter API documentation.
@@ -15,6 +58,9 @@ class TestNIH_NCBI(unittest.TestCase, NIH_NCBI):
 
         payload = self._generateFundingDetailsPayload(['5UG1HD078437-07', '5R01DK102815-05'])
         self.assertEquals(payload.replace(" ", ""), '{"criteria":{"project_nums":["5UG1HD078437-07","5R01DK102815-05"]}}', msg='[ERROR] Generating payload failed.')
+
+        payload = self._generateFundingDetailsPayload(['5UG1HD078437-07'], 500, 500)
+        self.assertEquals(payload.replace(" ", ""), '{"criteria":{"project_nums":["5UG1HD078437-07"]},"offset":500,"limit":500}', msg='[ERROR] Generating payload failed.')
         return
 
     #----------------------------------------------------
@@ -50,6 +96,25 @@ class TestNIH_NCBI(unittest.TestCase, NIH_NCBI):
             
         return
     
+    #----------------------------------------------------
+    # test_NIHRecordsOfManyAwards:
+    # Check whether the sub-projects of a search for several awards (the responses in
+    # 'test_response.txt' and 'test_response_2.txt') are assigned to the right award.
+    #----------------------------------------------------
+    def test_NIHRecordsOfManyAwards (self):
+        awards  = ['OT3OD025349', 'OT2OD023847', 'OT2OD000000']
+        records = {award: {} for award in awards}
+
+        for file_name in ('./tests/test_response.txt', './tests/test_response_2.txt'):
+            with open(file_name, 'r') as f:
+                self._assignSubProjects(records, awards, json.loads(f.read()))
+
+        self.assertEquals(len(records['OT3OD025349']), 4)
+        self.assertEquals(len(records['OT2OD023847']), 6)
+        self.assertEquals(records['OT2OD000000'], {})
+        self.assertEquals(records['OT3OD025349']['1OT3OD025349-01']['appl_id'], 9538432)
+        return
+
     #----------------------------------------------------
     # test_NIHPublications:
     # Check to see whether the publications retrieved from the test NIH reponse data in test_response_2.txt
@@ -101,6 +166,157 @@ class TestNIH_NCBI(unittest.TestCase, NIH_NCBI):
             self.assertEquals(records[k]['title'], 'Mechanotransduction in gastrointestinal smooth muscle cells: role of mechanosensitive ion channels')
         return
 
+    #----------------------------------------------------
+    # test_ESummaryBatchRecord:
+    # Check whether a multi-uid esummary response in 'test_response_esummary.txt' is
+    # parsed into one record per uid, and that uids NCBI could not summarise are skipped.
+    #----------------------------------------------------
+    def test_ESummaryBatchRecord (self):
+        with open('./tests/test_response_esummary.txt', 'r') as f:
+            jsonData = json.loads(f.read())
+            records = self._parseESummaryResult(jsonData)
+
+        self.assertEquals(sorted(records), ['7138845', '7506546'])
+        self.assertEquals(records['7138845']['title'], 'Computational analysis of mechanical stress in colonic diverticulosis')
+        self.assertEquals(records['7138845']['doi'], '10.1038/s41598-020-63049-y')
+        self.assertNotIn('doi', records['7506546'])
+        return
+
+    #----------------------------------------------------
+    # test_ESearchHistory:
+    # Check whether the hit count and the history server parameters are read from an
+    # esearch response made with usehistory=y.
+    #----------------------------------------------------
+    def test_ESearchHistory (self):
+        jsonData = {'esearchresult': {'count': '1234', 'retmax': '0', 'retstart': '0', 'querykey': '1',
+                                      'webenv': 'MCID_60f473cee135080701bee081', 'idlist': []}}
+        count, history = self._parseESearchHistory(jsonData)
+        self.assertEquals(count, 1234)
+        self.assertEquals(history, {'WebEnv': 'MCID_60f473cee135080701bee081', 'query_key': '1'})
+
+        self.assertEquals(self._parseESearchHistory({'esearchresult': {'ERROR': 'Empty term'}}), (0, {}))
+        return
+
+    #----------------------------------------------------
+    # test_ELinkSets:
+    # Check whether a multi-id elink response in 'test_response_elink.txt' is mapped back
+    # to each source id, and that a citing article shared by two sources is assembled
+    # into both from a single summary.
+    #----------------------------------------------------
+    def test_ELinkSets (self):
+        with open('./tests/test_response_elink.txt', 'r') as f:
+            links = self._parseELinkSets(json.loads(f.read()))
+
+        self.assertEquals(links, {
+            '32265489': [('pubmed', '32935578'), ('pubmed', '33000001')],
+            '31000000': [('pubmed', '32935578')],
+            '30000000': [],
+        })
+
+        pubs = {'pubmed': {'32935578': {'title': 'Citing paper', 'doi': '10.1152/ajpgi.00000.2020'}}}
+        record = self._assembleCitedBy(links, pubs)
+        self.assertEquals(list(record['32265489']), ['10.1152/ajpgi.00000.2020'])
+        self.assertEquals(list(record['31000000']), ['10.1152/ajpgi.00000.2020'])
+        self.assertEquals(record['30000000'], {})
+        return
+
+    #----------------------------------------------------
+    # test_IDConvRecord:
+    # Check whether the answers of the NCBI ID converter are mapped back to the
+    # requested ids, ignoring the ids it doesn't know.
+    #----------------------------------------------------
+    def test_IDConvRecord (self):
+        jsonData = {'status': 'ok', 'records': [
+            {'pmcid': 'PMC7138845', 'pmid': '32265489', 'doi': '10.1038/s41598-020-63049-y'},
+            {'pmid': '1', 'status': 'error', 'errmsg': 'invalid article id'},
+        ]}
+
+        converted = self._parseIDConvResult('pm_id', ['32265489', '1'], jsonData)
+        self.assertEquals(converted, {'32265489': {'pm_id': '32265489', 'pmc_id': '7138845', 'doi': '10.1038/s41598-020-63049-y'}})
+
+        converted = self._parseIDConvResult('pmc_id', ['7138845'], jsonData)
+        self.assertEquals(converted['7138845']['pm_id'], '32265489')
+        self.assertEquals(self._generateIDConvParams('pmc_id', ['7138845'])['ids'], 'PMC7138845')
+        return
+
+    #----------------------------------------------------
+    # test_NewCitedBy:
+    # Check whether only the summaries of the citing articles unknown to the caller
+    # are fetched, and that the known ones are returned by doi without a record.
+    #----------------------------------------------------
+    def test_NewCitedBy (self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self._crosswalk = IDCrosswalk(os.path.join(tmp_dir, 'crosswalk.sqlite'))
+            self._crosswalk.addMany([
+                {'pm_id': '32935578', 'doi': '10.1152/ajpgi.00000.2020', 'complete': True},
+                {'pm_id': '33000002', 'doi': '10.1000/other', 'complete': True},
+                {'pm_id': '33000003', 'complete': True},
+            ])
+
+            links = {
+                '32265489': [('pubmed', '32935578'), ('pubmed', '33000001'), ('pubmed', '33000003')],
+                '31000000': [('pubmed', '32935578'), ('pubmed', '33000002')],
+            }
+            known, to_fetch = self._splitKnownCiters(links, lambda doi: doi == '10.1152/ajpgi.00000.2020')
+
+        self.assertEquals(known, {'pubmed': {'32935578': '10.1152/ajpgi.00000.2020'}})
+        self.assertEquals(sorted(to_fetch['pubmed']), ['33000001', '33000002'])
+
+        pubs   = {'pubmed': {'33000001': {'title': 'New paper', 'doi': '10.1000/new'}}}
+        record = self._assembleNewCitedBy(links, pubs, known)
+        self.assertEquals(record['32265489'], {'10.1000/new': {'title': 'New paper', 'doi': '10.1000/new'}, '10.1152/ajpgi.00000.2020': None})
+        self.assertEquals(record['31000000'], {'10.1152/ajpgi.00000.2020': None})
+        return
+
+    #----------------------------------------------------
+    # searchClient:
+    # NIH_NCBI sending its requests to a FakeEutils, with a response cache in 'tmp_dir'.
+    #----------------------------------------------------
+    def searchClient (self, tmp_dir, eutils, crosswalk=False):
+        NN = NIH_NCBI(cache=HTTPCache(os.path.join(tmp_dir, 'cache.sqlite')), crosswalk=crosswalk)
+        NN._http._session = eutils
+        NN._http.backoff  = 0
+        return NN
+
+    #----------------------------------------------------
+    # test_SearchTermCached:
+    # A term search lists the ids with a plain esearch, and fetches their summaries
+    # by id, so a second search is answered from the cache.
+    #----------------------------------------------------
+    def test_SearchTermCached (self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            eutils = FakeEutils(450)
+            pubs   = self.searchClient(tmp_dir, eutils).getPublicationWithSearchTerm('vagus')
+
+            self.assertEquals(len(pubs), 450)
+            self.assertEquals(pubs['10.1000/7']['title'], 'Paper 7')
+            self.assertEquals([tool for tool, _ in eutils.requests], ['esearch', 'esummary', 'esummary', 'esummary'])
+            self.assertTrue(all('usehistory' not in params and 'WebEnv' not in params for _, params in eutils.requests))
+
+            eutils = FakeEutils(450)
+            self.assertEquals(len(self.searchClient(tmp_dir, eutils).getPublicationWithSearchTerm('vagus')), 450)
+            self.assertEquals(eutils.requests, [])
+        return
+
+    #----------------------------------------------------
+    # test_SearchTermFailures:
+    # A failed summary page raises instead of returning a partial result, and a
+    # search with too many hits for esearch goes through the history server, whose
+    # summaries are recorded in the crosswalk too.
+    #----------------------------------------------------
+    def test_SearchTermFailures (self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            NN = self.searchClient(tmp_dir, FakeEutils(10, summary_status=500))
+            with self.assertRaises(requests.HTTPError):
+                NN.getPublicationWithSearchTerm('vagus')
+
+            eutils    = FakeEutils(1200, max_ids=1000)
+            crosswalk = IDCrosswalk(os.path.join(tmp_dir, 'crosswalk.sqlite'))
+            pubs      = self.searchClient(tmp_dir, eutils, crosswalk).getPublicationWithSearchTerm('nerve')
+            self.assertEquals(len(pubs), 1200)
+            self.assertIn(('esearch', {'db': 'pmc', 'retmode': 'json', 'term': 'nerve', 'usehistory': 'y', 'retmax': 0}), eutils.requests)
+            self.assertEquals(crosswalk.lookup('pmc_id', '1100')['doi'], '10.1000/1100')
+        return
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,188 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    from MLDataIndexingEngine.SparcSearch import SparcSearch
+except ImportError as e: # gensim, nltk and symspellpy are only installed with the search engine
+    raise unittest.SkipTest(f'search engine dependencies missing: {e}')
+
+SNAPSHOT_URL = 'https://example.firebaseio.com/user.json'
+VERSION_URL  = 'https://example.firebaseio.com/user/Meta/version.json'
+
+class FakeResponse:
+
+    def __init__ (self, data):
+        self.content     = json.dumps(data).encode()
+        self.status_code = 200
+
+    def json (self):
+        return json.loads(self.content)
+
+    def raise_for_status (self):
+        return
+
+class FakeFirebase:
+
+    #----------------------------------------------------
+    # __init__:
+    # Firebase REST API holding 'graph', at version 'version'.
+    #----------------------------------------------------
+    def __init__ (self, graph, version=None):
+        self.graph    = graph
+        self.version  = version
+        self.requests = []
+
+    def get (self, url, params=None, timeout=None):
+        self.requests.append(url)
+        if (url == VERSION_URL):
+            return FakeResponse(self.version)
+        if (url == SNAPSHOT_URL):
+            return FakeResponse(self.graph)
+        raise ValueError(url)
+
+class RecordingIndex(SparcSearch.SearchIndex):
+
+    #----------------------------------------------------
+    # build:
+    # Keep the snapshot as the index, instead of training the models.
+    #----------------------------------------------------
+    def build (self, dat3):
+        self.builds = getattr(self, 'builds', 0) + 1
+        return {'graph': dat3}
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp (self):
+        self.req = SparcSearch.req
+        self.firebase = FakeFirebase({'Papers': {'paper1': {'title': 'Vagus nerve'}}}, version=1)
+        SparcSearch.req = self.firebase
+
+    def tearDown (self):
+        SparcSearch.req = self.req
+
+    #----------------------------------------------------
+    # test_NoRefresh:
+    # While the version is the same, only the version is read.
+    #----------------------------------------------------
+    def test_NoRefresh (self):
+        index = RecordingIndex(url=SNAPSHOT_URL)
+        self.assertTrue(index.refresh())
+        self.assertFalse(index.refresh())
+        self.assertFalse(index.refresh())
+
+        self.assertEqual(index.builds, 1)
+        self.assertEqual(self.firebase.requests, [VERSION_URL, SNAPSHOT_URL, VERSION_URL, VERSION_URL])
+        return
+
+    #----------------------------------------------------
+    # test_Refresh:
+    # A new version downloads the snapshot, and the index is rebuilt when the
+    # snapshot changed.
+    #----------------------------------------------------
+    def test_Refresh (self):
+        index = RecordingIndex(url=SNAPSHOT_URL)
+        index.refresh()
+
+        self.firebase.graph   = {'Papers': {'paper1': {'title': 'Vagus nerve stimulation'}}}
+        self.firebase.version = 2
+        self.assertTrue(index.refresh())
+        self.assertEqual(index.builds, 2)
+        self.assertEqual(index.state['graph'], self.firebase.graph)
+
+        # A new version with the same content is downloaded but not rebuilt
+        self.firebase.version = 3
+        self.assertFalse(index.refresh())
+        self.assertEqual(index.builds, 2)
+        self.assertEqual(self.firebase.requests.count(SNAPSHOT_URL), 3)
+        return
+
+    #----------------------------------------------------
+    # test_FullRefresh:
+    # The snapshot is downloaded again once 'full_refresh_interval' has passed,
+    # even if the version was never set.
+    #----------------------------------------------------
+    def test_FullRefresh (self):
+        self.firebase.version = None
+        index = RecordingIndex(url=SNAPSHOT_URL, full_refresh_interval=0)
+        index.refresh()
+
+        self.firebase.graph = {'Papers': {'paper2': {'title': 'Pelvic nerve'}}}
+        self.assertTrue(index.refresh())
+        self.assertEqual(index.state['graph'], self.firebase.graph)
+        return
+
+class TestModelVersions(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir   = tempfile.TemporaryDirectory()
+        self.model_dir = os.path.join(self.tmp_dir.name, 'models')
+
+        self.title  = [['vagus', 'nerve', 'stimulation'], ['pelvic', 'nerve', 'recordings']]
+        self.lookup = ['paper1', 'dataset1']
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    def modelFiles (self):
+        return sorted(name for name in os.listdir(self.model_dir) if name.endswith('.model'))
+
+    #----------------------------------------------------
+    # test_FirstVersion:
+    # The first model is trained from scratch and saved as version 1.
+    #----------------------------------------------------
+    def test_FirstVersion (self):
+        manifest = SparcSearch.train_model(self.title, self.lookup, self.model_dir)
+        self.assertEqual(manifest['version'], 1)
+        self.assertEqual(manifest['documents'], ['dataset1', 'paper1'])
+        self.assertEqual(SparcSearch.read_model_manifest(self.model_dir), manifest)
+
+        model, loaded = SparcSearch.load_model(self.model_dir)
+        self.assertEqual(loaded, manifest)
+        self.assertIn('vagus', model.wv.key_to_index)
+        return
+
+    #----------------------------------------------------
+    # test_NewDocuments:
+    # New documents are added to the vocabulary of the last version, saved as the
+    # next version, and no new document leaves the manifest unchanged.
+    #----------------------------------------------------
+    def test_NewDocuments (self):
+        SparcSearch.train_model(self.title, self.lookup, self.model_dir)
+
+        build_vocab = SparcSearch.Word2Vec.build_vocab
+        with mock.patch.object(SparcSearch.Word2Vec, 'build_vocab', autospec=True, side_effect=build_vocab) as spy:
+            manifest = SparcSearch.train_model(self.title + [['spinal', 'cord']], self.lookup + ['paper2'], self.model_dir)
+        spy.assert_called_once_with(mock.ANY, [['spinal', 'cord']], update=True)
+
+        self.assertEqual(manifest['version'], 2)
+        self.assertEqual(manifest['documents'], ['dataset1', 'paper1', 'paper2'])
+        model, _ = SparcSearch.load_model(self.model_dir)
+        self.assertIn('spinal', model.wv.key_to_index)
+        self.assertIn('vagus', model.wv.key_to_index)
+
+        self.assertEqual(SparcSearch.train_model(self.title, self.lookup, self.model_dir), manifest)
+        self.assertEqual(SparcSearch.read_model_manifest(self.model_dir), manifest)
+        self.assertEqual(self.modelFiles(), ['word2vec-v1.model', 'word2vec-v2.model'])
+        return
+
+    #----------------------------------------------------
+    # test_VersionsKept:
+    # Only the files of the last MODEL_VERSIONS_KEPT versions are kept.
+    #----------------------------------------------------
+    def test_VersionsKept (self):
+        title, lookup = list(self.title), list(self.lookup)
+        for i in range(4):
+            title.append(['document', f'word{i}'])
+            lookup.append(f'paper{i + 2}')
+            SparcSearch.train_model(title, lookup, self.model_dir)
+
+        self.assertEqual(SparcSearch.read_model_manifest(self.model_dir)['version'], 4)
+        self.assertEqual(self.modelFiles(), ['word2vec-v3.model', 'word2vec-v4.model'])
+        self.assertFalse(any(name.startswith('word2vec-v1.') for name in os.listdir(self.model_dir)))
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import threading
+import unittest
+from ExternalAPIs.http_client import HTTP_STATS
+from Harvest.citation_expansion import CitationExpander
+
+class TestCitationExpansion(unittest.TestCase):
+
+    def setUp (self):
+        # paper -> papers citing it; 'd' cites both 'b' and 'c', and 'e' cites 'a' back
+        self.graph = {
+            'a': ['b', 'c'],
+            'b': ['d'],
+            'c': ['d', 'a'],
+            'd': ['e'],
+            'e': ['a'],
+        }
+        self.lookups  = []
+        self.requests = 0
+
+    def lookup (self, papers, hop):
+        self.lookups.append((sorted(papers), hop))
+        self.requests += 2
+        return {key: {citer: citer for citer in self.graph.get(key, [])} for key in papers}
+
+    #----------------------------------------------------
+    # test_Expand:
+    # Every paper is looked up once, at its smallest hop, one batch per hop, and
+    # the expansion stops at 'max_depth'.
+    #----------------------------------------------------
+    def test_Expand (self):
+        expander = CitationExpander(self.lookup, max_depth=2, calls=lambda: self.requests)
+        hops = expander.expand({'a': 'a'})
+
+        self.assertEqual(hops, {'a': 0, 'b': 1, 'c': 1, 'd': 2})
+        self.assertEqual(self.lookups, [(['a'], 0), (['b', 'c'], 1)])
+        self.assertEqual(expander.stats['hops'], {0: 1, 1: 2, 2: 1})
+        self.assertEqual(expander.stats['calls'], 4)
+        self.assertFalse(expander.stats['truncated'])
+        return
+
+    #----------------------------------------------------
+    # test_CallBudget:
+    # The expansion stops before a lookup would exceed the budget, and reports the
+    # papers left.
+    #----------------------------------------------------
+    def test_CallBudget (self):
+        expander = CitationExpander(self.lookup, max_depth=3, call_budget=5, calls=lambda: self.requests, batch_size=1)
+        hops = expander.expand({'a': 'a'})
+
+        self.assertEqual(self.lookups, [(['a'], 0), (['b'], 1)])
+        self.assertEqual(hops, {'a': 0, 'b': 1, 'c': 1, 'd': 2})
+        self.assertEqual(expander.stats['calls'], 4)
+        self.assertTrue(expander.stats['truncated'])
+        self.assertEqual(expander.stats['unexpanded'], 2) # 'c', and 'd' reached from 'b'
+        return
+
+    #----------------------------------------------------
+    # test_BudgetWithinLookup:
+    # A batch that would send more requests than the budget has left is shrunk,
+    # at the number of requests per paper of the previous lookups.
+    #----------------------------------------------------
+    def test_BudgetWithinLookup (self):
+        def lookup (papers, hop):
+            self.lookups.append((sorted(papers), hop))
+            self.requests += len(papers) # one request per paper
+            return {key: {} for key in papers}
+
+        frontier = {str(i): str(i) for i in range(10)}
+        expander = CitationExpander(lookup, max_depth=1, call_budget=4, calls=lambda: self.requests, batch_size=10)
+        expander.expand(frontier)
+
+        self.assertEqual(self.lookups, [(['0', '1', '2', '3'], 0)])
+        self.assertEqual(expander.stats['calls'], 4)
+        self.assertTrue(expander.stats['truncated'])
+        self.assertEqual(expander.stats['unexpanded'], 6)
+        return
+
+    #----------------------------------------------------
+    # test_Visited:
+    # Papers visited beforehand are not added to the frontier again.
+    #----------------------------------------------------
+    def test_Visited (self):
+        expander = CitationExpander(self.lookup, max_depth=3, calls=lambda: self.requests)
+        expander.visit(['a'], 0)
+        hops = expander.expand({'b': 'b', 'c': 'c'}, hop=1)
+
+        self.assertEqual(hops, {'a': 0, 'b': 1, 'c': 1, 'd': 2, 'e': 3})
+        self.assertEqual(self.lookups, [(['b', 'c'], 1), (['d'], 2)])
+        return
+
+    #----------------------------------------------------
+    # test_OwnRequestsOnly:
+    # The requests sent by other threads, even during a lookup, are not charged
+    # to the budget.
+    #----------------------------------------------------
+    def test_OwnRequestsOnly (self):
+        def lookup (papers, hop):
+            other = threading.Thread(target=HTTP_STATS.record, args=('example.org', 'requests', 100))
+            other.start()
+            other.join()
+            HTTP_STATS.record('example.org', 'requests', len(papers))
+            return self.lookup(papers, hop)
+
+        HTTP_STATS.record('example.org', 'requests', 50)
+        expander = CitationExpander(lookup, max_depth=3, call_budget=3)
+        expander.expand({'a': 'a'})
+
+        self.assertEqual(expander.stats['calls'], 3)
+        self.assertEqual(self.lookups, [(['a'], 0), (['b', 'c'], 1)])
+        self.assertTrue(expander.stats['truncated'])
+        return
+
+if __name__ == '__main__':
+    unittest.main()
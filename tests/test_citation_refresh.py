@@ -0,0 +1,37 @@
+import time
+import calendar
+import unittest
+from Harvest.citation_refresh import DAY, isDue, paperYear, refreshInterval
+
+class TestCitationRefresh(unittest.TestCase):
+
+    def setUp (self):
+        self.now = calendar.timegm((2024, 6, 1, 0, 0, 0))
+
+    #----------------------------------------------------
+    # test_RefreshInterval:
+    # Recent papers are checked more often than older ones.
+    #----------------------------------------------------
+    def test_RefreshInterval (self):
+        self.assertEqual(paperYear({'year': '2023'}), 2023)
+        self.assertIsNone(paperYear({'year': ''}))
+
+        self.assertEqual(refreshInterval({'year': '2023'}, self.now), 7 * DAY)
+        self.assertEqual(refreshInterval({'year': '2020'}, self.now), 30 * DAY)
+        self.assertEqual(refreshInterval({'year': '2001'}, self.now), 90 * DAY)
+        self.assertEqual(refreshInterval({}, self.now), 30 * DAY)
+        return
+
+    #----------------------------------------------------
+    # test_IsDue:
+    # A paper is due if it was never checked, or if its interval has elapsed.
+    #----------------------------------------------------
+    def test_IsDue (self):
+        self.assertTrue(isDue({'year': '2001'}, self.now))
+        self.assertFalse(isDue({'year': '2001', 'citations_checked_at': self.now - 30 * DAY}, self.now))
+        self.assertTrue(isDue({'year': '2023', 'citations_checked_at': self.now - 8 * DAY}, self.now))
+        self.assertTrue(isDue({'year': time.strftime('%Y'), 'citations_checked_at': time.time() - 8 * DAY}))
+        return
+
+if __name__ == '__main__':
+    unittest.main()
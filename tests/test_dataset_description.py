@@ -0,0 +1,100 @@
+import io
+import json
+import zipfile
+import unittest
+import openpyxl
+from SPARC.dataset_description import find_doi_links, parse_dataset_description
+
+ROWS = [
+    ['Metadata element', 'Description', 'Example', 'Value', 'Value 2'],
+    ['Name', 'Descriptive title', 'Vagus nerve', 'https://doi.org/10.1000/not-a-field'],
+    ['Originating Article DOI', 'DOIs of published articles', 'https://doi.org/10.1000/example',
+     'DOI: https://doi.org/10.1000/article-1, https://doi.org/10.1000/article-2', None],
+    ['Protocol URL or DOI', 'URLs of protocols', '', 'dx.doi.org/10.17504/protocols.io.6bvhan6', 42],
+]
+
+class TestDatasetDescription(unittest.TestCase):
+
+    def xlsx (self, sheet_title='Sheet1'):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = sheet_title
+        for row in ROWS:
+            sheet.append(row)
+
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        return buffer.getvalue()
+
+    def csv (self):
+        return '\n'.join(','.join('"{0}"'.format(value if value is not None else '') for value in row) for row in ROWS).encode()
+
+    def assertDOIs (self, description):
+        self.assertEqual(description['originatingArticleDOI'], ['https://doi.org/10.1000/article-1', 'https://doi.org/10.1000/article-2'])
+        self.assertEqual(description['protocolsDOI'], ['dx.doi.org/10.17504/protocols.io.6bvhan6'])
+        self.assertEqual(description['errors'], [])
+
+    #----------------------------------------------------
+    # test_Xlsx:
+    # Only the values of the article and protocol rows are searched, skipping the
+    # example column, and a cell can hold several DOIs.
+    #----------------------------------------------------
+    def test_Xlsx (self):
+        self.assertDOIs(parse_dataset_description(self.xlsx(), 'xlsx'))
+        self.assertDOIs(parse_dataset_description(self.xlsx('Dataset description')))
+        return
+
+    #----------------------------------------------------
+    # test_CsvAndJson:
+    # The csv and json variants give the same DOIs, and the format of a zip archive
+    # holding the description is found from the name of its file.
+    #----------------------------------------------------
+    def test_CsvAndJson (self):
+        self.assertDOIs(parse_dataset_description(self.csv(), 'csv'))
+        self.assertDOIs(parse_dataset_description(self.csv(), file_name='dataset_description.csv'))
+
+        data = {
+            'name': 'Vagus nerve',
+            'originating_article_doi': ['https://doi.org/10.1000/article-1', 'https://doi.org/10.1000/article-2'],
+            'protocols': [{'protocol_url_or_doi': 'dx.doi.org/10.17504/protocols.io.6bvhan6'}],
+        }
+        self.assertDOIs(parse_dataset_description(json.dumps(data).encode(), 'json'))
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as f:
+            f.writestr('files/dataset_description.csv', self.csv())
+        self.assertDOIs(parse_dataset_description(archive.getvalue()))
+        return
+
+    #----------------------------------------------------
+    # test_Errors:
+    # Files that cannot be parsed give a structured error and no DOI.
+    #----------------------------------------------------
+    def test_Errors (self):
+        description = parse_dataset_description(b'not an excel file', 'xlsx')
+        self.assertEqual(description['originatingArticleDOI'], [])
+        self.assertEqual(description['errors'][0]['code'], 'unreadable')
+        self.assertEqual(description['errors'][0]['format'], 'xlsx')
+
+        self.assertEqual(parse_dataset_description(b'', 'xlsx')['errors'][0]['code'], 'missing')
+        self.assertEqual(parse_dataset_description(b'x', 'txt')['errors'][0]['code'], 'unsupported_format')
+        self.assertEqual(parse_dataset_description(b'{', 'json')['errors'][0]['code'], 'unreadable')
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as f:
+            f.writestr('files/readme.txt', 'nothing here')
+        self.assertEqual(parse_dataset_description(archive.getvalue())['errors'][0]['code'], 'missing')
+        return
+
+    def test_FindDOILinks (self):
+        self.assertEqual(find_doi_links('see (https://doi.org/10.1/abc).'), ['https://doi.org/10.1/abc'])
+        self.assertEqual(find_doi_links(12), [])
+
+        # the brackets of the doi are kept, the ones around it are not
+        self.assertEqual(find_doi_links('https://doi.org/10.1016/S0140-6736(20)30183-5.'), ['https://doi.org/10.1016/S0140-6736(20)30183-5'])
+        self.assertEqual(find_doi_links('(doi.org/10.1016/S0140-6736(20)30183-5)'), ['doi.org/10.1016/S0140-6736(20)30183-5'])
+        self.assertEqual(find_doi_links('[doi.org/10.1002/(SICI)1097-4636(199903)].'), ['doi.org/10.1002/(SICI)1097-4636(199903)'])
+        return
+
+if __name__ == '__main__':
+    unittest.main()
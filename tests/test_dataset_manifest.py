@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from SPARC.dataset_manifest import DatasetManifest
+from SPARC.metadata_extraction import apply_manifest
+
+class TestDatasetManifest(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir  = tempfile.TemporaryDirectory()
+        self.manifest = DatasetManifest(os.path.join(self.tmp_dir.name, 'manifest.sqlite'))
+
+        self.dataset = {
+            'datasetId': 64, 'version': 4, 'name': 'Quantified Morphology of the Pig Vagus Nerve',
+            'tags': ['vagus nerve'], 'contributors': [], 'originatingArticleDOI': [],
+            'protocolsDOI': ['dx.doi.org/10.17504/protocols.io.6bvhan6'], 'properties': {'award_id': 'OT2OD025340'},
+        }
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    #----------------------------------------------------
+    # test_Versions:
+    # Only the harvested version of a dataset is found, and a new version replaces
+    # the older ones.
+    #----------------------------------------------------
+    def test_Versions (self):
+        self.manifest.put(64, 4, self.dataset)
+
+        self.assertEqual(self.manifest.get(64, 4)['protocolsDOI'], ['dx.doi.org/10.17504/protocols.io.6bvhan6'])
+        self.assertNotIn('properties', self.manifest.get(64, 4))
+        self.assertIsNone(self.manifest.get(64, 5))
+        self.assertIsNone(self.manifest.get(64, None))
+
+        self.manifest.put(64, 5, dict(self.dataset, version=5))
+        self.assertIsNone(self.manifest.get(64, 4))
+        self.assertEqual(self.manifest.versions(), {'64': 5})
+        return
+
+    #----------------------------------------------------
+    # test_ApplyManifest:
+    # A search record of a harvested version is filled in from the manifest.
+    #----------------------------------------------------
+    def test_ApplyManifest (self):
+        self.manifest.put(64, 4, self.dataset)
+
+        record = {'datasetId': 64, 'version': 4, 'properties': {'award_id': 'OT2OD025340'}}
+        self.assertTrue(apply_manifest(record, self.manifest))
+        self.assertEqual(record['name'], 'Quantified Morphology of the Pig Vagus Nerve')
+        self.assertEqual(record['properties'], {'award_id': 'OT2OD025340'})
+
+        self.assertFalse(apply_manifest({'datasetId': 64, 'version': 5}, self.manifest))
+        self.assertFalse(apply_manifest({'datasetId': 65}, self.manifest))
+        self.assertFalse(apply_manifest(record, None))
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from GraphStore.delta_sync import deltaSync, diffGraph
+from GraphStore.graph_store import VERSION_PATH
+from GraphStore.sqlite_store import SQLiteStore
+
+class TestDeltaSync(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source  = SQLiteStore(os.path.join(self.tmp_dir.name, 'source.sqlite'))
+        self.target  = SQLiteStore(os.path.join(self.tmp_dir.name, 'target.sqlite'))
+
+        self.target.update('Papers', {
+            'paper1': {'title': 'Paper 1', 'datasets': ['dataset1', 'dataset2'], 'citations': 1},
+            'paper2': {'title': 'Paper 2', 'awards': ['award1']},
+        })
+        self.source.update('Papers', {
+            'paper1': {'title': 'Paper 1', 'datasets': ['dataset2', 'dataset1'], 'citations': 2},
+            'paper3': {'title': 'Paper 3', 'protocols': ['protocol1']},
+        })
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    #----------------------------------------------------
+    # test_DiffGraph:
+    # Only the new records and the changed fields are written. The order of the
+    # values of a list does not matter.
+    #----------------------------------------------------
+    def test_DiffGraph (self):
+        updates = diffGraph(self.target.snapshot(), self.source.snapshot())
+        self.assertEqual(updates, {
+            'Papers/paper1/citations': 2,
+            'Papers/paper3': {'title': 'Paper 3', 'protocols': ['protocol1']},
+        })
+
+        updates = diffGraph(self.target.snapshot(), self.source.snapshot(), delete=True)
+        self.assertIsNone(updates['Papers/paper2'])
+
+        # A list returned by Firebase as a dict is the same list
+        self.assertEqual(diffGraph({'Papers': {'paper1': {'datasets': {'0': 'a', '1': 'b'}}}}, {'Papers': {'paper1': {'datasets': ['a', 'b']}}}), {})
+        return
+
+    #----------------------------------------------------
+    # test_DeltaSync:
+    # A dry run only summarizes the changes, and a sync leaves nothing to change.
+    # The version of the target only changes when something was written.
+    #----------------------------------------------------
+    def test_DeltaSync (self):
+        summary = deltaSync(self.source, self.target, dry_run=True)
+        self.assertEqual(summary['nodes']['Papers'], {'added': 1, 'changed': 1, 'deleted': 0})
+        self.assertEqual(summary['paths'], 2)
+        self.assertEqual(self.target.get('Papers/paper1/citations'), 1)
+        self.assertIsNone(self.target.get(VERSION_PATH))
+
+        deltaSync(self.source, self.target)
+        self.assertEqual(self.target.get('Papers/paper1/citations'), 2)
+        self.assertEqual(self.target.get('Papers/paper2/title'), 'Paper 2')
+        version = self.target.get(VERSION_PATH)
+        self.assertIsNotNone(version)
+
+        self.assertEqual(deltaSync(self.source, self.target)['paths'], 0)
+        self.assertEqual(self.target.get(VERSION_PATH), version)
+        self.assertNotIn('Meta', self.target.snapshot())
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import time
+import tempfile
+import unittest
+import requests
+from ExternalAPIs.http_cache import HTTPCache
+
+class TestHTTPCache(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path    = os.path.join(self.tmp_dir.name, 'cache.sqlite')
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    def _response (self, url, content):
+        resp = requests.Response()
+        resp.url         = url
+        resp.status_code = 200
+        resp.headers['Content-Type'] = 'application/json'
+        resp._content    = content
+        return resp
+
+    #----------------------------------------------------
+    # test_CacheKey:
+    # Requests differing only by their method or payload get different keys.
+    #----------------------------------------------------
+    def test_CacheKey (self):
+        url = 'https://api.pennsieve.io/zipit/discover'
+        self.assertEqual(HTTPCache.key('POST', url, b'{"a": 1}'), HTTPCache.key('post', url, '{"a": 1}'))
+        self.assertNotEqual(HTTPCache.key('POST', url, b'{"a": 1}'), HTTPCache.key('POST', url, b'{"a": 2}'))
+        self.assertNotEqual(HTTPCache.key('GET', url), HTTPCache.key('POST', url))
+        return
+
+    #----------------------------------------------------
+    # test_StoreAndExpire:
+    # A stored response is returned as a regular response until its TTL expires.
+    # With stale_while_revalidate, the expired response is still returned but
+    # flagged as stale.
+    #----------------------------------------------------
+    def test_StoreAndExpire (self):
+        url   = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?id=1'
+        cache = HTTPCache(self.path, ttls={'https://eutils.ncbi.nlm.nih.gov/': 0.2})
+        key   = cache.key('GET', url)
+
+        cache.set(key, self._response(url, b'{"result": {"uids": []}}'))
+        resp, is_fresh = cache.get(key)
+        self.assertTrue(is_fresh)
+        self.assertEqual(resp.json(), {'result': {'uids': []}})
+        self.assertEqual(resp.headers['content-type'], 'application/json')
+
+        time.sleep(0.3)
+        self.assertEqual(cache.get(key), (None, False))
+
+        cache.stale_while_revalidate = True
+        resp, is_fresh = cache.get(key)
+        self.assertFalse(is_fresh)
+        self.assertEqual(resp.content, b'{"result": {"uids": []}}')
+        return
+
+    #----------------------------------------------------
+    # test_LRUEviction:
+    # When the cache grows past max_bytes, the least recently used responses go first.
+    #----------------------------------------------------
+    def test_LRUEviction (self):
+        cache = HTTPCache(self.path, max_bytes=25)
+        keys  = [cache.key('GET', f'https://example.org/{i}') for i in range(3)]
+
+        cache.set(keys[0], self._response('https://example.org/0', b'0' * 10))
+        cache.set(keys[1], self._response('https://example.org/1', b'1' * 10))
+        cache.get(keys[0]) # keys[1] is now the least recently used
+        cache.set(keys[2], self._response('https://example.org/2', b'2' * 10))
+
+        self.assertIsNotNone(cache.get(keys[0])[0])
+        self.assertIsNone(cache.get(keys[1])[0])
+        self.assertIsNotNone(cache.get(keys[2])[0])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+from ExternalAPIs.id_crosswalk import IDCrosswalk
+
+class TestIDCrosswalk(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir   = tempfile.TemporaryDirectory()
+        self.crosswalk = IDCrosswalk(os.path.join(self.tmp_dir.name, 'crosswalk.sqlite'))
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    #----------------------------------------------------
+    # test_MergeEntries:
+    # Identifiers learnt separately for the same publication end up in one entry,
+    # which can be looked up by any of them.
+    #----------------------------------------------------
+    def test_MergeEntries (self):
+        self.crosswalk.add(pm_id='32265489', doi='10.1038/s41598-020-63049-y')
+        self.crosswalk.add(pm_id='32265489', pmc_id='PMC7138845')
+
+        entry = self.crosswalk.lookup('pmc_id', '7138845')
+        self.assertEqual(entry['pm_id'], '32265489')
+        self.assertEqual(entry['doi'], '10.1038/s41598-020-63049-y')
+
+        self.assertEqual(self.crosswalk.lookup('doi', '10.1038/s41598-020-63049-y')['pmc_id'], '7138845')
+        self.assertEqual(self.crosswalk.lookup('pmc_id', 'PMC7138845'), entry)
+        return
+
+    #----------------------------------------------------
+    # test_LookupMany:
+    # Unknown ids are left out, and 'complete' tells whether a missing doi is known
+    # to be missing.
+    #----------------------------------------------------
+    def test_LookupMany (self):
+        self.crosswalk.addMany([
+            {'pm_id': '1', 'doi': '10.1/a'},
+            {'pm_id': '2', 'complete': True},
+            {'pm_id': '3'},
+        ])
+
+        found = self.crosswalk.lookupMany('pm_id', ['1', '2', '3', '4'])
+        self.assertEqual(sorted(found), ['1', '2', '3'])
+        self.assertTrue(found['2']['complete'])
+        self.assertIsNone(found['2']['doi'])
+        self.assertFalse(found['3']['complete'])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
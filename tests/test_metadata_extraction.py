@@ -0,0 +1,230 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+import openpyxl
+import requests
+import SPARC.metadata_extraction as SPARC
+from SPARC.dataset_manifest import DatasetManifest
+
+#----------------------------------------------------
+# descriptionFile:
+# Bytes of a dataset_description.xlsx file referencing an article and a protocol.
+#----------------------------------------------------
+def descriptionFile (name):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'Sheet1'
+    sheet.append(['Metadata element', 'Description', 'Example', 'Value'])
+    sheet.append(['Originating Article DOI', 'DOIs of published articles', '', 'https://doi.org/10.1000/' + name])
+    sheet.append(['Protocol URL or DOI', 'URLs of protocols', '', 'https://dx.doi.org/10.17504/protocols.io.' + name])
+    sheet.append(['Keywords', '', '', 'vagus'])
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+class FakeResponse:
+
+    def __init__ (self, data=None, content=b'', status_code=200):
+        self.data        = data
+        self.content     = content
+        self.status_code = status_code
+
+    def json (self):
+        return self.data
+
+    def raise_for_status (self):
+        if (self.status_code >= 400):
+            raise requests.HTTPError(f'{self.status_code} error')
+
+class FakePennsieve:
+
+    #----------------------------------------------------
+    # __init__:
+    # Pennsieve with 'count' datasets at version 1, answering after 'delay' seconds.
+    # The dataset_description files are answered with 'zipit_status'.
+    #----------------------------------------------------
+    def __init__ (self, count, delay=0, zipit_status=200):
+        self.count        = count
+        self.delay        = delay
+        self.zipit_status = zipit_status
+        self.requests     = []
+
+        self._lock   = threading.Lock()
+        self.running = 0
+        self.peak    = 0
+
+    def request (self, method, url, headers=None, params=None, json=None, **kwargs):
+        with self._lock:
+            self.requests.append((method, url.replace('https://api.pennsieve.io', ''), dict(params or {})))
+            self.running += 1
+            self.peak     = max(self.peak, self.running)
+        try:
+            time.sleep(self.delay)
+            return self.respond(url, params or {}, json)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def respond (self, url, params, json):
+        if url.endswith('/discover/search/records'):
+            records = [{'datasetId': i, 'version': 1, 'properties': {'award_id': f'OT2OD0{i}'}} for i in range(self.count)]
+            offset  = params.get('offset', 0)
+            limit   = params.get('limit', 10)
+            return FakeResponse({'totalCount': self.count, 'offset': offset, 'limit': limit, 'records': records[offset:offset + limit]})
+
+        if '/discover/datasets/' in url:
+            i = int(url.rsplit('/', 1)[1])
+            return FakeResponse({
+                'name': f'Dataset {i}', 'description': '', 'version': 1, 'versionPublishedAt': '2021-01-01T00:00:00Z',
+                'doi': f'10.26275/d{i}', 'tags': ['vagus'], 'contributors': [],
+            })
+
+        if url.endswith('/zipit/discover'):
+            if (self.zipit_status != 200):
+                return FakeResponse(status_code=self.zipit_status)
+            return FakeResponse(content=descriptionFile(str(json['data']['datasetId'])))
+
+        raise ValueError(url)
+
+class FakeProtocols:
+
+    #----------------------------------------------------
+    # __init__:
+    # protocols.io with 'count' protocols, every third one without a doi.
+    #----------------------------------------------------
+    def __init__ (self, count):
+        self.count    = count
+        self.requests = []
+        self._lock    = threading.Lock()
+
+    def request (self, method, url, headers=None, params=None, **kwargs):
+        with self._lock:
+            self.requests.append(dict(params))
+
+        page_size = params.get('page_size', 10)
+        page_id   = params.get('page_id', 1)
+        items = [
+            {
+                'id': i, 'title': f'Protocol {i}', 'image': {}, 'uri': f'protocol-{i}', 'stats': {}, 'authors': [],
+                'total_collections': 0, 'number_of_steps': 3, 'url': f'https://www.protocols.io/view/protocol-{i}',
+                'doi': f'dx.doi.org/10.17504/protocols.io.p{i}' if i % 3 else '',
+            }
+            for i in range(self.count)
+        ]
+        return FakeResponse({
+            'items': items[(page_id - 1) * page_size:page_id * page_size],
+            'pagination': {'total_pages': -(-self.count // page_size)},
+        })
+
+class TestMetadataExtraction(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir  = tempfile.TemporaryDirectory()
+        self.manifest = DatasetManifest(os.path.join(self.tmp_dir.name, 'manifest.sqlite'))
+        self.http     = SPARC._http
+
+    def tearDown (self):
+        SPARC._http = self.http
+        self.tmp_dir.cleanup()
+
+    #----------------------------------------------------
+    # test_ConcurrentDatasets:
+    # The datasets are downloaded concurrently and their dataset_description files
+    # parsed in memory, and the list keeps the order of the search.
+    #----------------------------------------------------
+    def test_ConcurrentDatasets (self):
+        SPARC._http = FakePennsieve(6, delay=0.05)
+
+        datasets = SPARC.get_list_of_datasets_with_metadata([], manifest=self.manifest, max_workers=4)
+
+        self.assertEqual([dataset['datasetId'] for dataset in datasets], list(range(6)))
+        self.assertEqual(datasets[2]['datasetDOI'], 'https://dx.doi.org/10.26275/d2')
+        self.assertEqual(datasets[2]['originatingArticleDOI'], ['https://doi.org/10.1000/2'])
+        self.assertEqual(datasets[2]['protocolsDOI'], ['https://dx.doi.org/10.17504/protocols.io.2'])
+        self.assertGreater(SPARC._http.peak, 1)
+        self.assertLessEqual(SPARC._http.peak, 4)
+        self.assertFalse(os.path.exists('dataset_description.xlsx'))
+        return
+
+    #----------------------------------------------------
+    # test_Manifest:
+    # The versions already harvested are yielded first, without any download.
+    #----------------------------------------------------
+    def test_Manifest (self):
+        SPARC._http = FakePennsieve(3)
+        SPARC.get_list_of_datasets_with_metadata([], manifest=self.manifest)
+
+        SPARC._http = FakePennsieve(4)
+        datasets = list(SPARC.iter_datasets_with_metadata(manifest=self.manifest))
+
+        self.assertEqual([dataset['datasetId'] for dataset in datasets], [0, 1, 2, 3])
+        self.assertEqual(datasets[0]['name'], 'Dataset 0')
+        self.assertEqual([url for _, url, _ in SPARC._http.requests if '/search/' not in url],
+                         ['/discover/datasets/3', '/zipit/discover'])
+        return
+
+    #----------------------------------------------------
+    # test_MissingDescription:
+    # A dataset without a dataset_description file (404) is stored as such, but a
+    # failed download raises and leaves the version to be harvested again.
+    #----------------------------------------------------
+    def test_MissingDescription (self):
+        SPARC._http = FakePennsieve(1, zipit_status=404)
+        datasets = list(SPARC.iter_datasets_with_metadata(manifest=self.manifest))
+        self.assertEqual(datasets[0]['protocolsDOI'], [])
+        self.assertEqual(datasets[0]['descriptionErrors'][0]['code'], 'missing')
+        self.assertIsNotNone(self.manifest.get(0, 1))
+
+        manifest = DatasetManifest(os.path.join(self.tmp_dir.name, 'other.sqlite'))
+        SPARC._http = FakePennsieve(1, zipit_status=403)
+        with self.assertRaises(requests.HTTPError):
+            list(SPARC.iter_datasets_with_metadata(manifest=manifest))
+        self.assertIsNone(manifest.get(0, 1))
+        return
+
+    #----------------------------------------------------
+    # test_PagedSearch:
+    # The search records are requested page by page, and only a few pages ahead
+    # of the records being consumed.
+    #----------------------------------------------------
+    def test_PagedSearch (self):
+        SPARC._http = FakePennsieve(250)
+
+        records = list(SPARC.iter_dataset_records())
+        self.assertEqual([record['datasetId'] for record in records], list(range(250)))
+        self.assertEqual(sorted((params['offset'], params['limit']) for _, _, params in SPARC._http.requests),
+                         [(0, 100), (100, 100), (200, 100)])
+
+        SPARC._http = FakePennsieve(1000)
+        records = SPARC.iter_dataset_records(page_size=10, prefetch=2)
+        next(records)
+        records.close()
+        self.assertLessEqual(len(SPARC._http.requests), 3)
+        return
+
+    #----------------------------------------------------
+    # test_Protocols:
+    # Every page is requested once, with the largest page size, and the protocols
+    # without a doi are left out.
+    #----------------------------------------------------
+    def test_Protocols (self):
+        SPARC._http = FakeProtocols(250)
+
+        protocols = SPARC.parsing_protocols('key', max_workers=2)
+        self.assertEqual(sorted(params['page_id'] for params in SPARC._http.requests), [1, 2, 3])
+        self.assertTrue(all(params['page_size'] == SPARC.PROTOCOLS_PAGE_SIZE for params in SPARC._http.requests))
+        self.assertEqual([protocol['id'] for protocol in protocols], [i for i in range(250) if i % 3])
+        self.assertEqual(protocols[0]['doi'], '10.17504/protocols.io.p1')
+
+        # The first page is yielded before the others are requested
+        SPARC._http = FakeProtocols(250)
+        first = next(SPARC.iter_protocols('key'))
+        self.assertEqual(first['id'], 1)
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+from ExternalAPIs.rate_limiter import NCBI_HOST, RateLimiter, applyNCBIRates
+from ExternalAPIs.http_client import parseRetryAfter
+
+class TestRateLimiter(unittest.TestCase):
+
+    #----------------------------------------------------
+    # test_TokenBucket:
+    # A host limited to 2 requests per second gets its first request right away,
+    # and every other request half a second after the previous one, so that no
+    # second holds more than 2 requests. Hosts without a limit never wait.
+    #----------------------------------------------------
+    def test_TokenBucket (self):
+        limiter = RateLimiter({'example.org': 2})
+
+        self.assertEqual(limiter.reserve('example.org'), 0)
+        self.assertAlmostEqual(limiter.reserve('example.org'), 0.5, places=1)
+        self.assertAlmostEqual(limiter.reserve('example.org'), 1.0, places=1)
+
+        self.assertEqual(limiter.reserve('unlimited.org'), 0)
+        return
+
+    #----------------------------------------------------
+    # test_NCBIRates:
+    # A client with an API key raises the NCBI rate of the shared limiter, and a
+    # client without a key created afterwards does not lower it again.
+    #----------------------------------------------------
+    def test_NCBIRates (self):
+        limiter = RateLimiter()
+        self.assertEqual(limiter.getRate(NCBI_HOST), 3)
+
+        applyNCBIRates(limiter, 'key')
+        self.assertEqual(limiter.getRate(NCBI_HOST), 10)
+        applyNCBIRates(limiter)
+        self.assertEqual(limiter.getRate(NCBI_HOST), 10)
+
+        limiter = RateLimiter({})
+        applyNCBIRates(limiter)
+        self.assertEqual(limiter.getRate(NCBI_HOST), 3)
+        return
+
+    #----------------------------------------------------
+    # test_Block:
+    # After the server asks us to back off, requests to that host wait until the
+    # block expires, while other hosts are not affected.
+    #----------------------------------------------------
+    def test_Block (self):
+        limiter = RateLimiter({'example.org': 10})
+        limiter.block('example.org', 5)
+
+        self.assertAlmostEqual(limiter.reserve('example.org'), 5, places=1)
+        self.assertEqual(limiter.reserve('other.org'), 0)
+        return
+
+    #----------------------------------------------------
+    # test_SharedStateFile:
+    # Two limiters using the same state file share one bucket, as two worker
+    # processes would.
+    #----------------------------------------------------
+    def test_SharedStateFile (self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_file = os.path.join(tmp_dir, 'rate_limit.json')
+            limiter_1  = RateLimiter({'example.org': 1}, state_file=state_file)
+            limiter_2  = RateLimiter({'example.org': 1}, state_file=state_file)
+
+            self.assertEqual(limiter_1.reserve('example.org'), 0)
+            self.assertAlmostEqual(limiter_2.reserve('example.org'), 1.0, places=1)
+        return
+
+    #----------------------------------------------------
+    # test_SharedRate:
+    # A shared bucket is refilled at the lowest rate of the processes using it,
+    # e.g. 3 requests per second once a process without an NCBI API key joins one
+    # with a key.
+    #----------------------------------------------------
+    def test_SharedRate (self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_file = os.path.join(tmp_dir, 'rate_limit.json')
+            with_key    = RateLimiter({NCBI_HOST: 10}, state_file=state_file)
+            without_key = RateLimiter({NCBI_HOST: 3}, state_file=state_file)
+
+            self.assertEqual(with_key.reserve(NCBI_HOST), 0)
+            self.assertAlmostEqual(without_key.reserve(NCBI_HOST), 1 / 3, places=1)
+            self.assertAlmostEqual(with_key.reserve(NCBI_HOST), 2 / 3, places=1)
+        return
+
+    #----------------------------------------------------
+    # test_RetryAfter:
+    # Retry-After can be given in seconds or as an HTTP date.
+    #----------------------------------------------------
+    def test_RetryAfter (self):
+        self.assertEqual(parseRetryAfter('3'), 3)
+        self.assertEqual(parseRetryAfter('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+        self.assertIsNone(parseRetryAfter(None))
+        self.assertIsNone(parseRetryAfter('soon'))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
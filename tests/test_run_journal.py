@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from Harvest.run_journal import RunJournal
+
+class TestRunJournal(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path    = os.path.join(self.tmp_dir.name, 'journal.sqlite')
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    #----------------------------------------------------
+    # test_Resume:
+    # A restarted run skips the committed units and gets their results back, but
+    # not the units that were never committed.
+    #----------------------------------------------------
+    def test_Resume (self):
+        journal = RunJournal(self.path)
+        journal.markDone('datasets', 'dataset1', {'award': 'award1'})
+        journal.commit()
+        journal.markDone('datasets', 'dataset2', {'award': 'award2'})
+        self.assertTrue(journal.isDone('datasets', 'dataset2'))
+
+        restarted = RunJournal(self.path)
+        self.assertTrue(restarted.resumed)
+        self.assertEqual(restarted.run_id, journal.run_id)
+        self.assertTrue(restarted.isDone('datasets', 'dataset1'))
+        self.assertEqual(restarted.result('datasets', 'dataset1'), {'award': 'award1'})
+        self.assertFalse(restarted.isDone('datasets', 'dataset2'))
+        self.assertFalse(restarted.isDone('awards', 'dataset1'))
+        return
+
+    #----------------------------------------------------
+    # test_FinishRun:
+    # Once a run is finished, the next one starts from scratch.
+    #----------------------------------------------------
+    def test_FinishRun (self):
+        journal = RunJournal(self.path)
+        journal.markDone('awards', 'award1')
+        journal.finishRun()
+
+        next_run = RunJournal(self.path)
+        self.assertFalse(next_run.resumed)
+        self.assertFalse(next_run.isDone('awards', 'award1'))
+        self.assertEqual(next_run.completed('awards'), 0)
+        return
+
+    #----------------------------------------------------
+    # test_ResumeSameStore:
+    # A run is only resumed against the store it was writing to.
+    #----------------------------------------------------
+    def test_ResumeSameStore (self):
+        local = RunJournal(self.path, store='sqlite:/tmp/graph.sqlite')
+        local.markDone('awards', 'award1')
+        local.commit()
+
+        remote = RunJournal(self.path, store='firebase:https://example.firebaseio.com/user')
+        self.assertFalse(remote.resumed)
+        self.assertNotEqual(remote.run_id, local.run_id)
+        self.assertFalse(remote.isDone('awards', 'award1'))
+
+        restarted = RunJournal(self.path, store='sqlite:/tmp/graph.sqlite')
+        self.assertTrue(restarted.resumed)
+        self.assertEqual(restarted.run_id, local.run_id)
+        self.assertTrue(restarted.isDone('awards', 'award1'))
+        return
+
+if __name__ == '__main__':
+    unittest.main()
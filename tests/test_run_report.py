@@ -0,0 +1,50 @@
+import json
+import unittest
+from ExternalAPIs.http_client import HTTP_STATS
+from Harvest.run_report import RunReport
+
+class TestRunReport(unittest.TestCase):
+
+    #----------------------------------------------------
+    # test_Stages:
+    # Each stage reports its items, and the units that failed are not counted.
+    #----------------------------------------------------
+    def test_Stages (self):
+        report = RunReport()
+        with report.unit('datasets'):
+            pass
+        report.unitStarted('citations')
+        report.unitDone('citations', 200)
+
+        with self.assertRaises(ValueError):
+            with report.unit('datasets'):
+                raise ValueError()
+
+        result = report.build()
+        self.assertEqual(result['stages']['datasets']['items'], 1)
+        self.assertEqual(result['stages']['citations']['items'], 200)
+        self.assertNotIn('awards', result['stages'])
+        json.dumps(result)
+        return
+
+    #----------------------------------------------------
+    # test_HTTPStats:
+    # Only the requests and cache hits recorded during the run are reported.
+    #----------------------------------------------------
+    def test_HTTPStats (self):
+        HTTP_STATS.record('example.org', 'requests', 5)
+
+        report = RunReport()
+        HTTP_STATS.record('example.org', 'requests', 3)
+        HTTP_STATS.record('example.org', 'cache_hits')
+
+        result = report.build()
+        self.assertEqual(result['http']['example.org']['requests'], 3)
+        self.assertEqual(result['http']['example.org']['cache_hits'], 1)
+        self.assertEqual(result['cache']['hits'], 1)
+        self.assertEqual(result['cache']['requests_sent'], 3)
+        self.assertEqual(result['cache']['hit_rate'], 0.25)
+        return
+
+if __name__ == '__main__':
+    unittest.main()
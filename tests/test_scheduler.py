@@ -0,0 +1,84 @@
+import time
+import threading
+import unittest
+from Harvest.scheduler import BatchQueue, Scheduler
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp (self):
+        self.scheduler = Scheduler(max_workers=8, limits={'host': 2})
+
+    def tearDown (self):
+        self.scheduler.shutdown()
+
+    #----------------------------------------------------
+    # test_ResourceLimit:
+    # Tasks submitted by tasks are waited for, and no more than the limit of a
+    # resource run at once.
+    #----------------------------------------------------
+    def test_ResourceLimit (self):
+        lock    = threading.Lock()
+        running = [0, 0] # running now, most running at once
+        done    = []
+
+        def fetch (i):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            done.append(i)
+
+        def parse ():
+            for i in range(6):
+                self.scheduler.submit(fetch, i, resource='host')
+
+        self.scheduler.submit(parse)
+        self.scheduler.wait()
+
+        self.assertEqual(sorted(done), list(range(6)))
+        self.assertEqual(running[1], 2)
+        self.assertEqual(self.scheduler.stats['host']['tasks'], 6)
+        return
+
+    #----------------------------------------------------
+    # test_WhenAll:
+    # The callback runs once every task succeeded, and not if one failed. The
+    # error is raised by wait.
+    #----------------------------------------------------
+    def test_WhenAll (self):
+        called = []
+        def fail ():
+            raise ValueError('failed')
+
+        self.scheduler.whenAll([self.scheduler.submit(time.sleep, 0.01) for _ in range(3)], lambda: called.append('ok'))
+        self.scheduler.whenAll([self.scheduler.submit(time.sleep, 0.01), self.scheduler.submit(fail)], lambda: called.append('failed'))
+
+        with self.assertRaises(ValueError):
+            self.scheduler.wait()
+        self.assertEqual(called, ['ok'])
+        return
+
+    #----------------------------------------------------
+    # test_BatchQueue:
+    # Full batches are submitted right away, and the last partial batch when the
+    # scheduler runs out of tasks.
+    #----------------------------------------------------
+    def test_BatchQueue (self):
+        batches = []
+        queue   = BatchQueue(self.scheduler, batches.append, batch_size=3, resource='host')
+
+        def produce ():
+            for i in range(7):
+                queue.add(i)
+
+        self.scheduler.submit(produce)
+        self.scheduler.wait()
+
+        self.assertEqual(sorted(len(b) for b in batches), [1, 3, 3])
+        self.assertEqual(sorted(i for b in batches for i in b), list(range(7)))
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import sqlite3
+import requests
+import tempfile
+import unittest
+from contextlib import closing
+from ExternalAPIs.http_cache import HTTPCache, buildResponse
+import ExternalAPIs.scholar_api as scholar_api
+from ExternalAPIs.scholar_api import ScholarAPI, ScholarBudgetExceeded, SearchBudget, getcitationandpubinfo
+
+#----------------------------------------------------
+# scholarResult:
+# Google Scholar result 'i', citing a paper published in a journal in 2020.
+#----------------------------------------------------
+def scholarResult (i):
+    return {
+        'position': i,
+        'title': f'Paper {i}',
+        'link': f'https://doi.org/10.1000/P{i}' if i % 2 == 0 else f'https://example.org/paper{i}.pdf',
+        'publication_info': {'summary': f'A Author{i}, B Author - Journal of Nerves, 2020 - example.org'},
+        'inline_links': {'cited_by': {'cites_id': str(1000 + i), 'total': i}},
+    }
+
+class FakeSerpAPI:
+
+    #----------------------------------------------------
+    # __init__:
+    # SerpAPI answering with 'count' citers of any paper, 20 per page.
+    #----------------------------------------------------
+    def __init__ (self, count):
+        self.count    = count
+        self.requests = []
+
+    def get (self, url, params=None, **kwargs):
+        self.requests.append(dict(params))
+
+        start  = params.get('start', 0)
+        num    = params.get('num', 10)
+        result = {'organic_results': [scholarResult(i) for i in range(start, min(start + num, self.count))]}
+        if (start + num < self.count):
+            result['serpapi_pagination'] = {'next': f'https://scholar.google.com/scholar?start={start + num}'}
+        return buildResponse(url, 200, {'Content-Type': 'application/json'}, json.dumps(result).encode())
+
+class TestScholarAPI(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache   = HTTPCache(os.path.join(self.tmp_dir.name, 'cache.sqlite'))
+        self.budget  = SearchBudget(os.path.join(self.tmp_dir.name, 'budget.sqlite'), monthly_limit=5)
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    def client (self, count):
+        scholar = ScholarAPI('key', cache=self.cache, budget=self.budget)
+        scholar._http = FakeSerpAPI(count)
+        return scholar
+
+    #----------------------------------------------------
+    # test_CitingPages:
+    # Every page of citers is read, and each result becomes a paper record.
+    #----------------------------------------------------
+    def test_CitingPages (self):
+        scholar = self.client(45)
+
+        records = scholar.getCitingPapers('1234')
+        self.assertEqual([params['start'] for params in scholar._http.requests], [0, 20, 40])
+        self.assertEqual(len(records), 45)
+        self.assertEqual(records[2], {
+            'title': 'Paper 2', 'journal': 'Journal of Nerves', 'year': '2020', 'author_list': 'A Author2, B Author',
+            'doi': '10.1000/P2', 'cites_id': '1002', 'cited_by': 2,
+        })
+
+        cited_by = scholar.getCitedBy('1234')
+        self.assertEqual(len(cited_by), 23)
+        self.assertEqual(cited_by['10.1000/P44']['title'], 'Paper 44')
+        return
+
+    #----------------------------------------------------
+    # test_CacheAndBudget:
+    # Cached searches are neither sent nor counted, and a search past the monthly
+    # budget is refused.
+    #----------------------------------------------------
+    def test_CacheAndBudget (self):
+        scholar = self.client(45)
+        scholar.getCitingPapers('1234')
+        scholar.getCitingPapers('1234')
+        self.assertEqual(len(scholar._http.requests), 3)
+        self.assertEqual(self.budget.used(), 3)
+        with closing(sqlite3.connect(self.cache.path)) as conn:
+            self.assertTrue(all('api_key' not in url for url, in conn.execute('SELECT url FROM responses')))
+
+        scholar = self.client(45)
+        scholar.search({'q': '10.1000/a'})
+        scholar.search({'q': '10.1000/b'})
+        self.assertEqual(self.budget.remaining(), 0)
+        with self.assertRaises(ScholarBudgetExceeded):
+            scholar.search({'q': '10.1000/c'})
+        self.assertEqual(len(scholar._http.requests), 2)
+
+        # the budget starts again the next month
+        self.assertEqual(self.budget.used(now=time.time() + 32 * 24 * 60 * 60), 0)
+        return
+
+    #----------------------------------------------------
+    # test_FailedSearch:
+    # A search that SerpAPI did not answer is not charged to the budget.
+    #----------------------------------------------------
+    def test_FailedSearch (self):
+        scholar = self.client(45)
+        scholar._http.get = lambda url, params=None, **kwargs: buildResponse(url, 500, {}, b'')
+
+        with self.assertRaises(requests.HTTPError):
+            scholar.search({'q': '10.1000/a'})
+        self.assertEqual(self.budget.used(), 0)
+        return
+
+    #----------------------------------------------------
+    # test_CitationAndPubInfo:
+    # Every organic result is parsed, not only the first one.
+    #----------------------------------------------------
+    def test_CitationAndPubInfo (self):
+        results = {'organic_results': [scholarResult(i) for i in range(3)]}
+
+        record = getcitationandpubinfo(results)
+        self.assertEqual(sorted(record), [0, 1, 2])
+        self.assertEqual(record[1]['cites_id'], '1001')
+        return
+
+    #----------------------------------------------------
+    # test_SharedClient:
+    # The module functions reuse one client per api key.
+    #----------------------------------------------------
+    def test_SharedClient (self):
+        scholar = self.client(25)
+        scholar_api._shared_clients['key'] = scholar
+        try:
+            self.assertIs(scholar_api.getSharedScholarAPI('key'), scholar)
+
+            scholar_api.get_fromoriginatingdoi('10.1000/P0', 'key')
+            result = scholar_api.get_fromcitesid('1000', 'key')
+            self.assertEqual(len(result['organic_results']), 25)
+            self.assertEqual(len(scholar._http.requests), 3)
+        finally:
+            scholar_api._shared_clients.pop('key', None)
+        return
+
+if __name__ == '__main__':
+    unittest.main()
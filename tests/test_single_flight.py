@@ -0,0 +1,105 @@
+import time
+import threading
+import unittest
+from ExternalAPIs.single_flight import SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp (self):
+        self.single_flight = SingleFlight()
+        self.executed      = []
+
+    def fetch (self, key):
+        self.executed.append(key)
+        time.sleep(0.05)
+        return {'key': key, 'values': []}
+
+    #----------------------------------------------------
+    # test_CompletedCall:
+    # A repeated call reuses the result of the first one, and every caller gets
+    # its own copy of it.
+    #----------------------------------------------------
+    def test_CompletedCall (self):
+        first = self.single_flight.do('fetch', 'a', lambda: self.fetch('a'))
+        first['values'].append(1)
+        second = self.single_flight.do('fetch', 'a', lambda: self.fetch('a'))
+
+        self.assertEqual(self.executed, ['a'])
+        self.assertEqual(second, {'key': 'a', 'values': []})
+        self.assertEqual(self.single_flight.getStats()['fetch'], {'calls': 2, 'executed': 1, 'hits': 1, 'waits': 0})
+        return
+
+    #----------------------------------------------------
+    # test_InFlightCall:
+    # Calls made from several threads while the first one is in flight wait for its result.
+    #----------------------------------------------------
+    def test_InFlightCall (self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.single_flight.do('fetch', 'a', lambda: self.fetch('a'))))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.executed, ['a'])
+        self.assertEqual(len(results), 5)
+        stats = self.single_flight.getStats()['fetch']
+        self.assertEqual(stats['executed'], 1)
+        self.assertEqual(stats['hits'] + stats['waits'], 4)
+        return
+
+    #----------------------------------------------------
+    # test_DoMany:
+    # Only the keys not seen before are passed to the batch function.
+    #----------------------------------------------------
+    def test_DoMany (self):
+        batches = []
+        def fetchMany (keys):
+            batches.append(keys)
+            return {key: key.upper() for key in keys if key != 'c'}
+
+        self.assertEqual(self.single_flight.doMany('fetch', ['a', 'b'], fetchMany), {'a': 'A', 'b': 'B'})
+        self.assertEqual(self.single_flight.doMany('fetch', ['b', 'c', 'c'], fetchMany), {'b': 'B', 'c': None})
+        self.assertEqual(batches, [['a', 'b'], ['c']])
+        self.assertEqual(self.single_flight.getStats()['fetch']['hits'], 1)
+        return
+
+    #----------------------------------------------------
+    # test_FailedCall:
+    # A failed call is not remembered, so it is executed again the next time.
+    #----------------------------------------------------
+    def test_FailedCall (self):
+        def fail ():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            self.single_flight.do('fetch', 'a', fail)
+        self.assertEqual(self.single_flight.do('fetch', 'a', lambda: self.fetch('a'))['key'], 'a')
+        self.assertEqual(self.executed, ['a'])
+        return
+
+    #----------------------------------------------------
+    # test_EmptyResult:
+    # An empty result, as returned by a failed lookup, is not remembered.
+    #----------------------------------------------------
+    def test_EmptyResult (self):
+        results = [{}, {'key': 'a'}]
+        self.assertEqual(self.single_flight.do('fetch', 'a', lambda: results.pop(0)), {})
+        self.assertEqual(self.single_flight.do('fetch', 'a', lambda: results.pop(0)), {'key': 'a'})
+        self.assertEqual(self.single_flight.do('fetch', 'a', lambda: results.pop(0)), {'key': 'a'})
+
+        batches = []
+        def fetchMany (keys):
+            batches.append(keys)
+            return {key: key.upper() for key in keys if len(batches) > 1 or key != 'c'}
+
+        self.single_flight.doMany('fetchMany', ['b', 'c'], fetchMany)
+        self.assertEqual(self.single_flight.doMany('fetchMany', ['b', 'c'], fetchMany), {'b': 'B', 'c': 'C'})
+        self.assertEqual(batches, [['b', 'c'], ['c']])
+        return
+
+if __name__ == '__main__':
+    unittest.main()
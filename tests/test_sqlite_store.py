@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from GraphStore.graph_store import GraphStore, copyGraph
+from GraphStore.sqlite_store import SQLiteStore
+
+class TestSQLiteStore(unittest.TestCase):
+
+    def setUp (self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store   = SQLiteStore(os.path.join(self.tmp_dir.name, 'graph.sqlite'))
+
+    def tearDown (self):
+        self.tmp_dir.cleanup()
+
+    #----------------------------------------------------
+    # test_IncompleteStore:
+    # A backend missing get or bulkUpdate cannot be created.
+    #----------------------------------------------------
+    def test_IncompleteStore (self):
+        class ReadOnlyStore(GraphStore):
+            def get(self, path):
+                return None
+
+        with self.assertRaises(TypeError):
+            ReadOnlyStore()
+        return
+
+    #----------------------------------------------------
+    # test_GetAndUpdate:
+    # Records and their fields can be read and written at any depth, and updating
+    # a record only changes the given fields.
+    #----------------------------------------------------
+    def test_GetAndUpdate (self):
+        self.store.update('Papers', {'paper1': {'title': 'Paper 1', 'datasets': ['dataset1']}})
+        self.store.update('Papers/paper1', {'citations': 3})
+        self.store.bulkUpdate({'Papers/paper1/datasets': ['dataset1', 'dataset2'], 'Awards/award1': {'amount': 10}})
+
+        self.assertEqual(self.store.get('Papers/paper1'), {'title': 'Paper 1', 'datasets': ['dataset1', 'dataset2'], 'citations': 3})
+        self.assertEqual(self.store.get('Papers/paper1/datasets/1'), 'dataset2')
+        self.assertEqual(self.store.get('Awards'), {'award1': {'amount': 10}})
+        self.assertIsNone(self.store.get('Papers/paper2'))
+        self.assertEqual(self.store.snapshot('Protocols'), {})
+        return
+
+    #----------------------------------------------------
+    # test_Delete:
+    # As in Firebase, writing None or an empty value deletes it.
+    #----------------------------------------------------
+    def test_Delete (self):
+        self.store.update('Papers', {'paper1': {'title': 'Paper 1', 'datasets': ['dataset1']}, 'paper2': {'title': 'Paper 2'}})
+        self.store.bulkUpdate({'Papers/paper1/datasets': [], 'Papers/paper2/title': None})
+
+        self.assertEqual(self.store.snapshot('Papers'), {'paper1': {'title': 'Paper 1'}})
+        return
+
+    #----------------------------------------------------
+    # test_CopyGraph:
+    # Every record of a store can be copied to another one.
+    #----------------------------------------------------
+    def test_CopyGraph (self):
+        self.store.update('Datasets', {'dataset1': {'name': 'Dataset 1'}})
+        self.store.update('Papers', {f'paper{i}': {'title': str(i)} for i in range(5)})
+
+        target = SQLiteStore(os.path.join(self.tmp_dir.name, 'target.sqlite'))
+        self.assertEqual(copyGraph(self.store, target, batch_size=2), 6)
+        self.assertEqual(target.snapshot(), self.store.snapshot())
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from GraphStore.graph_store import GraphStore
+from GraphStore.write_buffer import WriteBuffer
+
+#----------------------------------------------------
+# RecordingStore:
+# GraphStore recording the reads and writes sent to it.
+#----------------------------------------------------
+class RecordingStore(GraphStore):
+
+    def __init__ (self, database):
+        self.database = database
+        self.reads    = []
+        self.writes   = []
+
+    def get (self, path):
+        self.reads.append(path)
+        return self.database.get(path)
+
+    def bulkUpdate (self, updates):
+        self.writes.append(dict(updates))
+
+class TestWriteBuffer(unittest.TestCase):
+
+    def setUp (self):
+        self.store = RecordingStore({
+            'Papers': {
+                'paper1': {'title': 'Paper 1', 'datasets': ['dataset1']},
+            },
+        })
+        self.buffer = WriteBuffer(self.store, batch_size=3)
+
+    #----------------------------------------------------
+    # test_MergePaper:
+    # New papers are written whole, and the edges of existing papers are merged
+    # without duplicates. The Papers node is read only once.
+    #----------------------------------------------------
+    def test_MergePaper (self):
+        self.buffer.mergePaper('paper1', 'datasets', {'title': 'Paper 1', 'datasets': ['dataset1', 'dataset2']})
+        self.buffer.mergePaper('paper1', 'datasets', {'title': 'Paper 1', 'datasets': ['dataset2']})
+        self.buffer.mergePaper('paper1', 'awards', {'title': 'Paper 1', 'awards': ['award1']})
+        self.buffer.mergePaper('paper2', 'datasets', {'title': 'Paper 2', 'datasets': ['dataset1']})
+        self.buffer.flush()
+
+        self.assertEqual(self.store.reads, ['Papers'])
+        self.assertEqual(self.store.writes, [{
+            'Papers/paper1/datasets': ['dataset1', 'dataset2'],
+            'Papers/paper1/awards': ['award1'],
+            'Papers/paper2': {'title': 'Paper 2', 'datasets': ['dataset1']},
+        }])
+        return
+
+    #----------------------------------------------------
+    # test_NestedPaths:
+    # A write below a pending path is folded into it, since a multi-path update
+    # cannot contain a path and its ancestor.
+    #----------------------------------------------------
+    def test_NestedPaths (self):
+        self.buffer.mergePaper('paper2', 'datasets', {'title': 'Paper 2', 'datasets': ['dataset1']})
+        self.buffer.mergePaper('paper2', 'datasets', {'title': 'Paper 2', 'datasets': ['dataset2']})
+        self.buffer.update('Papers/paper2/citations', 4)
+        self.buffer.flush()
+
+        self.assertEqual(self.store.writes, [{
+            'Papers/paper2': {'title': 'Paper 2', 'datasets': ['dataset1', 'dataset2'], 'citations': 4},
+        }])
+        self.assertEqual(self.buffer.get('Papers/paper2/citations'), 4)
+        return
+
+    #----------------------------------------------------
+    # test_BatchSize:
+    # The buffer is flushed every time 'batch_size' paths are pending.
+    #----------------------------------------------------
+    def test_BatchSize (self):
+        for i in range(7):
+            self.buffer.update(f'Datasets/dataset{i}', {'name': str(i)})
+
+        self.assertEqual([len(w) for w in self.store.writes], [3, 3])
+        self.buffer.flush()
+        self.assertEqual([len(w) for w in self.store.writes], [3, 3, 1])
+        return
+
+    #----------------------------------------------------
+    # test_FlushListener:
+    # Listeners are called after every flush, once the writes are stored.
+    #----------------------------------------------------
+    def test_FlushListener (self):
+        stored = []
+        self.buffer.addFlushListener(lambda: stored.append(len(self.store.writes)))
+
+        self.buffer.update('Datasets/dataset1', {'name': '1'})
+        self.assertEqual(stored, [])
+        self.buffer.flush()
+        self.assertEqual(stored, [1])
+        return
+
+if __name__ == '__main__':
+    unittest.main()